@@ -8,6 +8,7 @@
 
 # Import libraries
 from pyindi import *
+from indi_profiler import profiler
 import time
 import numpy as flx
 import numpy as pixels
@@ -15,6 +16,7 @@ import matplotlib
 matplotlib.use('QT4Agg')
 import matplotlib.pyplot as plt
 import warnings
+from photometry_tools import Photometry
 
 
 # Ignore deprecation warnings
@@ -29,7 +31,7 @@ with warnings.catch_warnings():
 t0 = time.time()
 
 #pi is an instance of PyINDI. Here we connect to the server
-pi=PyINDI(verbose=False)
+pi=profiler.wrap(PyINDI(verbose=False))   # records the INDI round trips, see indi_profiler
 
 # Define running parameters
 n_img    = 1      # number of images averaged for flux computation
@@ -44,6 +46,12 @@ y        = 76      # y position of the star
 w        = 20      # in pixels, the width of the cropped image (around the null)
 h        = w       # in pixels, the height of the cropped image (around the null)
 
+# Null and background regions up and down (precomputed once, see photometry_tools)
+phot = Photometry()
+phot.box('null', y-0.5*h, x-0.5*w, h, w)
+phot.box('up', y+0.5*h, x-0.5*w, h, w)
+phot.box('down', y-1.5*h, x-0.5*w, h, w)
+
 # define opd steps (degrees)
 opd_step = wav
 opd2deg  = 360/wav
@@ -97,12 +105,8 @@ for i in range(n_stp):
 			f      = pi.getFITS("NOMIC.DisplayImage.File", "NOMIC.GetDisplayImage.Now")
 			pixels = f[0].data
 
-			# Extract background regions up and down
-			roi_up = pi.cutRegion(pixels,y+0.5*h,x-0.5*w,h,w)
-			roi_dw = pi.cutRegion(pixels,y-1.5*h,x-0.5*w,h,w)
-		
-			# Extract sub-array
-			roi = pi.cutRegion(pixels,y-0.5*h,x-0.5*w,h,w)		
+			# Sub-array for display (a view, not a copy)
+			roi = phot.cut(pixels, 'null')
 			tam = roi.shape
 			
 			# Prepare display	
@@ -119,7 +123,7 @@ for i in range(n_stp):
 			time.sleep(0.001)
 			
 			# Compute total flux (iteration i, side j)
-			avg[i,j] = roi.mean()-0.5*(roi_up.mean()+roi_dw.mean())
+			avg[i,j] = phot.flux(pixels, 'null', ['up', 'down'], statistic='mean')
 			#print('Flux AVG = %d %d' % avg[0] avg[1]) 
 		else:
 			rois = pi.getKeys (device='NOMIC', prop='ROIStats', key='ID', nunique=3)
@@ -177,5 +181,8 @@ t1 = time.time()-t0
 print("Time to optimize setpoint: %fs" % (t1))
 print(" ")
 
+# Print the INDI round trips of this run (see indi_profiler)
+profiler.report()
+
 #Now pause 
 input("Press 1")
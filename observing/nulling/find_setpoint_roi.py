@@ -12,6 +12,7 @@
 
 # Import libraries
 from pyindi import *
+from indi_profiler import profiler
 import time
 import numpy as flx
 import numpy as pixels
@@ -33,7 +34,7 @@ with warnings.catch_warnings():
 t0 = time.time()
 
 #pi is an instance of PyINDI. Here we connect to the server
-pi=PyINDI(verbose=False)
+pi=profiler.wrap(PyINDI(verbose=False))   # records the INDI round trips, see indi_profiler
 
 # Define running parameters
 n_img    = 10         # number of images averaged for flux computation
@@ -156,5 +157,8 @@ t1 = time.time()-t0
 print("Time to optimize setpoint: %fs" % (t1))
 print(" ")
 
+# Print the INDI round trips of this run (see indi_profiler)
+profiler.report()
+
 #Now pause 
 input("Press 1")
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# The INDI round-trip profiler of nomops (see nulling_steve/profile_tools.py), for the standalone scripts of this
+# directory, which do not use the nomops session: wrap the PyINDI instance and print the report at the end.
+#
+# Usage:
+#  >> from indi_profiler import profiler
+#  >> pi = profiler.wrap(PyINDI(verbose=False))
+#  >> ...
+#  >> profiler.report()
+
+nulling_steve = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nulling_steve')
+if nulling_steve not in sys.path:
+  sys.path.append(nulling_steve)   # after this directory, so that its scripts are not shadowed
+from profile_tools import profiler
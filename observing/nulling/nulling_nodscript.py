@@ -32,14 +32,13 @@ pi=PyINDI(verbose=False)
 # Define AO waiting function
 def wait4AOrunning():
 	while True:
-		pi.setINDI("LBTO.Dictionary.Name=L_AOStatus;Value=")
-		lstatus = pi.getINDI("LBTO.Dictionary.Value")
-		pi.setINDI("LBTO.Dictionary.Name=R_AOStatus;Value=")
-		rstatus = pi.getINDI("LBTO.Dictionary.Value")
+		status  = pi.getINDI("LBTO.AOStatus.*")   # both sides in one request
+		lstatus = status["LBTO.AOStatus.L_AOStatus"]
+		rstatus = status["LBTO.AOStatus.R_AOStatus"]
 		print lstatus, rstatus
-		time.sleep(0.02)
 		if rstatus == "AORunning" and lstatus == "AORunning":
 			break
+		time.sleep(0.1)
 
 # Running parameters
 n_nod     = 1     # Number of nod pairs before the photometry
@@ -3,12 +3,14 @@
 #DD-140207
 
 from pyindi import *
+from indi_profiler import profiler
 import numpy as flx
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
+from photometry_tools import Photometry
 
 #pi is an instance of PyINDI. Here we connect to the lmircam server
-pi=PyINDI(verbose=False)
+pi=profiler.wrap(PyINDI(verbose=False))   # records the INDI round trips, see indi_profiler
 
 # Define running parameters
 n_img    = 50      # number of images averaged for flux computation
@@ -20,6 +22,11 @@ h        = 20      # in pixels, the height of the cropped image (around the null
 gain_stp = 50
 gain_stp2 = 0.1
 
+# Star and background regions (precomputed once, see photometry_tools)
+phot = Photometry()
+phot.box('star', r-0.5*h, c-0.5*w, h, w)
+phot.box('background', r+0.5*h, c-0.5*w, h, w)
+
 #Get initial INDI values
 #pi.setINDI("Ubcs.SPC_TRANS.command=5")		
 settings  = pi.getINDI('PLC.UBCSettings.*')
@@ -61,18 +68,8 @@ for k in range(n_img):
 	f      = pi.getFITS("NOMIC.DisplayImage.File", "NOMIC.GetDisplayImage.Now")
 	pixels = f[0].data
 
- 	# Extract background region
-	roi2 = pi.cutRegion(pixels,r+0.5*h,c-0.5*w,h,w)
-
-	# Extract sub-array
-	roi = pi.cutRegion(pixels,r-0.5*h,c-0.5*w,h,w)
-	i#mgplot = plt.imshow(roi)
-
-	# Compute total flux over the extracted region
-	flx[k] = roi.sum()-roi2.sum()
-
-	# Compute total flux over the extracted region
-	flx[k] = roi.sum()
+	# Compute total flux over the star region
+	flx[k] = phot.fluxes(pixels)[0]
 
 # Compute mean and rms of flux
 avg_now = flx.mean()		
@@ -101,15 +98,8 @@ for i in range(2):
 			f      = pi.getFITS("NOMIC.DisplayImage.File", "NOMIC.GetDisplayImage.Now")
 			pixels = f[0].data
 
-			 # Extract background region
-			roi2 = pi.cutRegion(pixels,r+0.5*h,c-0.5*w,h,w)
-			
-			# Extract sub-array
-			roi = pi.cutRegion(pixels,r-0.5*h,c-0.5*w,h,w)
-			i#mgplot = plt.imshow(roi)
-		
-			# Compute total flux over the extracted region
-			flx[k] = roi.sum()-roi2.sum()
+			# Compute total flux over the star region minus the background region
+			flx[k] = phot.flux(pixels, 'star', ['background'])
 
 		# Compute mean and rms of flux
 		avg_now = flx.mean()		
@@ -126,3 +116,6 @@ print('  ')
 # Going back to null
 print('Going back to destructive interference')
 settings['PLC.UBCSettings.CGSetpoint'] = setpoint0
+
+# Print the INDI round trips of this run (see indi_profiler)
+profiler.report()
@@ -3,12 +3,14 @@
 #DD-140207
 
 from pyindi import *
+from indi_profiler import profiler
 import numpy as flx
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
+from photometry_tools import Photometry
 
 #pi is an instance of PyINDI. Here we connect to the lmircam server
-pi=PyINDI(verbose=False)
+pi=profiler.wrap(PyINDI(verbose=False))   # records the INDI round trips, see indi_profiler
 
 # Define running parameters
 n_img    = 50      # number of images averaged for flux computation
@@ -20,6 +22,10 @@ h        = 25      # in pixels, the height of the cropped image (around the null
 gain_stp = 10
 gain_stp2 = 0.03
 
+# Star region (precomputed once, see photometry_tools)
+phot = Photometry()
+phot.box('star', r-0.5*w, c-0.5*h, w, h)
+
 # define setpoint steps (0.1 ~ 5um)
 setpoint_step = 0.30
 
@@ -65,11 +71,8 @@ for k in range(n_img):
 	f      = pi.getFITS("NOMIC.DisplayImage.File", "NOMIC.GetDisplayImage.Now")
 	pixels = f[0].data
 
-	# Extract sub-array
-	roi = pi.cutRegion(pixels,r-0.5*w,c-0.5*h,w,h)
-
-	# Compute total flux over the extracted region
-	flx[k] = roi.sum()
+	# Compute total flux over the star region
+	flx[k] = phot.fluxes(pixels)[0]
 
 # Compute mean and rms of flux
 avg_now = flx.mean()		
@@ -102,11 +105,8 @@ for i in range(2):
 			f      = pi.getFITS("NOMIC.DisplayImage.File", "NOMIC.GetDisplayImage.Now")
 			pixels = f[0].data
 
-			# Extract sub-array
-			roi = pi.cutRegion(pixels,r-0.5*w,c-0.5*h,w,h)
-
-			# Compute total flux over the extracted region
-			flx[k] = roi.sum()
+			# Compute total flux over the star region
+			flx[k] = phot.fluxes(pixels)[0]
 
 		# Compute mean and rms of flux
 		avg_now = flx.mean()		
@@ -122,4 +122,7 @@ print('  ')
 
 # Going back to null
 print('Going back to destructive interference')
-settings['PLC.UBCSettings.CGSetpoint'] = setpoint0
\ No newline at end of file
+settings['PLC.UBCSettings.CGSetpoint'] = setpoint0
+
+# Print the INDI round trips of this run (see indi_profiler)
+profiler.report()
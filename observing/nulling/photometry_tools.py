@@ -0,0 +1,146 @@
+import numpy as np
+
+class Photometry(object):
+  """
+  ROI photometry on NOMIC images without cutting out copies of the ROIs.
+  The regions (boxes as for pi.cutRegion, circular apertures, annuli)
+  are defined once; compile() precomputes the bounding box of all
+  regions and one weight mask per region inside it. fluxes() then takes
+  a view of the bounding box (no copy of the frame) and computes the
+  sums of all regions in one product with the stacked masks, for one
+  frame or for a stack of frames (n_frames, ny, nx) at once.
+
+  Boxes use the same arguments as pi.cutRegion(pixels, row, col, h, w),
+  i.e., the box starts at (int(row), int(col)). Apertures and annuli
+  are centered on (row, col) and contain the pixels whose centers are
+  within their radii.
+
+  Usage:
+   >> phot = Photometry()
+   >> phot.box('star', y-0.5*h, x-0.5*w, h, w)
+   >> phot.box('up', y+0.5*h, x-0.5*w, h, w)
+   >> phot.box('down', y-1.5*h, x-0.5*w, h, w)
+   >> null = phot.flux(pixels, 'star', ['up', 'down'], statistic='mean')
+   >> sums = phot.fluxes(cube)     # (n_frames, n_regions), columns in phot.names
+  """
+
+  def __init__(self):
+    self.names = []
+    self.regions = []     # (kind, parameters), in the order of self.names
+    self.masks = None     # (n_regions, ny, nx) weights in the bounding box, see compile()
+
+  def _add(self, name, kind, parameters):
+    if name in self.names:
+      raise ValueError('region %s is already defined' % (name))
+    self.names.append(name)
+    self.regions.append((kind, parameters))
+    self.masks = None
+
+  def box(self, name, row, col, h, w):
+    """
+    Adds a box of h x w pixels starting at (row, col), as cut out by
+    pi.cutRegion(pixels, row, col, h, w).
+    """
+    self._add(name, 'box', (int(row), int(col), int(h), int(w)))
+
+  def aperture(self, name, row, col, radius):
+    """
+    Adds a circular aperture of a radius (in pixels) around (row, col).
+    """
+    self._add(name, 'annulus', (float(row), float(col), 0.0, float(radius)))
+
+  def annulus(self, name, row, col, r_in, r_out):
+    """
+    Adds an annulus between r_in (excluded) and r_out (included) around
+    (row, col), e.g., for the background around an aperture.
+    """
+    self._add(name, 'annulus', (float(row), float(col), float(r_in), float(r_out)))
+
+  def _extent(self, kind, parameters):
+    if kind == 'box':
+      row, col, h, w = parameters
+      return row, row + h, col, col + w
+    row, col, r_in, r_out = parameters
+    return (int(np.floor(row - r_out)), int(np.ceil(row + r_out)) + 1,
+            int(np.floor(col - r_out)), int(np.ceil(col + r_out)) + 1)
+
+  def compile(self):
+    """
+    Precomputes the bounding box of all regions and their masks. Called
+    by the first fluxes() after the regions changed.
+    """
+    if len(self.regions) == 0:
+      raise ValueError('no regions defined')
+    extents = np.array([self._extent(kind, parameters) for kind, parameters in self.regions])
+    self.y0, self.x0 = max(0, extents[:,0].min()), max(0, extents[:,2].min())
+    self.y1, self.x1 = extents[:,1].max(), extents[:,3].max()
+    rows, cols = np.mgrid[self.y0:self.y1, self.x0:self.x1]
+    self.masks = np.zeros((len(self.regions), self.y1 - self.y0, self.x1 - self.x0))
+    for i in range(len(self.regions)):
+      kind, parameters = self.regions[i]
+      if kind == 'box':
+        row, col, h, w = parameters
+        self.masks[i, max(0, row - self.y0):row + h - self.y0, max(0, col - self.x0):col + w - self.x0] = 1.0
+      else:
+        row, col, r_in, r_out = parameters
+        r2 = (rows - row)**2 + (cols - col)**2
+        self.masks[i] = (r2 <= r_out**2) & ((r_in == 0.0) | (r2 > r_in**2))
+    self.areas = self.masks.sum(axis=2).sum(axis=1)
+    if np.any(self.areas == 0):
+      empty = [self.names[i] for i in np.flatnonzero(self.areas == 0)]
+      raise ValueError('regions %s contain no pixels' % (', '.join(empty)))
+
+  def view(self, frames):
+    """
+    Returns the bounding box of all regions in a frame or a stack of
+    frames, as a view (not a copy).
+    """
+    if self.masks is None:
+      self.compile()
+    frames = np.asarray(frames)
+    if (frames.shape[-2] < self.y1) or (frames.shape[-1] < self.x1):
+      raise ValueError('regions extend to (%i, %i), beyond the frame (%i, %i)'
+                       % (self.y1, self.x1, frames.shape[-2], frames.shape[-1]))
+    return frames[..., self.y0:self.y1, self.x0:self.x1]
+
+  def cut(self, frame, name):
+    """
+    Returns the bounding box of one region in a frame as a view, e.g.,
+    for display.
+    """
+    if self.masks is None:
+      self.compile()
+    i = self.names.index(name)
+    rows = np.flatnonzero(self.masks[i].any(axis=1))
+    cols = np.flatnonzero(self.masks[i].any(axis=0))
+    return np.asarray(frame)[..., self.y0 + rows[0]:self.y0 + rows[-1] + 1, self.x0 + cols[0]:self.x0 + cols[-1] + 1]
+
+  def fluxes(self, frames, statistic='sum'):
+    """
+    Returns the flux of all regions ('sum' or 'mean' over their pixels)
+    in a frame (array of n_regions) or in a stack of frames (array of
+    n_frames x n_regions), in the order of self.names.
+    """
+    sums = np.tensordot(self.view(frames), self.masks, axes=([-2,-1], [1,2]))
+    if statistic == 'mean':
+      return sums / self.areas
+    if statistic != 'sum':
+      raise ValueError("statistic must be 'sum' or 'mean', not %s" % (statistic))
+    return sums
+
+  def flux(self, frames, star, background=[], statistic='sum'):
+    """
+    Returns the flux of the star region minus the mean background of the
+    background regions (scaled to the area of the star region), for a
+    frame (float) or a stack of frames (array of n_frames). With
+    'mean', the result is per pixel: mean(star) - mean(mean(background)).
+    """
+    means = self.fluxes(frames, statistic='mean')
+    i = self.names.index(star)
+    net = means[..., i]
+    if len(background) > 0:
+      j = [self.names.index(name) for name in background]
+      net = net - means[..., j].mean(axis=-1)
+    if statistic == 'sum':
+      return net * self.areas[i]
+    return net
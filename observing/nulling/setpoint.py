@@ -47,6 +47,7 @@ print('')
 print('Importing libraries, setting up, initializing some things.')
 import time
 from pyindi import *
+from indi_profiler import profiler
 import numpy as np
 #import numpy as flx      # obsolete
 #import numpy as pixels   # obsolete
@@ -71,7 +72,7 @@ with warnings.catch_warnings():
 t0 = time.time()
 
 #pi is an instance of PyINDI. Here we connect to the server
-pi=PyINDI(verbose=False)
+pi=profiler.wrap(PyINDI(verbose=False))   # records the INDI round trips, see indi_profiler
 
 # Define ROI ID numbers
 pos1 = '3'  # on-source ROI
@@ -251,6 +252,9 @@ pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + f
 
 print('New setpoint used: ', setpoint_final)
 
+# Print the INDI round trips of this run (see indi_profiler)
+profiler.report()
+
 #Now pause
 #if raw_input("Press [ENTER] to confirm or [c] + [ENTER] to abort. ") == "c": quit()
 #input("Press 1")
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# Offline benchmark of the setpoint search algorithms
+#
+# Runs the setpoint algorithms of this repository against a simulated
+# fringe (see sim_tools.FringeSim) with configurable INDI latency, frame
+# rate, piston drift and noise, and reports for each algorithm over
+# n_runs Monte Carlo runs: the fraction of runs which finished within the
+# time limit, the (simulated) time to convergence, the number of INDI
+# calls, and the distribution of the final setpoint error.
+#
+# The nomops find_setpoint is called with each of its methods, the
+# standalone scripts are executed as they are (with the simulated server
+# standing in for pyindi and without display). find_setpoint_img.py is
+# not covered, since the simulation has no images.
+#
+# Usage (from this directory, no INDI server needed):
+#  $ python benchmark_setpoint.py
+
+import os
+import sys
+import warnings
+import numpy as np
+import sim_tools
+
+# ====================================================================================================
+# Define running parameters
+# ====================================================================================================
+n_runs      = 20         # Monte Carlo runs per algorithm
+seed        = 1          # seed of the first run (run i uses seed + i, the same for all algorithms)
+init_range  = 400.0      # initial setpoint error drawn uniformly from [-init_range, init_range] deg
+fps         = 20.0       # NOMIC frame rate in Hz
+latency     = 0.02       # INDI round trip in s
+jitter      = 0.005      # mean exponential jitter of the INDI round trip in s
+drift       = 0.5        # linear piston drift of the null in deg/s
+walk        = 2.0        # random walk of the null in deg/sqrt(s)
+noise       = 20.0       # noise per ROI and frame in ADU (fringe amplitude 1000 ADU)
+time_limit  = 600.0      # simulated time limit per run in s
+algorithms  = ['find_setpoint scan', 'find_setpoint fringe', 'find_setpoint brent', 'find_setpoint gradient',
+               'setpoint.py',
+               'nulling/setpoint.py', 'nulling/find_setpoint.py', 'nulling/find_setpoint_roi.py',
+               'nulling/old/find_setpoint_roi_mult_points.py', 'nulling/old/find_setpoint_roi_mult_points_v2.py',
+               'nulling/old/setpoint_2016-03-05.py', 'nulling/old/setpoint_2016-03-22.py',
+               'nulling/old/setpoint_2016-04-21.py', 'nulling/old/setpoint_2016-04-23.py',
+               'nulling/old/setpoint_2016-04-30.py']
+# ====================================================================================================
+
+here = os.path.dirname(os.path.abspath(__file__))
+observing = os.path.dirname(here)
+
+
+class ScriptFinished(Exception):
+  """
+  Raised in place of a prompt (raw_input/input): a script waiting for
+  the operator is done as far as the benchmark is concerned.
+  """
+  pass
+
+
+def _prompt(*args):
+  raise ScriptFinished()
+
+
+def run_find_setpoint(method):
+  """
+  Returns a runner calling nomops' find_setpoint with a method.
+  """
+  def run():
+    import config
+    import setpoint_controls
+    import profile_tools
+    from command_tools import nomic_state
+    profile_tools.setpoint_log.filename = os.devnull   # no run log of simulated searches
+    cfg = dict(config.hosts_std)
+    cfg['nomic_setpoint_method'] = method
+    cfg['nomic_setpoint_output'] = 'none'
+    cfg['target'] = ''
+    nomic_state.invalidate()
+    setpoint_controls.find_setpoint(cfg)
+  return run
+
+
+def run_script(path):
+  """
+  Returns a runner executing a standalone setpoint script.
+  """
+  def run():
+    namespace = {'__name__': '__main__', '__file__': path}
+    sys.path.insert(0, os.path.dirname(path))
+    try:
+      execfile(path, namespace)
+    finally:
+      sys.path.remove(os.path.dirname(path))
+  return run
+
+
+def runner(name):
+  if name.startswith('find_setpoint '):
+    return run_find_setpoint(name.split()[1])
+  if name.startswith('nulling/'):
+    return run_script(os.path.join(observing, name))
+  return run_script(os.path.join(here, name))
+
+
+def benchmark(name, clock):
+  """
+  Runs one algorithm n_runs times and returns its results as a
+  dictionary of arrays (time, calls, error, finished) and the failures.
+  """
+  run = runner(name)
+  results = {'time': [], 'calls': [], 'error': [], 'finished': []}
+  failures = {}
+  rng = np.random.RandomState(seed)
+  for i in range(n_runs):
+    setpoint = rng.uniform(-1000.0, 1000.0)
+    null = setpoint - rng.uniform(-init_range, init_range)
+    sim = sim_tools.FringeSim(clock, seed=seed+i, setpoint=setpoint, null=null, fps=fps, latency=latency,
+                              jitter=jitter, drift=drift, walk=walk, noise=noise, time_limit=time_limit)
+    sim_tools.server = sim
+    finished = True
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')   # the scripts print a lot
+    try:
+      try:
+        run()
+      except (ScriptFinished, SystemExit):
+        pass
+      except Exception, error:
+        finished = False
+        reason = '%s: %s' % (error.__class__.__name__, error)
+        failures[reason] = failures.get(reason, 0) + 1
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+    results['time'].append(sim.now())
+    results['calls'].append(sum(sim.calls.values()))
+    results['error'].append(sim.error())
+    results['finished'].append(finished)
+  for key in results.keys():
+    results[key] = np.array(results[key])
+  return results, failures
+
+
+def report(name, results, failures):
+  done = results['finished']
+  n_done = np.sum(done)
+  line = '  %-48s %4i/%-4i' % (name, n_done, len(done))
+  if n_done > 0:
+    t = results['time'][done]
+    e = results['error'][done]
+    line = line + ' %8.1f %8.1f %8.0f %8.1f %8.1f %8.1f' % (np.median(t), np.percentile(t, 90), np.mean(results['calls'][done]),
+                                                             np.mean(e), np.std(e), np.percentile(np.abs(e), 90))
+  print(line)
+  for reason in failures.keys():
+    print('  %-48s %4i x %s' % ('', failures[reason], reason))
+
+
+if __name__ == '__main__':
+  clock = sim_tools.VirtualClock()
+  clock.install()                                          # before the nomops modules bind sleep
+  sim_tools.install(sim_tools.FringeSim(clock))
+  import __builtin__
+  __builtin__.raw_input = _prompt
+  __builtin__.input = _prompt
+  sys.path.insert(0, here)
+  warnings.simplefilter('ignore')                          # e.g., badly conditioned fits of the old scripts
+
+  print('')
+  print('Setpoint benchmark: %i runs, %.0f Hz, INDI latency %.0f ms, drift %.1f deg/s, walk %.1f deg/sqrt(s), noise %.0f ADU'
+        % (n_runs, fps, 1000.0 * latency, drift, walk, noise))
+  print('')
+  print('  %-48s %9s %8s %8s %8s %8s %8s %8s' % ('algorithm', 'finished', 't [s]', 't90 [s]', 'calls', 'err', 'err std', '|err|90'))
+  for name in algorithms:
+    results, failures = benchmark(name, clock)
+    report(name, results, failures)
+  print('')
+  clock.uninstall()
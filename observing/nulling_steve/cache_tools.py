@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))   # the cache is kept next to the code, whatever the working directory
+
+class SetpointCache(object):
+  """
+  Small on-disk cache (JSON file) of converged phase setpoints, keyed by
+  target, nod position, PZT (UBC or NAC), and PHASECAM beam 2 position.
+  The two nod positions alternate during a night and their best
+  setpoints are usually repeatable, so a setpoint search can start from
+  the cached setpoint with a narrower scan range instead of from
+  whatever setpoint is currently set.
+
+  Every entry carries the time it was stored. lookup() only returns
+  entries younger than max_age seconds. The file is read on every
+  lookup and rewritten on every store, so that several processes (e.g.,
+  nomops and the setpoint script) can share it.
+
+  Usage:
+   >> key = setpoint_cache.key('HD 12345', '+2.3', 'UBC', 124.0)
+   >> setpoint_cache.store(key, 1234.5, 8.0)
+   >> entry = setpoint_cache.lookup(key, max_age=1800)
+   >> if entry is not None: print(entry['setpoint'], entry['age'])
+  """
+
+  def __init__(self, filename=os.path.join(here, 'setpoint_cache.json')):
+    self.filename = filename
+
+  def key(self, target, nod_position, pzt, beam2_y):
+    """
+    Returns the cache key for a target, nod position, PZT, and beam 2
+    position (in pixels, rounded to 0.1).
+    """
+    return '%s|%s|%s|%.1f' % (target, nod_position, pzt, float(beam2_y))
+
+  def load(self):
+    """
+    Returns all entries as a dictionary key -> entry. A missing or
+    unreadable file is an empty cache.
+    """
+    try:
+      f = open(self.filename, 'r')
+      try:
+        return json.load(f)
+      finally:
+        f.close()
+    except (IOError, ValueError):
+      return {}
+
+  def lookup(self, key, max_age):
+    """
+    Returns the entry for key (a dictionary with 'setpoint', 'std',
+    'time', and 'age' in s), or None if there is none or it is older
+    than max_age seconds.
+    """
+    entry = self.load().get(key)
+    if entry is None:
+      return None
+    entry['age'] = time.time() - entry['time']
+    if entry['age'] > max_age:
+      return None
+    return entry
+
+  def store(self, key, setpoint, std=None):
+    """
+    Stores a converged setpoint (and its uncertainty, if known) with the
+    current time.
+    """
+    if std is not None:
+      std = float(std)
+    entries = self.load()
+    entries[key] = {'setpoint': float(setpoint), 'std': std, 'time': time.time()}
+    tmp = self.filename + '.tmp'
+    f = open(tmp, 'w')
+    try:
+      json.dump(entries, f, indent=1, sort_keys=True)
+    finally:
+      f.close()
+    os.rename(tmp, self.filename)   # replace the file in one go
+
+
+setpoint_cache = SetpointCache()
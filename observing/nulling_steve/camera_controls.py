@@ -1,12 +1,15 @@
 from pyindi import * 
 import numpy as np
 from time import sleep
-from multiprocessing import Process
 from print_tools import *
+from profile_tools import *
 from opd_controls import *
+from command_tools import *
+from wait_tools import *
 
-pi = PyINDI(verbose=False)
+from session_tools import pi
 
+@profiled
 def take_darks(cfg):
   """
   Sets up NOMIC and takes darks. Uses the parameters 'save_nomic and
@@ -21,7 +24,7 @@ def take_darks(cfg):
   flag=f[0].header['FLAG']
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
@@ -37,11 +40,7 @@ def take_darks(cfg):
   
   n_sequ = cfg['nomic_nsequences_dark']
   # Set camera in safe state.
-  pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
+  nomic_state.set('contacq', 0).set('savedata', 0).set('loglevel', 0).set('autodispwhat', 0).lbtintpar(DIT, 1, 1).flush()
   
   info('Moving in blank+tape.')
   #Set filters to flat
@@ -49,14 +48,12 @@ def take_darks(cfg):
   pi.setINDI("NOMIC.EditFITS.Keyword=FLAG;Value=DRK;Comment=SCI/CAL/DRK/FLT")
   
   # Set up camera for integration.
-  pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, n_sequ), wait=True)
+  nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, n_sequ).flush()
   
   info('Taking ' + np.str(n_sequ) + ' dark frames.')
   # Integrate
   sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
+  nomic_state.send('go', timeout=50000)
   
   info('Opening filter wheel 2.')
   #Open FW2
@@ -66,30 +63,63 @@ def take_darks(cfg):
   pi.setINDI("NOMIC.EditFITS.Keyword=FLAG;Value=%s;Comment=SCI/CAL/DRK/FLT" % ( flag ))
   
   # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+    sleep(0.3)
+  nomic_state.set('contacq', 1).flush()
   
   info('Integration finished.')
   print('')
 
 
+@profiled
+def stage_camera(cfg, n_sequ):
+  """
+  Sets up NOMIC for an integration of n_sequ frames (changes only, see
+  command_tools.nomic_state) without starting it, so that the camera
+  setup can be sent while the telescope is still settling. A following
+  take_null, take_photometry, or take_background of n_sequ frames finds
+  the camera ready and starts at once. Uses the parameter 'save_nomic'
+  of a configuration dictionary and gets the integration time from the
+  camera as set by the operator before.
+  
+  Usage:
+   >> stage_camera(hosts_std, hosts_std['nomic_nsequences_phot'])
+  """
+  
+  # Get DIT as set by operator.
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
+  
+  if cfg['save_nomic']:
+    savedata = 1
+  else:
+    savedata = 0
+  
+  # Set camera in safe state and set up camera for integration (changes only).
+  nomic_state.set('contacq', 0).set('loglevel', 0)
+  nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, n_sequ)
+  if nomic_state.flush():
+    sleep(0.3)
+
+
+@profiled
 def take_null(cfg):
   """
   Sets up NOMIC and takes null data. Uses the parameters 'save_nomic',
   'nomic_nsequences_null', 'nomic_dither_opd', 'nomic_dither_opd_pattern',
-  'nomic_dither_opd_ndits', and 'nomic_dither_opd_off0' of a configuration
-  dictionary and gets the integration time from the camere as set by the
-  operator before.
+  'nomic_dither_opd_ndits', 'nomic_dither_opd_off0', and
+  'nomic_setpoint_track' of a configuration dictionary and gets the
+  integration time from the camere as set by the operator before. If
+  'nomic_setpoint_track' is True, the setpoint is kept on the null with
+  a SetpointTracker while the OPD dither pattern is running. With the
+  OPD dither pattern, the number of frames is rounded up to whole
+  dither cycles.
   
   Usage:
    >> take_null(hosts_std)
   """
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
@@ -98,6 +128,20 @@ def take_null(cfg):
   print('  nomic_nsequences_null = ' + np.str(cfg['nomic_nsequences_null']))
   print('  DIT                   = ' + np.str(DIT) + ' (as set by operator)')
   print('  OPD dither enabled?     ' + np.str(cfg['nomic_dither_opd']))
+  print('  Setpoint tracking?      ' + np.str(cfg['nomic_setpoint_track']))
+  
+  track = cfg['nomic_setpoint_track']
+  if track and not cfg['nomic_dither_opd']:
+    info('Setpoint tracking needs the OPD dither pattern, not tracking.')
+    track = False
+  
+  # Compile the OPD dither pattern (fails here on a bad configuration) and take whole dither cycles
+  n_sequ = cfg['nomic_nsequences_null']
+  if cfg['nomic_dither_opd']:
+    pattern = DitherPattern.from_config(cfg)
+    n_sequ = pattern.whole_cycles(n_sequ)
+    print('  OPD dither cycle        ' + np.str(pattern.period) + ' frames at ' + np.str(len(pattern)) + ' positions, taking '
+          + np.str(n_sequ // pattern.period) + ' cycles (' + np.str(n_sequ) + ' frames)')
   
   if cfg['save_nomic']:
     savedata = 1
@@ -107,35 +151,35 @@ def take_null(cfg):
   # Set fits header to nulling (obstype = 2).
   pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=2;Comment=observation type', wait=False)
   
-  # Start OPD dither pattern
+  # Start OPD dither pattern (and the setpoint tracker following it)
+  file_number_start = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get initial file number
   if cfg['nomic_dither_opd']:
-    dither = Process(target=opd_dither, args=(cfg,))
+    dither = DitherTask(cfg, file_number_start, pattern=pattern)
     dither.start()
-    sleep(0.3)
+    if track:
+      tracker = SetpointTracker(cfg, file_number_start, dither=dither)
+      tracker.start()
   
   # Integrate
-  n_sequ = cfg['nomic_nsequences_null']
-  file_number_start = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get initial file number
   while True:
     try:
-      # Set camera in safe state.
-      pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-      
-      # Set up camera for integration.
-      pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-      pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-#      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, n_sequ - 2), wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, n_sequ), wait=True)
+      # Set camera in safe state and set up camera for integration (changes only).
+      nomic_state.set('contacq', 0).set('loglevel', 0)
+      nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, n_sequ)
+      changed = nomic_state.flush()
       
-      # Integrate
-      sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
+      # Integrate (at the initial dither offset)
+      if changed:
+        sleep(0.3)
+      if cfg['nomic_dither_opd']:
+        dither.ready.wait(10.0)
+        if (not dither.ready.isSet()) or (dither.error is not None):
+          info('OPD dither pattern is not running (no initial offset sent within 10 s, or stopped on an error).')
+          raise RuntimeError('OPD dither pattern not running')
+      nomic_state.send('go', timeout=50000)
       break
     except:
+      nomic_state.invalidate()   # camera state is unknown after an error
       file_number = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get file number
       request('An error occured. Please recover error.')
       print('  When done, please enter the number of frames for this')
@@ -143,11 +187,9 @@ def take_null(cfg):
       print('  Enter 0 if you do not want to take additional frames')
       print('  or -1 to repeat the full sequence.')
       print('  We took ' + np.str(file_number - file_number_start) + ' files so far.')
-      pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-      pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-      sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+      if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+        sleep(0.3)
+      nomic_state.set('contacq', 1).flush()
       inp = int(raw_input())
       if inp == 0:
         info('Aborting sequence as requested.')
@@ -159,14 +201,20 @@ def take_null(cfg):
         info('Restarting sequence as requested.')
         file_number_start = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get initial file number
         if cfg['nomic_dither_opd']:
-          dither.terminate()  # terminate and then restart dither pattern
-          dither = Process(target=opd_dither, args=(cfg,))
+          if track:
+            tracker.stop()
+          dither.stop()   # back to the nominal setpoint, then restart dither pattern
+          dither = DitherTask(cfg, file_number_start, pattern=pattern)
           dither.start()
-          sleep(0.3)
+          if track:
+            tracker = SetpointTracker(cfg, file_number_start, dither=dither)
+            tracker.start()
         continue
   
   if cfg['nomic_dither_opd']:
-    dither.terminate()   # terminate dither pattern since we are done for this integration
+    if track:
+      tracker.stop()   # first, so that the dither pattern restores the setpoint including its corrections
+    dither.stop()      # stop dither pattern since we are done for this integration
   
 #  # check phase loop
 #  if not pi.getINDI('PLC.CloseLoop.Yes'):
@@ -187,11 +235,9 @@ def take_null(cfg):
 #  pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
     
   # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+    sleep(0.3)
+  nomic_state.set('contacq', 1).flush()
   
   # Set obstype to 4 (undefined)
   pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=4;Comment=observation type', wait=False)
@@ -200,6 +246,7 @@ def take_null(cfg):
   print('')
 
 
+@profiled
 def take_photometry(cfg):
   """
   Sets up NOMIC and takes photomatry data. Uses the parameters 'save_nomic'
@@ -211,7 +258,7 @@ def take_photometry(cfg):
   """
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
@@ -231,23 +278,18 @@ def take_photometry(cfg):
   n_sequ = cfg['nomic_nsequences_phot']
   while True:
     try:
-      # Set camera in safe state.
-      pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-      
-      # Set up camera for integration.
-      pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-      pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, n_sequ), wait=True)
+      # Set camera in safe state and set up camera for integration (changes only).
+      nomic_state.set('contacq', 0).set('loglevel', 0)
+      nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, n_sequ)
+      changed = nomic_state.flush()
       
       # Integrate
-      sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
+      if changed:
+        sleep(0.3)
+      nomic_state.send('go', timeout=50000)
       break
     except:
+      nomic_state.invalidate()   # camera state is unknown after an error
       request('An error occured. Please recover error.')
       print('  When done, please enter the number of frames for this')
       print('  sequence you would still like to take.')
@@ -265,11 +307,9 @@ def take_photometry(cfg):
         continue
   
   # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+    sleep(0.3)
+  nomic_state.set('contacq', 1).flush()
     
   # Set obstype to 4 (undefined)
   pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=4;Comment=observation type', wait=False)
@@ -278,6 +318,7 @@ def take_photometry(cfg):
   print('')
 
 
+@profiled
 def take_background(cfg):
   """
   Sets up NOMIC and takes background data. Uses the parameters 'save_nomic'
@@ -289,7 +330,7 @@ def take_background(cfg):
   """
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
@@ -309,23 +350,18 @@ def take_background(cfg):
   n_sequ = cfg['nomic_nsequences_bkgd']
   while True:
     try:
-      # Set camera in safe state.
-      pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-      pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-      
-      # Set up camera for integration.
-      pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-      pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-      pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, n_sequ), wait=True)
+      # Set camera in safe state and set up camera for integration (changes only).
+      nomic_state.set('contacq', 0).set('loglevel', 0)
+      nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, n_sequ)
+      changed = nomic_state.flush()
       
       # Integrate
-      sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
+      if changed:
+        sleep(0.3)
+      nomic_state.send('go', timeout=50000)
       break
     except:
+      nomic_state.invalidate()   # camera state is unknown after an error
       request('An error occured. Please recover error.')
       print('  When done, please enter the number of frames for this')
       print('  sequence you would still like to take.')
@@ -343,11 +379,9 @@ def take_background(cfg):
         continue
   
   # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+    sleep(0.3)
+  nomic_state.set('contacq', 1).flush()
   
   # Set obstype to 4 (undefined)
   pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=4;Comment=observation type', wait=False)
@@ -356,6 +390,7 @@ def take_background(cfg):
   print('')
 
 
+@profiled
 def wait_AO_loop(cfg, take_bkg = True):
   """
   Waits for the AO loop to be closed. Uses the parameters 'save_nomic',
@@ -369,11 +404,11 @@ def wait_AO_loop(cfg, take_bkg = True):
   """
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
-  if (pi.getINDI('LBTO.AOStatus.L_AOStatus') == 'AORunning') and (pi.getINDI('LBTO.AOStatus.R_AOStatus') == 'AORunning'):
+  if ao_loops_running():
     info('AO loop closed, continuing.')
     return
   request('Please close AO loop.')
@@ -392,50 +427,35 @@ def wait_AO_loop(cfg, take_bkg = True):
   
   n_done = 0 
   if take_bkg == True:
-    # Set camera in safe state.
-    pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-    
-    # Set up camera for integration.
-    pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-    pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, cfg['nomic_nwait_AO_loop']), wait=True)
+    # Set camera in safe state and set up camera for integration (changes only).
+    nomic_state.set('contacq', 0).set('loglevel', 0)
+    nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, cfg['nomic_nwait_AO_loop'])
+    nomic_state.flush()
     
-    while n_done < cfg['nomic_nsequences_null'] and not ((pi.getINDI('LBTO.AOStatus.L_AOStatus') == 'AORunning') and (pi.getINDI('LBTO.AOStatus.R_AOStatus') == 'AORunning')):
+    while n_done < cfg['nomic_nsequences_null'] and not ao_loops_running():
       print('  AO loop still open, taking %i background frames.' % (cfg['nomic_nwait_AO_loop']))
       sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', "go", timeout=50000, wait=True)
+      nomic_state.send('go', timeout=50000)
       n_done = n_done + cfg['nomic_nwait_AO_loop']
     
     # Set camera in continuous.
-    pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-    pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-    sleep(0.3)
-    pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+    if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+      sleep(0.3)
+    nomic_state.set('contacq', 1).flush()
     
-    if not ((pi.getINDI('LBTO.AOStatus.L_AOStatus') == 'AORunning') and (pi.getINDI('LBTO.AOStatus.R_AOStatus') == 'AORunning')):
+    if not ao_loops_running():
       print('')
       print('  AO loop still open, but took enough background frames.')
       print('  Stoped taking background frames, still waiting.')
       print('')
       
-  i = 0
-  while not ((pi.getINDI('LBTO.AOStatus.L_AOStatus') == 'AORunning') and (pi.getINDI('LBTO.AOStatus.R_AOStatus') == 'AORunning')):
-    i = i + 1
-    if i < 5:
-      print('  AO loop still open, waiting ...')
-    if i == 5:
-      print('  AO loop still open, continue waiting quietly ...')
-    sleep(1.0)
+  wait_ao_running(report=waiting_report('  AO loop still open, waiting ...', '  AO loop still open, continue waiting quietly ...', 5))
     
   info('AO loop closed. %i background files taken.' % n_done)
   print('')
 
 
+@profiled
 def wait_phase_loop(cfg, take_bkg = True):
   """
   Waits for the phase loop to be closed. Uses the parameters 'save_nomic',
@@ -449,11 +469,11 @@ def wait_phase_loop(cfg, take_bkg = True):
   """
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Print status information.
   print('')
-  if pi.getINDI('PLC.CloseLoop.Yes'):
+  if phase_loop_closed():
     info('Phase loop closed, continuing.')
     return
   request('Please close phase loop.')
@@ -475,32 +495,23 @@ def wait_phase_loop(cfg, take_bkg = True):
     # Set fits header to nulling (obstype = 2).
     pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=2;Comment=observation type', wait=False)
 
-    # Set camera in safe state.
-    pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-    pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-    
-    # Set up camera for integration.
-    pi.setINDI('NOMIC.Command.text', '%i savedata' % savedata, wait=True)
-    pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, cfg['nomic_nwait_phase_loop']), wait=True)
+    # Set camera in safe state and set up camera for integration (changes only).
+    nomic_state.set('contacq', 0).set('loglevel', 0)
+    nomic_state.set('savedata', savedata).set('autodispwhat', 1).lbtintpar(DIT, 1, cfg['nomic_nwait_phase_loop'])
+    nomic_state.flush()
     
-    while n_done < cfg['nomic_nsequences_null'] and not pi.getINDI('PLC.CloseLoop.Yes'):
+    while n_done < cfg['nomic_nsequences_null'] and not phase_loop_closed():
       print('  Phase loop still open, taking %i background frames.' % (cfg['nomic_nwait_phase_loop']))
       sleep(0.3)
-      pi.setINDI('NOMIC.Command.text', "go", timeout=50000, wait=True)
+      nomic_state.send('go', timeout=50000)
       n_done = n_done + cfg['nomic_nwait_phase_loop']
     
     # Set camera in continuous.
-    pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-    pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-    pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-    sleep(0.3)
-    pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+    if nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1).flush():
+      sleep(0.3)
+    nomic_state.set('contacq', 1).flush()
     
-    if not pi.getINDI('PLC.CloseLoop.Yes'):
+    if not phase_loop_closed():
       print('')
       print('  Phase loop still open, but took enough background frames.')
       print('  Stoped taking background frames, still waiting.')
@@ -510,14 +521,7 @@ def wait_phase_loop(cfg, take_bkg = True):
     pi.setINDI('NOMIC.EditFITS.Keyword=OBSTYPE;Value=4;Comment=observation type', wait=False)
 
   
-  i = 0
-  while not pi.getINDI('PLC.CloseLoop.Yes'):
-    i = i + 1
-    if i < 5:
-      print('  Phase loop still open, waiting ...')
-    if i == 5:
-      print('  Phase loop still open, continue waiting quietly ...')
-    sleep(1.0)
+  wait_phase_loop_closed(report=waiting_report('  Phase loop still open, waiting ...', '  Phase loop still open, continue waiting quietly ...', 5))
     
   info('Phase loop closed. %i background files taken.' % n_done)
   print('')
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# Offline check of the OPD dither pattern compilation
+#
+# Checks that opd_controls.DitherPattern rejects bad configurations (so
+# that take_null and observing_sequence fail before anything moves), that
+# whole_cycles rounds the number of frames up to whole dither cycles, and
+# that DitherTimeline repeats the first cycle with the drift of the
+# pattern. Stops on the first failed check.
+#
+# Usage (from this directory, no INDI server needed):
+#  $ python check_dither_pattern.py
+
+import os
+import sys
+import numpy as np
+import sim_tools
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def check_raises(args, what):
+  try:
+    DitherPattern(*args)
+  except ValueError, error:
+    print('  ok  %-40s (%s)' % (what, error))
+    return
+  raise AssertionError('DitherPattern%s did not raise ValueError (%s)' % (str(args), what))
+
+
+def check(condition, what):
+  assert condition, what
+  print('  ok  %s' % (what))
+
+
+if __name__ == '__main__':
+  sim_tools.install(sim_tools.FringeSim(sim_tools.VirtualClock()))
+  sys.path.insert(0, here)
+  import config
+  from opd_controls import DitherPattern, DitherTimeline
+
+  print('')
+  print('DitherPattern validation:')
+  check_raises(([], []), 'empty pattern')
+  check_raises(([-0.2, 0.2], [50]), 'fewer frame counts than offsets')
+  check_raises(([-0.2, np.nan], [50, 50]), 'offset not finite')
+  check_raises(([-0.2, 0.2], [50, 50], np.inf), 'initial offset not finite')
+  check_raises(([-0.2, 0.2], [50, 0]), 'frame count zero')
+  check_raises(([-0.2, 0.2], [50, 2.5]), 'frame count not an integer')
+
+  print('')
+  print('DitherPattern.whole_cycles:')
+  pattern = DitherPattern([-0.2, 0.2, 0.2, -0.2], [50, 50, 50, 50])
+  check(pattern.period == 200, 'period of 4 x 50 frames is 200')
+  check(pattern.whole_cycles(1000) == 1000, '1000 frames are 5 whole cycles')
+  check(pattern.whole_cycles(1001) == 1200, '1001 frames round up to 6 cycles')
+  check(pattern.whole_cycles(0) == 200, 'at least one cycle')
+  fast = DitherPattern([-0.2, 0.2, 0.2, -0.2], [2, 2, 2, 2])
+  check(fast.whole_cycles(1001) == 1008, '1001 frames round up to 126 cycles of 8 frames')
+  for name in ['hosts_std', 'hosts_fdt']:
+    cfg = getattr(config, name)
+    n_sequ = DitherPattern.from_config(cfg).whole_cycles(cfg['nomic_nsequences_null'])
+    check(n_sequ % DitherPattern.from_config(cfg).period == 0, '%s compiles, %i null frames in whole cycles' % (name, n_sequ))
+
+  print('')
+  print('DitherTimeline:')
+  pattern = DitherPattern([0.1, 0.2], [3, 5], 0.05)
+  timeline = DitherTimeline(pattern, 100, 1000.0)
+  check(timeline.start == pattern.off0, 'starts at the initial offset')
+  check([timeline.entry(k)[0] for k in range(4)] == [103, 108, 111, 116], 'trigger frames repeat every period')
+  frame, setpoint, position = timeline.entry(3)
+  check(np.allclose(position, pattern.drift + timeline.entry(1)[2]), 'second cycle shifted by the drift')
+  check(np.allclose(setpoint, 1000.0 + position), 'setpoint is nominal + position')
+
+  print('')
+  print('All checks passed.')
+  print('')
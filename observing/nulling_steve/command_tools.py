@@ -0,0 +1,180 @@
+from pyindi import *
+
+from session_tools import pi
+
+class CameraCommand(object):
+  """
+  Collects consecutive Command.text verbs for NOMIC (or LMIRCAM) and
+  sends them to the camera as one chained command, i.e., in a single
+  INDI round trip instead of one round trip per verb. The camera
+  executes the verbs in the order they were added.
+
+  Usage:
+   >> cmd = CameraCommand()              # NOMIC, or CameraCommand('LMIRCAM')
+   >> cmd.add('0 contacq').add('0 savedata').lbtintpar(DIT, 1, 1)
+   >> cmd.flush()
+   >> cmd.send('go', timeout=50000)      # add + flush in one go
+  """
+
+  def __init__(self, camera='NOMIC'):
+    self.camera = camera
+    self.verbs = []
+
+  def add(self, verb):
+    """
+    Queues one verb (e.g. '0 contacq'). Returns the command itself so
+    that calls can be chained.
+    """
+    self.verbs.append(verb)
+    return self
+
+  def lbtintpar(self, DIT, n_coadd, n_sequ):
+    """
+    Queues the integration parameters (DIT, coadds, number of frames).
+    """
+    return self.add('%f %i %i lbtintpar' % (DIT, n_coadd, n_sequ))
+
+  def text(self):
+    """
+    Returns the chained command as it will be sent to the camera.
+    """
+    return ' '.join(self.verbs)
+
+  def flush(self, timeout=None, wait=True):
+    """
+    Sends all queued verbs as one command and empties the queue. Does
+    nothing if the queue is empty. A timeout (as used for 'go' and
+    'rawbg') is passed on to setINDI if provided. Returns True if a
+    command was sent, False otherwise.
+    """
+    if len(self.verbs) == 0:
+      return False
+    text = self.text()
+    self.verbs = []
+    if timeout is None:
+      pi.setINDI('%s.Command.text' % (self.camera), text, wait=wait)
+    else:
+      pi.setINDI('%s.Command.text' % (self.camera), text, timeout=timeout, wait=wait)
+    return True
+
+  def send(self, verb, timeout=None, wait=True):
+    """
+    Queues a verb and flushes the queue (including anything queued
+    before).
+    """
+    self.add(verb)
+    return self.flush(timeout=timeout, wait=wait)
+
+
+class CameraState(object):
+  """
+  Client-side model of the camera settings. Keeps the last value of
+  each setting acknowledged by the camera and only sends the settings
+  that differ from it, chained into one command. Settings that were
+  never sent (or were invalidated) are always sent.
+  
+  The model only knows what was sent through it. Use sync() to update
+  it from CamInfo and invalidate() to forget everything, e.g., after an
+  error or when the operator changed the camera setup by hand.
+  
+  Usage:
+   >> nomic_state.set('contacq', 0).set('savedata', 1).lbtintpar(DIT, 1, 100)
+   >> nomic_state.flush()                 # sends only what has changed
+   >> nomic_state.send('go', timeout=50000)
+  """
+  
+  settings = ['contacq', 'savedata', 'loglevel', 'autodispwhat', 'lbtintpar']
+  
+  def __init__(self, camera='NOMIC'):
+    self.camera = camera
+    self.cmd = CameraCommand(camera)
+    self.values = {}    # last acknowledged verb of each setting
+    self.pending = {}   # verbs queued but not yet acknowledged
+  
+  def set(self, name, value):
+    """
+    Queues an integer setting (e.g. set('savedata', 1)) if it differs
+    from the acknowledged camera state. Returns the state itself so that
+    calls can be chained.
+    """
+    return self._queue(name, '%i %s' % (value, name))
+  
+  def lbtintpar(self, DIT, n_coadd, n_sequ):
+    """
+    Queues the integration parameters if they differ from the
+    acknowledged camera state.
+    """
+    return self._queue('lbtintpar', '%f %i %i lbtintpar' % (DIT, n_coadd, n_sequ))
+  
+  def _queue(self, name, verb):
+    if self.pending.get(name, self.values.get(name)) != verb:
+      self.cmd.add(verb)
+      self.pending[name] = verb
+    return self
+  
+  def add(self, verb):
+    """
+    Queues a verb which does not change a tracked setting (e.g. 'rawbg').
+    """
+    self.cmd.add(verb)
+    return self
+  
+  def flush(self, timeout=None):
+    """
+    Sends the queued changes as one command. Returns True if a command
+    was sent, False if the camera already was in the requested state.
+    """
+    pending = self.pending
+    self.pending = {}
+    try:
+      sent = self.cmd.flush(timeout=timeout)
+    except:
+      for name in pending.keys():
+        self.values.pop(name, None)   # camera state unknown after a failed command
+      raise
+    self.values.update(pending)
+    return sent
+  
+  def send(self, verb, timeout=None):
+    """
+    Queues a verb and sends it together with all queued changes.
+    """
+    self.add(verb)
+    return self.flush(timeout=timeout)
+  
+  def invalidate(self):
+    """
+    Forgets the acknowledged camera state so that all settings are sent
+    again the next time.
+    """
+    self.values = {}
+  
+  def sync(self):
+    """
+    Reads CamInfo from the camera in one request and drops every cached
+    setting which CamInfo reports with a different value. Returns the
+    CamInfo dictionary, so it can replace a separate read of, e.g.,
+    IntTime.
+    
+    Usage:
+     >> DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
+    """
+    caminfo = pi.getINDI('%s.CamInfo.*' % (self.camera))
+    for key in caminfo.keys():
+      name = key.split('.')[-1].lower()
+      if (name in self.settings) and (name != 'lbtintpar'):
+        try:
+          verb = '%i %s' % (int(caminfo[key]), name)
+        except (TypeError, ValueError):
+          verb = None
+        if self.values.get(name) != verb:
+          self.values.pop(name, None)
+    DIT = caminfo.get('%s.CamInfo.IntTime' % (self.camera))
+    if ('lbtintpar' in self.values) and (DIT is not None):
+      if float(self.values['lbtintpar'].split()[0]) != float('%f' % DIT):
+        del self.values['lbtintpar']
+    return caminfo
+
+
+nomic_state = CameraState('NOMIC')
+lmircam_state = CameraState('LMIRCAM')
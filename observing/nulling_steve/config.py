@@ -23,13 +23,16 @@ use of the PyINDI ppD command):
 
 Currently available configurations:
 - hosts_std: Standard configuration file for HOSTS nulling observations
+- hosts_fdt: Configuration file for fast dither testing (hosts_std with a few changes)
 
 List of entries in each configuration dictionary:
 =================================================
 Camera controls:
+- nomic_dither_fast: bool, True for the fast dither mode (for dither positions of a few frames, see opd_controls.DitherTask)
+- nomic_dither_lead: float, time in s the fast dither mode sends an offset ahead of the frame trigger
 - nomic_dither_opd: bool, True to enable OPD dithering, False otherwise
 - nomic_dither_opd_ndits: list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-- nomic_dither_opd_off0: first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint)
+- nomic_dither_opd_off0: first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint), Unit: rad at 11um
 - nomic_dither_opd_pattern: list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
 - nomic_nsequences_null: int, number of integrations per sequence
 - save_lmircam: bool, True for saving frames from LMIRCAM, False otherwise
@@ -44,6 +47,9 @@ Telescope controls:
 hosts_std = {} # Standard configuration file for HOSTS nulling observations
 #===============================================================================
 
+# Target:
+hosts_std['target']                           = ''           # string, name of the target (set in the observing script), used as key for cached setpoints, '' to not use the setpoint cache
+
 # Telescope controls:
 hosts_std['phasecam_beam2_offset_nod']        = 2            # int, offset of PHASECAM's beam 2 after a nod (in pixels)
 hosts_std['nod_throw']                        = 2.3          # float, length of a single nod offset in arcsec
@@ -52,13 +58,15 @@ hosts_std['opw_offset_nod']                   = 1300         # int, offset of th
 hosts_std['pzt']                              = 'UBC'        # string, 'UBC' or 'NAC', defines which PZTs to use
 
 # Camera controls:
+hosts_std['nomic_dither_fast']                = False        # bool, True for the fast dither mode (no readback, offsets sent without waiting, 'nomic_dither_lead' s ahead of the frame trigger)
+hosts_std['nomic_dither_lead']                = 0.0          # float, time in s the fast dither mode sends an offset ahead of the predicted end of the last frame at the old position
 hosts_std['nomic_dither_opd']                 = True         # bool, True to enable OPD dithering, False otherwise
 hosts_std['nomic_dither_opd_ndits']           = [50, 50, 50, 50]   # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-hosts_std['nomic_dither_opd_off0']            = 0.0          # first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint)
+hosts_std['nomic_dither_opd_off0']            = 0.0          # first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint), Unit: rad at 11um
 hosts_std['nomic_dither_opd_pattern']         = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
 hosts_std['nomic_nsequences_bkgd']            = 1000         # int, maximum number of integrations for background
 hosts_std['nomic_nsequences_dark']            = 500          # int, number of dark frames to be taken 
-hosts_std['nomic_nsequences_null']            = 2000         # int, number of integrations per nod for nulling observations
+hosts_std['nomic_nsequences_null']            = 1000         # int, number of integrations per nod for nulling observations
 hosts_std['nomic_nsequences_phot']            = 500          # int, number of integrations for photometry
 hosts_std['nomic_nwait_phase_loop']           = 100          # int, number of background frames taken in a row while waiting for phase loop to close
 hosts_std['nomic_nwait_AO_loop']              = 100          # int, number of background frames taken in a row while waiting for AO loop to close
@@ -66,48 +74,61 @@ hosts_std['save_lmircam']                     = False        # bool, True for sa
 hosts_std['save_nomic']                       = True         # bool, True for saving frames from NOMIC, False otherwise
 
 # Setpoint controls:
+hosts_std['nomic_setpoint_cache_age']         = 3600         # float, maximum age of a cached setpoint (same target, nod position, PZT, and beam 2 position) to start the setpoint search from in s
+hosts_std['nomic_setpoint_cache_range']       = 0.5          # float, scan range (fraction of nomic_setpoint_scan_range) used when starting from a cached setpoint
+hosts_std['nomic_setpoint_clip']              = 5.0          # float, ROI values further than this many sigma (from median and MAD) from the median over the stacked frames are rejected (10 frames or more, shorter stacks of 3 frames or more against the ROI noise pooled over the previous stacks, from the 6th stack of a search or tracking on)
+hosts_std['nomic_setpoint_fringe_period']     = 1800.0       # float, period of the fringe in setpoint degrees (used by the 'fringe' method)
 hosts_std['nomic_setpoint_img_stack']         = 3            # int, number of images stacked in one OPD position for flux computation during setpoint search
 hosts_std['nomic_setpoint_max_step']          = 45           # Maximum single step width to change the setpoint, set to HUGE number for no constraint.
-hosts_std['nomic_setpoint_n_confirm']         = 2            # Number of successful setpoint confirmations required
+hosts_std['nomic_setpoint_max_probes']        = 15           # int, maximum number of setpoints probed by the 'brent' and 'gradient' searches
+hosts_std['nomic_setpoint_max_scans']         = 10           # int, maximum number of grid scans of the 'scan' and 'fringe' searches (the search ends as not converged, its setpoint is not cached)
+hosts_std['nomic_setpoint_method']            = 'scan'       # string, 'scan' (grid scans + parabola fit), 'fringe' (grid scans + cosine fringe fit, works far from the null), 'brent' (successive parabolic interpolation) or 'gradient' (dither +/- one scan step + Newton steps), see setpoint_search.setpoint_strategies
 hosts_std['nomic_setpoint_n_scan']            = 5            # int, ODD NUMBER, number of OPD steps to scan for setpoint search
+hosts_std['nomic_setpoint_rate']              = 0            # float, maximum rate to change the setpoint in deg/s, 0 for no limit (steps of nomic_setpoint_max_step sent back to back)
 hosts_std['nomic_setpoint_output']            = 'none'       # string, 'screen', 'file', 'both', or 'none', indicates if and how to plot during setpoint search
 hosts_std['nomic_setpoint_savedata']          = False        # bool, True for saving frames from NOMIC during setpoint search
 hosts_std['nomic_setpoint_scan_range']        = [-360,360]   # vector of two int, range of setpoints to scan around initial setpoint in deg
+hosts_std['nomic_setpoint_tolerance']         = 10.0         # float, setpoint search has converged when the uncertainty of the fitted setpoint is below this (deg)
+hosts_std['nomic_setpoint_track']             = False        # bool, True to keep the setpoint on the null during take_null (needs the OPD dither pattern, UBC only)
+hosts_std['nomic_setpoint_track_frames']      = 5            # int, number of frames read at each OPD dither position by the setpoint tracker
+hosts_std['nomic_setpoint_track_gain']        = 0.5          # float, fraction of the measured setpoint error corrected after each OPD dither cycle
+hosts_std['nomic_setpoint_track_max_step']    = 2.0          # float, maximum setpoint correction after each OPD dither cycle in deg, applied while a dither position is held (limits the jump of the null within that position)
 
 #===============================================================================
 #===============================================================================
-hosts_fdt = {} # Configuration file for HOSTS nulling observations, fast dither testing
+hosts_fdt = dict(hosts_std) # Configuration file for HOSTS nulling observations, fast dither testing (entries not set below as in hosts_std)
 #===============================================================================
 
 # Telescope controls:
-hosts_std['phasecam_beam2_offset_nod']        = 2            # int, offset of PHASECAM's beam 2 after a nod (in pixels)
-hosts_std['nod_throw']                        = 2.3          # float, length of a single nod offset in arcsec
-hosts_std['off_throw']                        = 5.0          # float, length of a single offset in arcsec used to take background frames
-hosts_std['opw_offset_nod']                   = 1300         # int, offset of the PHASECAM pupil wheel after a nod
-hosts_std['pzt']                              = 'UBC'        # string, 'UBC' or 'NAC', defines which PZTs to use
+hosts_fdt['phasecam_beam2_offset_nod']        = 2            # int, offset of PHASECAM's beam 2 after a nod (in pixels)
+hosts_fdt['nod_throw']                        = 2.3          # float, length of a single nod offset in arcsec
+hosts_fdt['off_throw']                        = 5.0          # float, length of a single offset in arcsec used to take background frames
+hosts_fdt['opw_offset_nod']                   = 1300         # int, offset of the PHASECAM pupil wheel after a nod
+hosts_fdt['pzt']                              = 'UBC'        # string, 'UBC' or 'NAC', defines which PZTs to use
 
 # Camera controls:
-hosts_std['nomic_dither_opd']                 = True         # bool, True to enable OPD dithering, False otherwise
-hosts_std['nomic_dither_opd_ndits']           = [50, 50, 50, 50]   # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-hosts_std['nomic_dither_opd_off0']            = 0.0          # first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint)
-hosts_std['nomic_dither_opd_pattern']         = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-hosts_std['nomic_nsequences_bkgd']            = 1000         # int, maximum number of integrations for background
-hosts_std['nomic_nsequences_dark']            = 500          # int, number of dark frames to be taken 
-hosts_std['nomic_nsequences_null']            = 1000         # int, number of integrations per nod for nulling observations
-hosts_std['nomic_nsequences_phot']            = 500          # int, number of integrations for photometry
-hosts_std['nomic_nwait_phase_loop']           = 100          # int, number of background frames taken in a row while waiting for phase loop to close
-hosts_std['nomic_nwait_AO_loop']              = 100          # int, number of background frames taken in a row while waiting for AO loop to close
-hosts_std['save_lmircam']                     = False        # bool, True for saving frames from LMIRCAM, False otherwise
-hosts_std['save_nomic']                       = True         # bool, True for saving frames from NOMIC, False otherwise
+hosts_fdt['nomic_dither_fast']                = False        # bool, True for the fast dither mode (no readback, offsets sent without waiting, 'nomic_dither_lead' s ahead of the frame trigger), set per null by obs_fast_dither
+hosts_fdt['nomic_dither_lead']                = 0.05         # float, time in s the fast dither mode sends an offset ahead of the predicted end of the last frame at the old position
+hosts_fdt['nomic_dither_opd']                 = True         # bool, True to enable OPD dithering, False otherwise
+hosts_fdt['nomic_dither_opd_ndits']           = [50, 50, 50, 50]   # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
+hosts_fdt['nomic_dither_opd_off0']            = 0.0          # first offset from nominal setpoint for OPD dither pattern (if 0.0, first integration starts at nominal setpoint), Unit: rad at 11um
+hosts_fdt['nomic_dither_opd_pattern']         = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
+hosts_fdt['nomic_nsequences_bkgd']            = 1000         # int, maximum number of integrations for background
+hosts_fdt['nomic_nsequences_dark']            = 500          # int, number of dark frames to be taken 
+hosts_fdt['nomic_nsequences_null']            = 1000         # int, number of integrations per nod for nulling observations
+hosts_fdt['nomic_nsequences_phot']            = 500          # int, number of integrations for photometry
+hosts_fdt['nomic_nwait_phase_loop']           = 100          # int, number of background frames taken in a row while waiting for phase loop to close
+hosts_fdt['nomic_nwait_AO_loop']              = 100          # int, number of background frames taken in a row while waiting for AO loop to close
+hosts_fdt['save_lmircam']                     = False        # bool, True for saving frames from LMIRCAM, False otherwise
+hosts_fdt['save_nomic']                       = True         # bool, True for saving frames from NOMIC, False otherwise
 
 # Setpoint controls:
-hosts_std['nomic_setpoint_img_stack']         = 3            # int, number of images stacked in one OPD position for flux computation during setpoint search
-hosts_std['nomic_setpoint_max_step']          = 45           # Maximum single step width to change the setpoint, set to HUGE number for no constraint.
-hosts_std['nomic_setpoint_n_confirm']         = 2            # Number of successful setpoint confirmations required
-hosts_std['nomic_setpoint_n_scan']            = 5            # int, ODD NUMBER, number of OPD steps to scan for setpoint search
-hosts_std['nomic_setpoint_output']            = 'none'       # string, 'screen', 'file', 'both', or 'none', indicates if and how to plot during setpoint search
-hosts_std['nomic_setpoint_savedata']          = False        # bool, True for saving frames from NOMIC during setpoint search
-hosts_std['nomic_setpoint_scan_range']        = [-360,360]   # vector of two int, range of setpoints to scan around initial setpoint in deg
+hosts_fdt['nomic_setpoint_img_stack']         = 3            # int, number of images stacked in one OPD position for flux computation during setpoint search
+hosts_fdt['nomic_setpoint_max_step']          = 45           # Maximum single step width to change the setpoint, set to HUGE number for no constraint.
+hosts_fdt['nomic_setpoint_n_scan']            = 5            # int, ODD NUMBER, number of OPD steps to scan for setpoint search
+hosts_fdt['nomic_setpoint_output']            = 'none'       # string, 'screen', 'file', 'both', or 'none', indicates if and how to plot during setpoint search
+hosts_fdt['nomic_setpoint_savedata']          = False        # bool, True for saving frames from NOMIC during setpoint search
+hosts_fdt['nomic_setpoint_scan_range']        = [-360,360]   # vector of two int, range of setpoints to scan around initial setpoint in deg
 
 #===============================================================================
 #===============================================================================
@@ -1,5 +1,5 @@
 from pyindi import *
-pi = PyINDI()
+from session_tools import pi
 
 def custom_cfg(cfg_in):
   """
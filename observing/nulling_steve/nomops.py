@@ -25,12 +25,22 @@ print "#################################################################"
 print ""
 
 from pyindi import *
-pi = PyINDI()
+from session_tools import pi
 
 from config_tools import *
+from command_tools import *
+from stats_tools import *
+from robust_tools import *
+from wait_tools import *
+from task_tools import *
+from roi_tools import *
+from profile_tools import *
+from cache_tools import *
 from camera_controls import *
 from telescope_controls import *
 from opd_controls import *
+from setpoint_controls import *
+from sequence_tools import *
 from print_tools import *
 import config
 
@@ -2,7 +2,6 @@
 
 import config
 from nomops import *
-from time import sleep
 
 extra_wait = 7.0
 
@@ -10,77 +9,17 @@ cfg = custom_cfg(config.hosts_std)
 disp(cfg)
 
 #cfg['save_nomic'] = False
+#cfg['target'] = 'HD 12345'   # enables the setpoint cache for find_setpoint
 
-# nod pair 1
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
+# Observing plan (see help(observing_sequence)), steps which do not depend on each other run at the same time
+plan = [('nod_pairs', 3),   # null at the start position, then 5 nods (up, down, ...) with a null after each
+        ('photometry',),
+        ('background',),
+        ('reset',)]         # resetting for new observation on this target
 
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
-
-# nod pair 2
-nod(cfg, 'down')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
-
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
-
-# nod pair 3
-nod(cfg, 'down')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
-
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-take_null(cfg)
-
-# photometry
-nod(cfg, 'down', side='left')
-sleep(extra_wait)
-wait_AO_loop(cfg, take_bkg=False)
-
-sleep(extra_wait)
-take_photometry(cfg)
-
-# background
-nod(cfg, 'up', side='left')
-sleep(extra_wait)
-wait_AO_loop(cfg, take_bkg=False)
-
-offset_background(cfg, 'up')
-wait_AO_loop(cfg, take_bkg=False)
-
-sleep(extra_wait)
-take_background(cfg)
-
-#resetting for new observation on this target
-
-offset_background(cfg, 'down')
-wait_AO_loop(cfg, take_bkg=False)
-sleep(extra_wait)
-sleep(extra_wait)
-sleep(extra_wait)
-nod(cfg, 'down')
-wait_AO_loop(cfg, take_bkg=False)
+run_plan(cfg, plan, extra_wait=extra_wait)
 
+# Where did the time go?
+profiler.report()
 
 request('Done, restart script or preset to next target.')
-
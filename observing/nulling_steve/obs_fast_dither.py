@@ -2,7 +2,6 @@
 
 import config
 from nomops import *
-from time import sleep
 
 extra_wait = 7.0
 
@@ -11,106 +10,20 @@ disp(cfg)
 
 #cfg['save_nomic'] = False
 
-# nod pair 1
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
+# Two nulls at each nod position, one with the slow and one with the fast OPD dither pattern
+slow = {'nomic_dither_fast':        False,                     # bool, reference null with the standard dither mode
+        'nomic_dither_opd_ndits':   [50, 50, 50, 50],          # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
+        'nomic_dither_opd_pattern': [-0.2, 0.2, 0.2, -0.2]}    # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
+fast = {'nomic_dither_fast':        True,                      # bool, fast dither mode (see opd_controls.DitherTask)
+        'nomic_dither_opd_ndits':   [2, 2, 2, 2],              # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
+        'nomic_dither_opd_pattern': [-0.2, 0.2, 0.2, -0.2]}    # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
 
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-
-# nod pair 2
-nod(cfg, 'down')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-
-# nod pair 3
-nod(cfg, 'down')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-
-nod(cfg, 'up')
-sleep(extra_wait)
-wait_phase_loop(cfg)
-
-request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
-cfg['nomic_dither_opd_ndits']   = [50, 50, 50, 50]         # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-cfg['nomic_dither_opd_ndits']   = [2, 2, 2, 2]             # list of ints, number of frames taken at each OPD dither position (starts integrating first, then sends first offset)
-cfg['nomic_dither_opd_pattern'] = [-0.2, 0.2, 0.2, -0.2]   # list of floats, offsets to perform OPD dither pattern (starts integrating first, then sends first offset), Unit: rad at 11um
-take_null(cfg)
-
-# photometry
-nod(cfg, 'down', side='left')
-sleep(extra_wait)
-wait_AO_loop(cfg, take_bkg=False)
-
-sleep(extra_wait)
-take_photometry(cfg)
-
-# background
-nod(cfg, 'up', side='left')
-sleep(extra_wait)
-wait_AO_loop(cfg, take_bkg=False)
-
-offset_background(cfg, 'up')
-wait_AO_loop(cfg, take_bkg=False)
-
-sleep(extra_wait)
-take_background(cfg)
-
-#resetting for new observation on this target
-
-offset_background(cfg, 'down')
-wait_AO_loop(cfg, take_bkg=False)
-sleep(extra_wait)
-sleep(extra_wait)
-sleep(extra_wait)
-nod(cfg, 'down')
-wait_AO_loop(cfg, take_bkg=False)
+# Observing plan (see help(observing_sequence)), steps which do not depend on each other run at the same time
+plan = [('nod_pairs', 3, [slow, fast]),   # nulls at the start position, then 5 nods (up, down, ...) with nulls after each
+        ('photometry',),
+        ('background',),
+        ('reset',)]                       # resetting for new observation on this target
 
+run_plan(cfg, plan, extra_wait=extra_wait)
 
 request('Done, restart script or preset to next target.')
-
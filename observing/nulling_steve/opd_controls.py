@@ -1,9 +1,14 @@
 from pyindi import * 
 import numpy as np
+import threading
+import time
 from time import sleep
 from print_tools import *
+from stats_tools import *
+from wait_tools import *
+from setpoint_search import QuadraticFit
 
-pi = PyINDI()
+from session_tools import pi
 
 def offset_setpoint(inverse=False):
   """
@@ -21,34 +26,567 @@ def offset_setpoint(inverse=False):
   setpoint_old = pi.getINDI('PLC.UBCSettings.PLSetpoint')
   pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_old + offset) + ';forNAC=0')
 
-def opd_dither(cfg):
+def opd_dither(cfg, file_number=None):
   """
-  Initializes an OPD dither pattern. Uses the parameters
-  'nomic_dither_opd_pattern', and 'nomic_dither_opd_ndits'
-  of a configuration dictionary and gets the initial file
-  number from the camera.
+  Runs an OPD dither pattern in the calling thread until it times out
+  (see DitherTask, which runs it in the background). Uses the parameters
+  'nomic_dither_opd_pattern', 'nomic_dither_opd_ndits', and
+  'nomic_dither_opd_off0' of a configuration dictionary and gets the initial file
+  number from the camera (unless it is given).
   
   Usage:
    >> opd_dither(cfg)
   """
   
-  setpoint_new = pi.getINDI('PLC.UBCSettings.PLSetpoint')
-  file_number = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get initial file number
-  offsets = np.array(cfg['nomic_dither_opd_pattern']) * 5.0 * 180.0 / np.pi   # input in rad at 11um, but commandet offsets in deg in K band
-  pi.setINDI('NOMIC.EditFITS.Keyword=spdthpos;Value=0.0;Comment=setpoint dither position (offset from nominal setpoint) in rad')
-  while True:
-    for i_step in range(0, len(cfg['nomic_dither_opd_pattern'])):
-      file_number = file_number + cfg['nomic_dither_opd_ndits'][i_step]
-      try:
-        pi.evalINDI ('"NOMIC.CamInfo.FIndex" >= %d' % file_number, timeout=900)   # wait for cfg['nomic_dither_opd_ndits'][i] new files to arrive
-      except:
-        info('OPD dither offset timed out (more than 15 min since last offset)')
-        print('  or was interrupted.')
+  DitherTask(cfg, file_number).run()
+
+
+class DitherPattern(object):
+  """
+  OPD dither configuration ('nomic_dither_opd_pattern',
+  'nomic_dither_opd_ndits', 'nomic_dither_opd_off0') validated and
+  compiled into arrays once per sequence, so that a bad configuration
+  fails before the integration starts and not in the middle of it.
+  Offsets are converted from rad at 11um to deg in K band here, once.
+  
+  The integration starts at the initial offset off0 from the nominal
+  setpoint and stays for ndits[0] frames, then offset pattern[0] is
+  sent, and so on. One dither cycle is period frames, after which the
+  dither position has moved by drift (0.0 for closed patterns).
+  
+  Usage:
+   >> pattern = DitherPattern.from_config(cfg)
+   >> n_sequ = pattern.whole_cycles(cfg['nomic_nsequences_null'])   # frames in whole dither cycles
+  """
+  
+  def __init__(self, pattern, ndits, off0=0.0):
+    pattern = np.array(pattern, dtype=float).ravel()
+    ndits = np.array(ndits).ravel()
+    if len(pattern) == 0:
+      raise ValueError('empty OPD dither pattern')
+    if len(pattern) != len(ndits):
+      raise ValueError('OPD dither pattern has %i offsets but %i frame counts (nomic_dither_opd_ndits)' % (len(pattern), len(ndits)))
+    if not np.all(np.isfinite(pattern)) or not np.isfinite(off0):
+      raise ValueError('OPD dither offsets must be finite')
+    if np.any(ndits != np.round(ndits)) or np.any(ndits < 1):
+      raise ValueError('OPD dither frame counts must be positive integers, not %s' % (list(ndits)))
+    self.ndits = ndits.astype(int)                                   # frames at each dither position
+    self.offsets = pattern * 5.0 * 180.0 / np.pi                     # input in rad at 11um, but commanded offsets in deg in K band
+    self.off0 = float(off0) * 5.0 * 180.0 / np.pi                    # initial offset from the nominal setpoint
+    self.starts = np.concatenate(([0], np.cumsum(self.ndits)))      # first frame of each dither position (and of the next cycle)
+    self.positions = self.off0 + np.concatenate(([0.0], np.cumsum(self.offsets)[:-1]))   # dither position during each block of frames
+    self.period = int(self.starts[-1])                               # frames per dither cycle
+    self.drift = np.sum(self.offsets)                                # dither position moved after one cycle
+  
+  @classmethod
+  def from_config(cls, cfg):
+    return cls(cfg['nomic_dither_opd_pattern'], cfg['nomic_dither_opd_ndits'], cfg['nomic_dither_opd_off0'])
+  
+  def __len__(self):
+    return len(self.offsets)
+  
+  def budget(self, n_cycles):
+    """
+    Returns the number of frames in n_cycles dither cycles.
+    """
+    return int(n_cycles) * self.period
+  
+  def whole_cycles(self, n_frames):
+    """
+    Returns the smallest number of frames in whole dither cycles (at
+    least one) which is not less than n_frames.
+    """
+    return self.budget(max(1, -(-int(n_frames) // self.period)))
+
+
+class DitherTimeline(object):
+  """
+  DitherPattern compiled into a timeline of (trigger frame, absolute
+  setpoint, dither position) entries, so that nothing has to be
+  computed or read back between the frame trigger and the offset. The
+  first cycle is computed with np.cumsum; cycle c repeats it c dither
+  periods later, shifted by c times the drift of one cycle.
+  
+  Usage:
+   >> timeline = DitherTimeline(DitherPattern.from_config(cfg), file_number, setpoint)
+   >> frame, setpoint, position = timeline.entry(k)   # k-th offset
+  """
+  
+  def __init__(self, pattern, file_number, nominal):
+    self.frames = int(file_number) + pattern.starts[1:]          # trigger frame of each offset of the first cycle
+    self.positions = pattern.off0 + np.cumsum(pattern.offsets)   # dither position after each offset of the first cycle
+    self.start = pattern.off0                                     # dither position before the first offset
+    self.period = pattern.period                                  # frames per dither cycle
+    self.drift = pattern.drift                                    # dither position moved after one cycle
+    self.nominal = float(nominal)                                 # nominal setpoint
+  
+  def __len__(self):
+    return len(self.frames)
+  
+  def entry(self, k):
+    """
+    Returns the trigger frame, the absolute setpoint, and the dither
+    position of the k-th offset (k = 0, 1, ... over all cycles).
+    """
+    cycle, i = divmod(k, len(self.frames))
+    position = cycle * self.drift + self.positions[i]
+    return int(self.frames[i] + cycle * self.period), self.nominal + position, position
+
+
+class DitherTask(threading.Thread):
+  """
+  Runs the OPD dither pattern in a thread of the calling process, with
+  its own INDI channel ('dither') of the nomops session, instead of a
+  separate process with new INDI connections. The pattern is compiled
+  into a DitherPattern when the task is created (or given, if it was
+  compiled before) and into a DitherTimeline at the start, where the
+  initial offset is sent ('ready' is set once it was sent). Each entry
+  is fired as soon as the camera frame counter reaches its trigger
+  frame (evalINDI on the server): the spdthpos keyword and the absolute
+  setpoint are sent without reading anything back. The frame counter is read after each
+  offset, and the requested and actual trigger frames are kept in
+  'triggers' to measure the dither latency.
+  
+  Corrections of the nominal setpoint (e.g., by a SetpointTracker) go
+  through shift(), so that the timeline follows them.
+  
+  In the fast dither mode ('nomic_dither_fast', for dither positions of
+  a few frames), the task waits for the last frame at the old position
+  to start instead, and sends the offset 'nomic_dither_lead' seconds
+  before its predicted end (frame period measured from the frame
+  counter). Both commands go out back to back without waiting for the
+  server, and the frame counter is not read back.
+  
+  stop() reports the commanded and achieved dither rates (offsets per
+  second) in both modes.
+  
+  stop() cancels the pattern between two offsets (the frame waits are
+  split into short steps), and the task always ends by sending the
+  nominal setpoint (plus corrections) and spdthpos 0, also if it stops
+  on a timeout or an error. The number of offsets sent is available as
+  n_steps.
+  
+  Usage:
+   >> dither = DitherTask(cfg, file_number)   # file number the pattern starts at
+   >> dither.start()
+   >> dither.ready.wait(10.0)
+   >> ...
+   >> dither.stop()
+  """
+  
+  def __init__(self, cfg, file_number=None, timeout=900, pattern=None):
+    threading.Thread.__init__(self, name='dither')
+    self.setDaemon(True)
+    if pattern is None:
+      pattern = DitherPattern.from_config(cfg)
+    self.pattern = pattern
+    self.fast = cfg['nomic_dither_fast']
+    self.lead = cfg['nomic_dither_lead']      # s, fast mode only
+    self.file_number = file_number
+    self.timeout = timeout          # s without a new dither position before the pattern gives up
+    self.timeline = None
+    self.position = 0.0             # dither offset applied, from the nominal setpoint
+    self.n_steps = 0                # number of offsets sent
+    self.triggers = []              # (requested, actual) trigger frame of each offset (not in fast mode)
+    self.frame_period = None        # s, measured from the frame counter
+    self.seen = None                # (first frame, time, last frame, time) seen by the frame waits
+    self.t_sent = None              # (first, last) time an offset was sent
+    self.error = None
+    self.restored = False           # set once the nominal setpoint was sent back at the end
+    self.lock = threading.Lock()    # serializes setpoint changes of the timeline and of shift()
+    self.stopped = threading.Event()
+    self.ready = threading.Event()  # set once the initial offset was sent
+  
+  def stop(self, timeout=10.0):
+    """
+    Cancels the dither pattern, waits (at most timeout s) until the
+    nominal setpoint is restored, and prints a summary, with a warning
+    if the task did not end or could not restore the setpoint. Returns
+    the number of offsets sent.
+    """
+    self.stopped.set()
+    self.join(timeout)
+    summary = 'OPD dither: %i offsets sent (%.1f dither cycles)' % (self.n_steps, self.n_steps / float(len(self.pattern)))
+    if self.isAlive():
+      info(summary + ', still running after %.0f s, nominal setpoint NOT restored yet.' % (timeout))
+    elif not self.restored:
+      info(summary + ', nominal setpoint NOT restored (%s).' % (self.error))
+      print('  Check the PHASECAM setpoint and spdthpos before the next integration.')
+    else:
+      info(summary + ', nominal setpoint restored.')
+    latency = self.latency()
+    if latency is not None:
+      print('  Offsets landed %.1f frames after the trigger frame on average (max. %i).' % latency)
+    rates = self.rates()
+    if rates is not None:
+      print('  Dither rate: commanded %.2f offsets/s, achieved %.2f offsets/s (frame period %.1f ms).' % (rates + (1000.0 * self.frame_period,)))
+    return self.n_steps
+  
+  def rates(self):
+    """
+    Returns the commanded dither rate (offsets per second at the
+    measured frame period) and the achieved one (offsets sent per
+    second), or None if fewer than two offsets were sent.
+    """
+    if (self.n_steps < 2) or (self.frame_period is None) or (self.t_sent[1] <= self.t_sent[0]):
+      return None
+    return 1.0 / (np.mean(self.pattern.ndits) * self.frame_period), (self.n_steps - 1) / (self.t_sent[1] - self.t_sent[0])
+  
+  def latency(self):
+    """
+    Returns the mean and maximum number of frames between the requested
+    and the actual trigger frame of the offsets, or None.
+    """
+    if len(self.triggers) == 0:
+      return None
+    delay = np.diff(np.array(self.triggers), axis=1)
+    return np.mean(delay), int(np.max(delay))
+  
+  def shift(self, delta):
+    """
+    Shifts the nominal setpoint by delta (deg) and sends the shifted
+    setpoint at once, keeping the current dither position.
+    """
+    self.lock.acquire()
+    try:
+      if self.timeline is None:
+        setpoint = pi.getINDI('PLC.UBCSettings.PLSetpoint') + delta
+      else:
+        self.timeline.nominal = self.timeline.nominal + delta
+        setpoint = self.timeline.nominal + self.position
+      pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint) + ';forNAC=0')
+    finally:
+      self.lock.release()
+  
+  def _wait_frame(self, frame):
+    # wait for a frame in short steps, so that stop() is noticed
+    t0 = time.time()
+    while not self.stopped.isSet():
+      if wait_eval('"NOMIC.CamInfo.FIndex" >= %d' % (frame), timeout=0.5):
+        self._seen(frame, time.time())
+        return True
+      if time.time() - t0 > self.timeout:
+        info('OPD dither offset timed out (more than %.0f min since last offset)' % (self.timeout / 60.0))
         print('  Make sure to restart OPD dither pattern.')
-        return()
-      setpoint_old = pi.getINDI('PLC.UBCSettings.PLSetpoint')   # ask for current setpoint
-      if (setpoint_old - setpoint_new) > 2.9: # if expected setpoint is more than ~0.01 rad (at 11um) different from current setpoint
-        info('Setpoint has changed between two dither positions.')
-      setpoint_new = setpoint_old + offsets[i_step]             # determine new setpoint
-      pi.setINDI('NOMIC.EditFITS.Keyword=spdthpos;Value=' + str(np.sum(offsets[:i_step+1])) + ';Comment=setpoint dither position (offset from nominal setpoint) in rad')
-      pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_new) + ';forNAC=0')   # send a dither offset
+        return False
+    return False
+  
+  def _seen(self, frame, t):
+    # frame period from the first and the last frame seen
+    if self.seen is None:
+      self.seen = (frame, t, frame, t)
+    elif frame > self.seen[2]:
+      self.seen = self.seen[0:2] + (frame, t)
+      self.frame_period = (t - self.seen[1]) / (frame - self.seen[0])
+  
+  def _send(self, setpoint, position, wait=True):
+    pi.setINDI('NOMIC.EditFITS.Keyword=spdthpos;Value=' + str(position) + ';Comment=setpoint dither position (offset from nominal setpoint) in rad', wait=wait)
+    pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint) + ';forNAC=0', wait=wait)   # send a dither offset
+    self.position = position
+  
+  def run(self):
+    if threading.currentThread() is self:
+      pi.use_channel(self.getName())
+    try:
+      try:
+        self._run()
+      except Exception, error:
+        self.error = error
+        info('OPD dither pattern stopped on an error: %s' % (error))
+    finally:
+      self.ready.set()   # do not keep anybody waiting for a pattern which is not running
+      try:
+        self._restore()
+      except Exception, error:
+        if self.error is None:
+          self.error = error
+        info('OPD dither could not restore the nominal setpoint: %s' % (error))
+  
+  def _restore(self):
+    # back to the nominal setpoint (plus corrections) and spdthpos 0
+    if self.position != 0.0:
+      self.lock.acquire()
+      try:
+        if self.timeline is None:
+          nominal = pi.getINDI('PLC.UBCSettings.PLSetpoint') - self.position
+        else:
+          nominal = self.timeline.nominal
+        self._send(nominal, 0.0)
+      finally:
+        self.lock.release()
+    self.restored = True
+  
+  def _run(self):
+    file_number = self.file_number
+    if file_number is None:
+      file_number = pi.getINDI('NOMIC.CamInfo.FIndex')  # Get initial file number
+    self.timeline = DitherTimeline(self.pattern, file_number, pi.getINDI('PLC.UBCSettings.PLSetpoint'))
+    if self.fast:
+      self.frame_period = pi.getINDI('NOMIC.CamInfo.IntTime')   # first guess, measured from the frame counter below
+    self.lock.acquire()
+    try:
+      self._send(self.timeline.nominal + self.timeline.start, self.timeline.start)   # initial offset (nominal setpoint if 0.0)
+    finally:
+      self.lock.release()
+    self.ready.set()
+    k = 0
+    while True:
+      frame, setpoint, position = self.timeline.entry(k)
+      if self.fast:
+        # wait for the last frame at the old position to start, send ahead of its predicted end
+        if not self._wait_frame(frame - 1):
+          return
+        sleep(max(0.0, self.seen[3] + self.frame_period - self.lead - time.time()))
+      elif not self._wait_frame(frame):   # wait for ndits[i] new files to arrive
+        return
+      self.lock.acquire()
+      try:
+        self._send(self.timeline.nominal + position, position, wait=not self.fast)   # nominal setpoint may have been shifted since the entry was read
+      finally:
+        self.lock.release()
+      t = time.time()
+      if self.t_sent is None:
+        self.t_sent = (t, t)
+      self.t_sent = (self.t_sent[0], t)
+      if not self.fast:
+        self.triggers.append((frame, int(pi.getINDI('NOMIC.CamInfo.FIndex'))))
+      self.n_steps = self.n_steps + 1
+      k = k + 1
+
+
+class SetpointTracker(threading.Thread):
+  """
+  Keeps the phase setpoint (UBC) on the null while a null sequence is
+  taken with the OPD dither pattern running, so that no new setpoint
+  search is needed after each nod.
+  
+  The tracker knows which dither position every frame was taken at from
+  the dither pattern and the file number the pattern started at. It
+  reads the null (NullingStats) of a few frames at each dither position
+  and, after every full dither cycle, fits a parabola to null vs.
+  setpoint over the last 'fit_cycles' cycles (lock-in on the dither
+  modulation). The offset of the vertex from the nominal setpoint is the
+  setpoint error.
+  If it is significant, 'nomic_setpoint_track_gain' times the error
+  (at most 'nomic_setpoint_track_max_step' degrees) is applied to the
+  nominal setpoint. The correction is sent while the current dither
+  position is held, through the DitherTask running the pattern if one is
+  given (so that its timeline follows the corrected setpoint).
+  
+  Uses the dither pattern of the DitherTask (or 'nomic_dither_opd_pattern',
+  'nomic_dither_opd_ndits', and 'nomic_dither_opd_off0' without one),
+  'nomic_setpoint_track_gain', 'nomic_setpoint_track_max_step',
+  'nomic_setpoint_track_frames', and 'nomic_setpoint_clip' of a
+  configuration dictionary.
+  
+  Usage:
+   >> tracker = SetpointTracker(cfg, file_number, dither=dither)   # file number the dither pattern started at
+   >> tracker.start()
+   >> ...
+   >> tracker.stop()
+  """
+  
+  def __init__(self, cfg, file_number, settle=2, fit_cycles=4, camera='NOMIC', dither=None):
+    threading.Thread.__init__(self, name='tracker')
+    self.setDaemon(True)
+    self.camera = camera
+    self.dither = dither                                  # DitherTask running the pattern, corrections go through it
+    self.gain = cfg['nomic_setpoint_track_gain']
+    self.max_step = cfg['nomic_setpoint_track_max_step']
+    self.n_frames = cfg['nomic_setpoint_track_frames']   # frames read per dither position
+    self.clip = cfg['nomic_setpoint_clip']               # sigma clipping of the ROI means
+    self.settle = settle                                  # frames skipped after each dither offset
+    self.fit_cycles = fit_cycles                          # number of dither cycles in the fit
+    if dither is not None:
+      pattern = dither.pattern
+    else:
+      pattern = DitherPattern.from_config(cfg)
+    self.starts = int(file_number) + pattern.starts   # first frame of each dither position (and of the next cycle)
+    self.positions = pattern.positions                # dither offset at each position
+    self.drift = pattern.drift                        # offset left after one cycle (0.0 for closed patterns)
+    self.correction = 0.0   # total correction applied to the nominal setpoint
+    self.n_cycles = 0
+    self.n_updates = 0
+    self.stopped = threading.Event()
+  
+  def stop(self, timeout=10.0):
+    """
+    Stops the tracker and prints a summary.
+    """
+    self.stopped.set()
+    self.join(timeout)
+    info('Setpoint tracker: %i dither cycles, %i corrections, total correction %.1f deg.' % (self.n_cycles, self.n_updates, self.correction))
+  
+  def run(self):
+    pi.use_channel(self.getName())
+    stats = NullingStatsReader(self.camera)
+    clock = FrameClock(stats, self.camera, timeout=10)
+    fit = QuadraticFit()
+    roi_noise = NoisePool(size=3)   # ROI noise pooled over the dither positions, to clip the few frames of each against
+    samples = []   # (cycle, setpoint, null, std of null) in the fit
+    cycle = 0
+    while not self.stopped.isSet():
+      frame0 = (self.starts[-1] - self.starts[0]) * cycle
+      for i_pos in range(len(self.positions)):
+        first = frame0 + self.starts[i_pos] + self.settle
+        end = frame0 + self.starts[i_pos+1]   # first frame at the next position
+        if not self._wait_frame(first):
+          return
+        clock.last = max(clock.last or 0, first - 1)
+        try:
+          data = clock.next_n(min(self.n_frames, end - first))
+        except Exception:
+          continue   # no frames (e.g., sequence aborted), try the next position
+        data = data[stats.column(data, 'frame') < end]   # ignore frames taken at the next position
+        if len(data) == 0:
+          continue
+        null, null_err, n_rejected = stats.robust_null(data, self.clip, roi_noise)
+        sample = (self.correction + self.positions[i_pos] + self.drift * cycle, null, max(null_err, 1e-3))
+        fit.add(*sample)
+        samples.append((cycle,) + sample)
+      self._update(fit, cycle, end)
+      cycle = cycle + 1
+      for sample in samples:
+        if sample[0] <= cycle - self.fit_cycles:
+          fit.drop(*sample[1:])
+      samples = [sample for sample in samples if sample[0] > cycle - self.fit_cycles]
+      self.n_cycles = cycle
+  
+  def _wait_frame(self, frame):
+    # wait for a frame in short steps, so that stop() is noticed
+    while not self.stopped.isSet():
+      if wait_eval('"%s.CamInfo.FIndex" >= %d' % (self.camera, frame), timeout=1.0):
+        return True
+    return False
+  
+  def _update(self, fit, cycle, end):
+    # apply the correction measured over one dither cycle
+    vertex, vertex_std = fit.vertex()
+    if vertex is None:
+      return
+    error = vertex - (self.correction + self.drift * cycle)
+    if np.abs(error) <= vertex_std:
+      return   # not significant
+    step = np.clip(self.gain * error, -self.max_step, self.max_step)
+    if pi.getINDI('%s.CamInfo.FIndex' % (self.camera)) >= end - 2:
+      return   # too late, the dither pattern is about to send its next offset
+    if self.dither is not None:
+      self.dither.shift(step)
+    else:
+      setpoint = pi.getINDI('PLC.UBCSettings.PLSetpoint')
+      pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint + step) + ';forNAC=0')
+    self.correction = self.correction + step
+    self.n_updates = self.n_updates + 1
+
+
+class SetpointRamper(threading.Thread):
+  """
+  Moves the phase setpoint toward a target in its own thread, in steps
+  of at most max_step degrees and at most 'rate' degrees per second
+  (0 or None for no rate limit). move() returns at once. A new target
+  replaces the previous one even if it was not reached yet, so steps
+  toward a superseded target are never sent. wait() blocks until the
+  current target has been sent, so that the caller can prepare the next
+  measurement while the ramp is still running.
+  
+  Usage:
+   >> ramper = SetpointRamper('UBC', max_step=45.0, rate=0)
+   >> ramper.start()
+   >> ramper.move(setpoint)      # returns at once
+   >> ramper.wait()              # until setpoint was sent
+   >> ramper.stop()              # finishes the ramp, then stops
+  """
+  
+  def __init__(self, pzt='UBC', max_step=45.0, rate=0, setpoint=None):
+    threading.Thread.__init__(self, name='ramper')
+    self.setDaemon(True)
+    if pzt == 'UBC':
+      self.forNAC = '0'
+    else: # if pzt == 'NAC'
+      self.forNAC = '1'
+    if setpoint is None:
+      setpoint = pi.getINDI('PLC.%sSettings.PLSetpoint' % (pzt))
+    self.max_step = float(max_step)
+    self.rate = rate
+    self.current = float(setpoint)   # last setpoint sent
+    self.target = self.current
+    self.n_sent = 0                  # number of steps sent
+    self.n_superseded = 0            # number of targets replaced before they were reached
+    self.error = None
+    self.stopped = False
+    self.condition = threading.Condition()
+    self.reached = threading.Event()
+    self.reached.set()
+  
+  def move(self, setpoint):
+    """
+    Sets a new target setpoint and returns at once.
+    """
+    self.condition.acquire()
+    try:
+      if not self.reached.isSet():
+        self.n_superseded = self.n_superseded + 1
+      self.target = float(setpoint)
+      if self.target != self.current:
+        self.reached.clear()
+      self.condition.notify()
+    finally:
+      self.condition.release()
+  
+  def wait(self, timeout=None):
+    """
+    Waits until the target setpoint was sent. Returns False on timeout.
+    Raises the error of the ramp thread, if any.
+    """
+    self.reached.wait(timeout)
+    if self.error is not None:
+      raise self.error
+    return self.reached.isSet()
+  
+  def stop(self, timeout=None):
+    """
+    Waits for the current ramp to finish and stops the thread.
+    """
+    self.wait(timeout)
+    self.condition.acquire()
+    try:
+      self.stopped = True
+      self.condition.notify()
+    finally:
+      self.condition.release()
+    self.join(timeout)
+  
+  def run(self):
+    pi.use_channel(self.getName())
+    while True:
+      self.condition.acquire()
+      try:
+        while (self.target == self.current) and (not self.stopped):
+          self.condition.wait(1.0)
+        if self.stopped:
+          return
+        step = np.clip(self.target - self.current, -self.max_step, self.max_step)
+        setpoint = self.current + step
+        if np.abs(self.target - setpoint) < 1e-9:
+          setpoint = self.target   # final step, no rounding error
+      finally:
+        self.condition.release()
+      
+      t0 = time.time()
+      try:
+        pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint) + ';forNAC=' + self.forNAC)
+      except Exception, error:
+        self.error = error
+        self.reached.set()   # wake up waiting callers, they raise the error
+        return
+      
+      self.condition.acquire()
+      try:
+        self.current = setpoint
+        self.n_sent = self.n_sent + 1
+        if self.current == self.target:
+          self.reached.set()
+      finally:
+        self.condition.release()
+      if self.rate:
+        sleep(max(0.0, np.abs(step) / self.rate - (time.time() - t0)))
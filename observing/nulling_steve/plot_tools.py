@@ -0,0 +1,117 @@
+import numpy as np
+from multiprocessing import Event, Process, Queue
+
+def _render(queue, output, filename, done):
+  """
+  Runs in the renderer process: imports matplotlib, sets up the figure
+  and plots every scan received through the queue until None arrives,
+  then sets done.
+  """
+  from matplotlib import use as mpl_use
+  if output in ['screen', 'both']:
+    mpl_use('tkagg')    # needed for interactive mode
+  else:
+    mpl_use('agg')
+  import matplotlib.pyplot as plt
+
+  if output in ['screen', 'both']:
+    plt.ion()  # Turn on interactive mode
+  plt.figure(1)
+  plt.ylabel('Mean flux at null [ADU]')
+  plt.xlabel('Phase [degrees]')
+  plt.title('Setpoint optimization')
+  if output in ['screen', 'both']:
+    plt.draw()
+
+  while True:
+    try:
+      item = queue.get(True, 0.1)
+    except Exception:
+      if output in ['screen', 'both']:
+        plt.pause(0.05)   # keep the window responsive while waiting
+      continue
+    if item is None:
+      break
+    setpoints, null, null_std, z, plot_range_x, curve = item
+    plt.errorbar(setpoints, null, null_std, marker='o', linestyle='.')
+    if z is not None:
+      xp = np.linspace(plot_range_x[0], plot_range_x[1], 30)
+      plt.plot(xp, np.poly1d(z)(xp), linestyle='-', color='black')
+    if (curve is not None) and (curve[1] is not None):
+      plt.plot(curve[0], curve[1], linestyle='-', color='black')
+    if output in ['screen', 'both']:
+      plt.draw()
+      plt.pause(0.001)
+    if output in ['file', 'both']:
+      plt.savefig(filename)
+
+  done.set()
+  if output in ['screen', 'both']:
+    plt.ioff()
+    plt.show()    # keep the window open until it is closed by the user or the calling process ends
+
+
+class SetpointPlotter(object):
+  """
+  Plots the setpoint scans in a separate renderer process, fed through a
+  queue, so that the scan timing does not depend on the display.
+  matplotlib is only imported (in the renderer process) if output is
+  not 'none'; with output = 'none' all calls do nothing.
+
+  output is 'screen', 'file', 'both', or 'none', as given by the
+  configuration parameter 'nomic_setpoint_output'.
+
+  On screen, the window stays open after close() until the user closes
+  it or the calling process ends (the renderer is a daemon process, so
+  it never keeps a script from exiting).
+
+  Usage:
+   >> plotter = SetpointPlotter(cfg['nomic_setpoint_output'])
+   >> plotter.plot(setpoints, null_tot, null_std, z, [x_min, x_max])
+   >> plotter.close()
+  """
+
+  def __init__(self, output='none', filename='setpoint.pdf'):
+    self.output = output
+    self.queue = None
+    self.process = None
+    if output == 'none':
+      return
+    if output in ['screen', 'both']:
+      print('')
+      print('  Initializing display.')
+    if output in ['file', 'both']:
+      print('')
+      print('  Plotting to file.')
+    self.queue = Queue()
+    self.done = Event()
+    self.process = Process(target=_render, args=(self.queue, output, filename, self.done))
+    self.process.daemon = True
+    self.process.start()
+
+  def plot(self, setpoints, null, null_std, z=None, plot_range_x=None, curve=None):
+    """
+    Sends one scan (and optionally the polynomial z fitted to it, drawn
+    over plot_range_x, or a model curve given as (x, y)) to the
+    renderer. Does not wait for the plot.
+    """
+    if self.queue is None:
+      return
+    self.queue.put((np.array(setpoints), np.array(null), np.array(null_std), z, plot_range_x, curve))
+
+  def close(self, timeout=10.0):
+    """
+    Lets the renderer finish the queued plots and stops it. Waits for
+    the file to be written, but not for a window to be closed.
+    """
+    if self.queue is None:
+      return
+    self.queue.put(None)
+    if self.output in ['file', 'both']:
+      for i in range(int(timeout / 0.1)):   # until the file is written (or the renderer failed)
+        self.done.wait(0.1)
+        if self.done.is_set() or not self.process.is_alive():
+          break
+    if self.output == 'file':
+      self.process.join(timeout)
+    self.queue = None
@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+class Profiler(object):
+  """
+  Records every INDI call (getINDI, setINDI, getFITS, evalINDI, getKeys)
+  made through the nomops session: property name (device.property),
+  latency and wait flag. Calls are rolled into per-property latency
+  histograms and into per-function totals for the functions decorated
+  with @profiled (take_null, nod, find_setpoint, ...). Only aggregates
+  are kept, so the profiler can run for a whole night.
+
+  Usage:
+   >> profiler.report()            # print the report
+   >> profiler.report('night.txt') # or write it to a file
+   >> profiler.reset()
+  """
+
+  methods = ['getINDI', 'setINDI', 'getFITS', 'evalINDI', 'getKeys']
+  bins = [0.0, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0]   # histogram bin edges in s
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.reset()
+
+  def reset(self):
+    """
+    Forgets everything recorded so far.
+    """
+    self.lock.acquire()
+    try:
+      self.properties = {}   # (method, property) -> [n, total, max, n_wait, histogram]
+      self.sections = {}     # section -> [n runs, wall time, n INDI calls, INDI time]
+      self.t_start = time.time()
+    finally:
+      self.lock.release()
+
+  def current(self):
+    """
+    Returns the name of the innermost profiled function running in this
+    thread, or None.
+    """
+    stack = getattr(self.local, 'stack', [])
+    if len(stack) > 0:
+      return stack[-1]
+    return None
+
+  def enter(self, section):
+    if not hasattr(self.local, 'stack'):
+      self.local.stack = []
+    self.local.stack.append(section)
+
+  def leave(self, wall_time=None):
+    # wall_time None: the section is left without counting a call of it (e.g., by a task it started)
+    section = self.local.stack.pop()
+    if wall_time is None:
+      return
+    self.lock.acquire()
+    try:
+      entry = self.sections.setdefault(section, [0, 0.0, 0, 0.0])
+      entry[0] = entry[0] + 1
+      entry[1] = entry[1] + wall_time
+    finally:
+      self.lock.release()
+
+  def record(self, method, prop, latency, wait):
+    """
+    Records one INDI call.
+    """
+    self.lock.acquire()
+    try:
+      entry = self.properties.get((method, prop))
+      if entry is None:
+        entry = [0, 0.0, 0.0, 0, np.zeros(len(self.bins), dtype=int)]
+        self.properties[(method, prop)] = entry
+      entry[0] = entry[0] + 1
+      entry[1] = entry[1] + latency
+      entry[2] = max(entry[2], latency)
+      if wait:
+        entry[3] = entry[3] + 1
+      entry[4][np.searchsorted(self.bins, latency, side='right') - 1] += 1
+      stack = getattr(self.local, 'stack', [])
+      for section in set(stack):
+        totals = self.sections.setdefault(section, [0, 0.0, 0, 0.0])
+        totals[2] = totals[2] + 1
+        totals[3] = totals[3] + latency
+    finally:
+      self.lock.release()
+
+  def count(self):
+    """
+    Returns the number of INDI calls recorded since the last reset (all
+    threads).
+    """
+    self.lock.acquire()
+    try:
+      return sum([entry[0] for entry in self.properties.values()])
+    finally:
+      self.lock.release()
+
+  def call(self, method, function, args, kwargs):
+    """
+    Calls an INDI function and records it.
+    """
+    t0 = time.time()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      self.record(method, property_name(method, args, kwargs), time.time() - t0, kwargs.get('wait', True))
+
+  def wrap(self, indi):
+    """
+    Returns a stand-in for a PyINDI instance which records all calls,
+    for scripts which do not use the nomops session.
+
+    Usage:
+     >> pi = profiler.wrap(PyINDI(verbose=False))
+    """
+    return _Profiled(self, indi)
+
+  def report(self, filename=None):
+    """
+    Prints the per-function totals and the per-property latency
+    histograms, or writes them to a file if a filename is given.
+    """
+    lines = []
+    lines.append('INDI round-trip profile (%.1f s since reset)' % (time.time() - self.t_start))
+    lines.append('')
+    lines.append('  %-28s %5s %10s %7s %10s %6s' % ('function', 'runs', 'wall [s]', 'calls', 'INDI [s]', 'INDI %'))
+    names = self.sections.keys()
+    names.sort()
+    for name in names:
+      n, wall, n_calls, t_indi = self.sections[name]
+      share = 0.0
+      if wall > 0.0:
+        share = 100.0 * t_indi / wall
+      lines.append('  %-28s %5i %10.2f %7i %10.2f %6.1f' % (name, n, wall, n_calls, t_indi, share))
+    lines.append('')
+    header = ' '.join(['%6s' % (_bin_label(edge)) for edge in self.bins])
+    lines.append('  %-9s %-30s %6s %9s %8s %8s %6s  %s' % ('method', 'property', 'calls', 'total [s]', 'mean [ms]', 'max [ms]', 'wait', header))
+    keys = self.properties.keys()
+    keys.sort(key=lambda key: -self.properties[key][1])   # most expensive first
+    for key in keys:
+      n, total, t_max, n_wait, hist = self.properties[key]
+      lines.append('  %-9s %-30s %6i %9.2f %8.1f %8.1f %6i  %s' % (key[0], key[1], n, total, 1000.0 * total / n, 1000.0 * t_max, n_wait, ' '.join(['%6i' % (h) for h in hist])))
+    if filename is None:
+      print('')
+      for line in lines:
+        print(line)
+      print('')
+    else:
+      f = open(filename, 'w')
+      f.write('\n'.join(lines) + '\n')
+      f.close()
+
+
+class _Profiled(object):
+  def __init__(self, profiler, indi):
+    self._profiler = profiler
+    self._indi = indi
+
+  def __getattr__(self, name):
+    attr = getattr(self._indi, name)
+    if name not in Profiler.methods:
+      return attr
+    profiler = self._profiler
+    def call(*args, **kwargs):
+      return profiler.call(name, attr, args, kwargs)
+    return call
+
+
+class RunLog(object):
+  """
+  Log of timing records, one JSON dictionary per line, appended to a
+  file as they come (e.g., one record per setpoint search with the
+  method, number of probes, frames and INDI calls, and wall time), so
+  that the records of many nights can be compared. summary() prints the
+  medians per method (or per any other record key).
+
+  Usage:
+   >> setpoint_log.append({'method': 'scan', 'wall_time': 12.3, 'probes': 10})
+   >> setpoint_log.summary()
+   >> setpoint_log.summary(['method', 'nod_position'])
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+
+  def append(self, record):
+    """
+    Appends a record, with the current time added as 'time'.
+    """
+    record = dict(record)
+    record['time'] = time.time()
+    f = open(self.filename, 'a')
+    try:
+      f.write(json.dumps(record, sort_keys=True) + '\n')
+    finally:
+      f.close()
+
+  def load(self):
+    """
+    Returns all records as a list of dictionaries (none if there is no
+    log file). Lines which cannot be read are skipped.
+    """
+    records = []
+    try:
+      f = open(self.filename, 'r')
+    except IOError:
+      return records
+    try:
+      for line in f:
+        try:
+          records.append(json.loads(line))
+        except ValueError:
+          pass
+    finally:
+      f.close()
+    return records
+
+  def summary(self, keys=['method'], columns=['wall_time', 'probes', 'frames', 'indi_calls', 'setpoint_std']):
+    """
+    Prints the number of records and the median of some columns for
+    each combination of the values of keys.
+    """
+    groups = {}
+    for record in self.load():
+      group = tuple([record.get(key) for key in keys])
+      groups.setdefault(group, []).append(record)
+    print('')
+    print('  %-30s %5s %6s' % ('/'.join(keys), 'runs', 'conv.') + ''.join([' %12s' % (column) for column in columns]))
+    names = groups.keys()
+    names.sort()
+    for name in names:
+      records = groups[name]
+      n_converged = len([record for record in records if record.get('converged')])
+      line = '  %-30s %5i %6i' % ('/'.join([str(value) for value in name]), len(records), n_converged)
+      for column in columns:
+        values = [record[column] for record in records if record.get(column) is not None]
+        if len(values) > 0:
+          line = line + ' %12.2f' % (np.median(values))
+        else:
+          line = line + ' %12s' % ('-')
+      print(line)
+    print('')
+
+
+def profiled(function):
+  """
+  Decorator which attributes the INDI calls made while the decorated
+  function runs (including nested calls) to that function.
+  """
+  def wrapper(*args, **kwargs):
+    profiler.enter(function.__name__)
+    t0 = time.time()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      profiler.leave(time.time() - t0)
+  wrapper.__name__ = function.__name__
+  wrapper.__doc__ = function.__doc__
+  return wrapper
+
+
+def property_name(method, args, kwargs):
+  """
+  Returns 'device.property' for the arguments of an INDI call, e.g.
+  'PLC.PLSetpoint' for setINDI('PLC.PLSetpoint.PLSetpoint=10.0;forNAC=0').
+  """
+  if method == 'getKeys':
+    return '%s.%s' % (kwargs.get('device', '?'), kwargs.get('prop', '?'))
+  if len(args) == 0:
+    return '?'
+  name = args[0]
+  if isinstance(name, dict):
+    if len(name) == 0:
+      return '?'
+    name = min(name.keys())
+  name = str(name).strip('"').split('=')[0]
+  if method == 'evalINDI':
+    name = name.split('"')[0]
+  return '.'.join(name.split('.')[:2])
+
+
+def _bin_label(edge):
+  if edge < 1.0:
+    return '>%ims' % (int(round(1000 * edge)))
+  return '>%is' % (int(edge))
+
+
+profiler = Profiler()
+setpoint_log = RunLog(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'setpoint_runs.log'))   # next to the code, whatever the working directory
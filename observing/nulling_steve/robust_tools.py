@@ -0,0 +1,302 @@
+import numpy as np
+
+mad_to_sigma = 1.4826   # sigma of a Gaussian / median absolute deviation
+
+class P2Quantile(object):
+  """
+  Streaming estimate of a quantile (e.g., the median) with the P-square
+  algorithm (Jain & Chlamtac 1985): five markers per channel are moved
+  along a piecewise parabolic approximation of the distribution, so the
+  memory is constant however many values are added. Works on several
+  independent channels at once (e.g., one per ROI), every add() takes
+  one value per channel. The first five values are kept and the quantile
+  is exact up to then.
+
+  Usage:
+   >> median = P2Quantile(0.5, size=3)
+   >> median.add([m1, m2, m3])
+   >> print(median.value())
+  """
+
+  def __init__(self, p=0.5, size=1):
+    self.p = float(p)
+    self.size = size
+    self.count = 0
+    self.q = np.zeros((5, size))                                             # marker heights
+    self.n = np.tile(np.arange(5.0)[:,None], (1, size))                      # marker positions
+    self.desired = np.array([0.0, 2.0*p, 4.0*p, 2.0 + 2.0*p, 4.0])           # desired marker positions
+    self.increment = np.array([0.0, 0.5*p, p, 0.5*(1.0 + p), 1.0])
+
+  def add(self, x):
+    """
+    Adds one value per channel.
+    """
+    x = np.asarray(x, dtype=float).reshape(self.size)
+    if self.count < 5:
+      self.q[self.count] = x
+      self.count = self.count + 1
+      if self.count == 5:
+        self.q.sort(axis=0)
+      return
+    self.count = self.count + 1
+    channels = np.arange(self.size)
+    self.q[0] = np.minimum(self.q[0], x)
+    self.q[4] = np.maximum(self.q[4], x)
+    k = np.clip(np.sum(x[None,:] >= self.q[1:4], axis=0), 0, 3)             # cell of x, q[k] <= x < q[k+1]
+    self.n = self.n + (np.arange(5)[:,None] > k[None,:])
+    self.desired = self.desired + self.increment
+    for i in [1, 2, 3]:
+      d = self.desired[i] - self.n[i]
+      move = ((d >= 1.0) & (self.n[i+1] - self.n[i] > 1.0)) | ((d <= -1.0) & (self.n[i-1] - self.n[i] < -1.0))
+      if not np.any(move):
+        continue
+      d = np.sign(d[move])
+      q0, q1, q2 = self.q[i-1, move], self.q[i, move], self.q[i+1, move]
+      n0, n1, n2 = self.n[i-1, move], self.n[i, move], self.n[i+1, move]
+      parabolic = q1 + d / (n2 - n0) * ((n1 - n0 + d) * (q2 - q1) / (n2 - n1) + (n2 - n1 - d) * (q1 - q0) / (n1 - n0))
+      j = np.where(d > 0, i + 1, i - 1)
+      qj, nj = self.q[j, channels[move]], self.n[j, channels[move]]
+      linear = q1 + d * (qj - q1) / (nj - n1)
+      self.q[i, move] = np.where((q0 < parabolic) & (parabolic < q2), parabolic, linear)
+      self.n[i, move] = n1 + d
+
+  def value(self):
+    """
+    Returns the current estimate per channel (NaN before the first value).
+    """
+    if self.count == 0:
+      return np.nan * np.ones(self.size)
+    if self.count <= 5:
+      return np.percentile(self.q[0:self.count], 100.0 * self.p, axis=0)
+    return self.q[2].copy()
+
+
+def _nanstd(values):
+  # standard deviation over axis 0, ignoring NaN (np.nanstd is not available with older NumPy)
+  finite = np.isfinite(values)
+  n = np.sum(finite, axis=0)
+  mean = np.sum(np.where(finite, values, 0.0), axis=0) / np.maximum(n, 1)
+  ss = np.sum(np.where(finite, values - mean, 0.0)**2, axis=0)
+  return np.sqrt(ss / np.maximum(n - 1.0, 1.0))
+
+
+class RobustStats(object):
+  """
+  Streaming sigma-clipped mean per channel (e.g., the mean of each NOMIC
+  ROI over frames), with constant memory. The running median and median
+  absolute deviation (MAD) of each channel are tracked with P2Quantile;
+  a value further than 'clip' sigma from the running median is
+  rejected, all other values go into a running mean and variance
+  (Welford). A cosmic or a hot pixel in one frame therefore does not
+  bias the mean, and no frames have to be averaged in to dilute it.
+
+  Nothing is clipped before 'warmup' values arrived: the sigma of a few
+  values is too uncertain to clip at, and Gaussian data would lose good
+  values (and get a too small uncertainty) far more often than at the
+  nominal clip level. The first warmup values are kept, clipped exactly
+  once there are warmup of them, and used to start the P2Quantile
+  estimates. The clipping sigma is the larger of 1.4826 * MAD and the
+  standard deviation of the values used so far (a pooled estimate, so
+  that a MAD which is small by chance does not reject good values), and
+  at least min_sigma (e.g., for digitized values where the MAD can be 0).
+  At the end of the warmup, the standard deviation is taken over the
+  values within 2 * clip MAD sigma of the median, so that gross
+  outliers do not inflate it.
+
+  Usage:
+   >> rois = RobustStats(size=3)
+   >> for row in data: rois.add(row)    # e.g., Mean1, Mean2, Mean3 of one frame
+   >> print(rois.mean(), rois.error(), rois.n_rejected)
+  """
+
+  def __init__(self, size=1, clip=5.0, warmup=10, min_sigma=0.0):
+    self.size = size
+    self.clip = clip
+    self.warmup = warmup
+    self.min_sigma = min_sigma
+    self.median_ = P2Quantile(0.5, size)
+    self.mad_ = P2Quantile(0.5, size)
+    self.buffer = []                       # the first warmup values
+    self.clear_moments()
+
+  def clear_moments(self):
+    self.n_used = np.zeros(self.size)      # values used for the mean, per channel
+    self.n_rejected = np.zeros(self.size)  # values rejected, per channel
+    self.mean_ = np.zeros(self.size)
+    self.m2 = np.zeros(self.size)          # sum of squared deviations from the mean (Welford)
+
+  def _accumulate(self, x, accept):
+    n = self.n_used + accept
+    delta = np.where(accept, x - self.mean_, 0.0)
+    self.mean_ = self.mean_ + np.where(accept, delta / np.maximum(n, 1.0), 0.0)
+    self.m2 = self.m2 + np.where(accept, delta * (x - self.mean_), 0.0)
+    self.n_used = n
+    self.n_rejected = self.n_rejected + np.logical_not(accept)
+
+  def _accept(self, x, median, sigma):
+    return np.abs(x - median) <= self.clip * np.maximum(sigma, self.min_sigma)
+
+  def add(self, x):
+    """
+    Adds one value per channel.
+    """
+    x = np.asarray(x, dtype=float).reshape(self.size)
+    if len(self.buffer) < self.warmup:
+      self.buffer.append(x)
+      self.median_.add(x)
+      if len(self.buffer) < self.warmup:
+        self._accumulate(x, np.ones(self.size, dtype=bool))   # no clipping yet
+        return
+      # exact clipping of the warmup values, with the median and MAD of all of them
+      values = np.array(self.buffer)
+      median = np.median(values, axis=0)
+      deviations = np.abs(values - median)
+      sigma = mad_to_sigma * np.median(deviations, axis=0)
+      inliers = np.where(deviations <= 2.0 * self.clip * np.maximum(sigma, self.min_sigma), values, np.nan)   # std without gross outliers
+      sigma = np.maximum(sigma, _nanstd(inliers))
+      self.clear_moments()
+      for value in values:
+        self._accumulate(value, self._accept(value, median, sigma))
+      for deviation in deviations:
+        self.mad_.add(deviation)
+      return
+    median = self.median_.value()
+    sigma = np.maximum(mad_to_sigma * self.mad_.value(), self.std())
+    self._accumulate(x, self._accept(x, median, sigma))
+    self.median_.add(x)
+    self.mad_.add(np.abs(x - median))
+
+  def count(self):
+    """
+    Returns the number of values added per channel.
+    """
+    return self.n_used + self.n_rejected
+
+  def mean(self):
+    """
+    Returns the clipped mean per channel.
+    """
+    return self.mean_.copy()
+
+  def std(self):
+    """
+    Returns the standard deviation of the values used per channel.
+    """
+    return np.sqrt(self.m2 / np.maximum(self.n_used - 1.0, 1.0))
+
+  def error(self):
+    """
+    Returns the uncertainty of the clipped mean per channel.
+    """
+    return self.std() / np.sqrt(np.maximum(self.n_used, 1.0))
+
+  def median(self):
+    """
+    Returns the running median per channel.
+    """
+    if len(self.buffer) < self.warmup:
+      return np.median(np.array(self.buffer), axis=0)
+    return self.median_.value()
+
+  def sigma(self):
+    """
+    Returns the robust standard deviation (1.4826 * MAD) per channel.
+    """
+    if len(self.buffer) < self.warmup:
+      values = np.array(self.buffer)
+      return mad_to_sigma * np.median(np.abs(values - np.median(values, axis=0)), axis=0)
+    return mad_to_sigma * self.mad_.value()
+
+
+class NoisePool(object):
+  """
+  Noise (standard deviation) per channel pooled over many short stacks,
+  e.g., the ROI means of the few frames of each setpoint probe. The mean
+  may differ from stack to stack (the null changes with the setpoint),
+  the noise is assumed to be the same. Every stack gives one variance
+  per channel, the pooled variance is their running median (P2Quantile,
+  constant memory), so that a stack with a cosmic does not inflate it.
+  The variance of a stack with k degrees of freedom is divided by the
+  median of chi2(k)/k, (1 - 2/(9k))**3 (Wilson-Hilferty), so that stacks
+  of any length estimate the same variance. Once 'warmup' stacks were
+  added, robust_null clips stacks of any length (3 frames or more)
+  against this scale, instead of against the scale of the stack itself.
+
+  Usage:
+   >> pool = NoisePool(size=3)
+   >> for data in stacks: null, null_err, n_rejected = robust_null(data, pool=pool)
+   >> print(pool.sigma())
+  """
+
+  def __init__(self, size=1, warmup=5):
+    self.size = size
+    self.warmup = warmup
+    self.variance = P2Quantile(0.5, size)   # running median of the normalized stack variances
+
+  def add(self, m2, n_used):
+    """
+    Adds the sum of squared deviations from its mean and the number of
+    values used of one stack, per channel. Stacks of a single value are
+    ignored.
+    """
+    dof = np.asarray(n_used, dtype=float).reshape(self.size) - 1.0
+    if np.any(dof < 1.0):
+      return
+    self.variance.add(np.asarray(m2, dtype=float).reshape(self.size) / dof / (1.0 - 2.0 / (9.0 * dof))**3)
+
+  def sigma(self):
+    """
+    Returns the pooled standard deviation per channel, or None before
+    warmup stacks were added.
+    """
+    if self.variance.count < self.warmup:
+      return None
+    return np.sqrt(self.variance.value())
+
+
+def _clip_stack(means, clip, sigma):
+  # clips a whole stack against its median with a known sigma per channel,
+  # returns the mean, the sum of squared deviations, the number of values used and rejected per channel
+  accept = np.abs(means - np.median(means, axis=0)) <= clip * sigma
+  accept = accept | np.logical_not(np.any(accept, axis=0))   # e.g., 2 values far apart: keep both, it is not known which one is bad
+  n_used = np.sum(accept, axis=0)
+  mean = np.sum(np.where(accept, means, 0.0), axis=0) / n_used
+  m2 = np.sum(np.where(accept, means - mean, 0.0)**2, axis=0)
+  return mean, m2, n_used, len(means) - n_used
+
+
+def robust_null(means, clip=5.0, pool=None):
+  """
+  Returns the background subtracted flux at null,
+  Mean3 - 0.5 * (Mean1 + Mean2), from the sigma-clipped means of the
+  three ROIs over frames, its uncertainty, and the number of rejected
+  values. means is an (n, 3) array with the ROI means Mean1, Mean2,
+  Mean3 of n frames.
+
+  Without a pool, the values are clipped with RobustStats (i.e., not at
+  all below its warmup of 10 frames). With a NoisePool (kept by the
+  caller over all stacks of a search), the stack is clipped against its
+  median with the pooled sigma once the pool has enough degrees of
+  freedom, and the values used are added to the pool.
+
+  Usage:
+   >> null, null_err, n_rejected = robust_null(np.array([m1, m2, m3]).T)
+   >> pool = NoisePool(size=3)
+   >> null, null_err, n_rejected = robust_null(np.array([m1, m2, m3]).T, pool=pool)
+  """
+  means = np.asarray(means, dtype=float).reshape(-1, 3)
+  sigma = None
+  if pool is not None:
+    sigma = pool.sigma()
+  if sigma is None:
+    rois = RobustStats(size=3, clip=clip)
+    for row in means:
+      rois.add(row)
+    mean, m2, n_used, n_rejected = rois.mean(), rois.m2, rois.n_used, rois.n_rejected
+  else:
+    mean, m2, n_used, n_rejected = _clip_stack(means, clip, sigma)
+  if pool is not None:
+    pool.add(m2, n_used)
+  error = np.sqrt(m2 / np.maximum(n_used - 1.0, 1.0)) / np.sqrt(np.maximum(n_used, 1.0))
+  weights = np.array([-0.5, -0.5, 1.0])
+  return np.dot(weights, mean), np.sqrt(np.dot(weights**2, error**2)), int(np.sum(n_rejected))
@@ -0,0 +1,110 @@
+from pyindi import *
+from print_tools import *
+from session_tools import pi
+
+class ROIRegistry(object):
+  """
+  Keeps the geometry (X, Y, H, W) of the NOMIC ROIs client-side. After
+  one sync() (a QueryROI set + get per ROI), offsets are applied locally
+  and all changed ROIs are sent with push() in one batch, i.e., the
+  DefROI updates are sent back to back and only the last one waits for
+  the server. check() compares one ROI with the server (cycling through
+  the ROIs on each call, 2 round trips) and re-syncs all of them if it
+  has drifted, e.g., because the ROIs were moved by hand on the display.
+  check(full=True) compares all ROIs (2 round trips per ROI), e.g., once
+  at the start of an observing sequence.
+
+  Usage:
+   >> nomic_rois.check(full=True)  # re-syncs if needed (first call always syncs)
+   >> nomic_rois.offset(dy=128)    # nod offset in pixels
+   >> nomic_rois.push()
+  """
+
+  def __init__(self, ids=[1,2,3], camera='NOMIC', tolerance=0.5):
+    self.ids = list(ids)
+    self.camera = camera
+    self.tolerance = tolerance   # maximum difference to server geometry in pixels
+    self.geometry = {}           # ROI ID -> {'X': .., 'Y': .., 'H': .., 'W': ..}
+    self.changed = []            # ROI IDs changed locally but not pushed yet
+    self.i_check = 0             # next ROI compared by check()
+
+  def query(self, roi_id):
+    """
+    Reads the geometry of one ROI from the server (two round trips:
+    QueryROI answers for the ROI ID set last, so the ROIs can not be
+    read together).
+    """
+    prefix = '%s.QueryROI.' % (self.camera)
+    qroi = dict([(prefix + 'ROIID', roi_id), (prefix + 'X', 0.0), (prefix + 'Y', 0.0), (prefix + 'H', 0.0), (prefix + 'W', 0.0)])
+    pi.setINDI(qroi)
+    qroi = pi.getINDI(prefix + '*')
+    return dict([(key, qroi[prefix + key]) for key in ['X', 'Y', 'H', 'W']])
+
+  def sync(self):
+    """
+    Reads the geometry of all ROIs from the server. Local changes which
+    were not pushed are lost.
+    """
+    for roi_id in self.ids:
+      self.geometry[roi_id] = self.query(roi_id)
+    self.changed = []
+
+  def check(self, full=False):
+    """
+    Compares one ROI (all ROIs if full) with the server and takes the
+    server geometry of all ROIs if any differs by more than the
+    tolerance. Syncs if the registry is empty. Returns True if the
+    registry was in sync.
+    """
+    if len(self.geometry) < len(self.ids):
+      self.sync()
+      return False
+    if full:
+      ids = self.ids
+    else:
+      ids = [self.ids[self.i_check % len(self.ids)]]
+      self.i_check = self.i_check + 1
+    server = dict([(roi_id, self.query(roi_id)) for roi_id in ids])
+    moved = [roi_id for roi_id in ids
+             if max([abs(server[roi_id][key] - self.geometry[roi_id][key]) for key in server[roi_id].keys()]) > self.tolerance]
+    if len(moved) == 0:
+      return True
+    info('NOMIC ROI(s) %s moved, reading all ROIs again.' % (', '.join(['%i' % (roi_id) for roi_id in moved])))
+    for roi_id in self.ids:
+      if roi_id not in server:
+        server[roi_id] = self.query(roi_id)
+    self.geometry = server
+    self.changed = []
+    return False
+
+  def offset(self, dx=0, dy=0, ids=None):
+    """
+    Offsets ROIs (default: all) locally by dx, dy pixels. Use push() to
+    send them.
+    """
+    if len(self.geometry) < len(self.ids):
+      self.sync()
+    if ids is None:
+      ids = self.ids
+    for roi_id in ids:
+      self.geometry[roi_id]['X'] = self.geometry[roi_id]['X'] + dx
+      self.geometry[roi_id]['Y'] = self.geometry[roi_id]['Y'] + dy
+      if roi_id not in self.changed:
+        self.changed.append(roi_id)
+
+  def push(self):
+    """
+    Sends the geometry of all locally changed ROIs in one batch. The
+    DefROI updates go out in order on one connection and are applied
+    one after the other by the server, so only the last one waits for
+    it (one round trip for the batch).
+    """
+    prefix = '%s.DefROI.' % (self.camera)
+    for i in range(len(self.changed)):
+      roi_id = self.changed[i]
+      geo = self.geometry[roi_id]
+      droi = dict([(prefix + 'ROIID', roi_id), (prefix + 'X', geo['X']), (prefix + 'Y', geo['Y']), (prefix + 'H', geo['H']), (prefix + 'W', geo['W'])])
+      pi.setINDI(droi, wait=(i == len(self.changed) - 1))   # only the last one waits
+    self.changed = []
+
+nomic_rois = ROIRegistry()
@@ -0,0 +1,303 @@
+import time
+from time import sleep
+from print_tools import *
+from config_tools import custom_cfg
+from task_tools import Task
+from camera_controls import *
+from telescope_controls import *
+from opd_controls import DitherPattern
+from roi_tools import nomic_rois
+
+class Step(object):
+  """
+  One action of a Sequence: a function with its arguments, the
+  resources it uses (e.g., 'telescope', 'camera'), and the steps it
+  waits for. Runs as a task_tools.Task, which records its start, wall
+  time, and error: in a daemon thread on the INDI channel of its first
+  resource, or (if main is True) in the calling thread until it is done.
+  """
+
+  def __init__(self, name, function, args=(), uses=(), after=(), main=False):
+    self.name = name
+    self.function = function
+    self.args = args
+    self.uses = list(uses)
+    self.after = list(after)
+    self.main = main
+    self.task = None
+
+  def ready(self):
+    for step in self.after:
+      if (step.task is None) or not step.done():
+        return False
+    return True
+
+  def start(self):
+    channel = 'sequence'
+    if len(self.uses) > 0:
+      channel = self.uses[0]
+    self.task = Task(channel, self.function, args=self.args)
+    if self.main:
+      self.task.run()
+    else:
+      self.task.setDaemon(True)   # does not keep the process alive after Ctrl-C
+      self.task.start()
+
+  def done(self):
+    return (self.task is not None) and not self.task.isAlive()
+
+  def failed(self):
+    # an error, or no wall time if the step thread was ended by quit()
+    return self.done() and ((self.task.error is not None) or (self.task.duration is None))
+
+
+class Sequence(object):
+  """
+  Observing sequence as a dependency graph of steps. Every step names
+  the resources it uses and waits for the last step added before it on
+  each of them (and for the steps given with after). Steps which do not
+  depend on each other run concurrently, e.g., the camera is set up for
+  the next integration while the telescope settles after a nod. Steps
+  using one of the main resources (default: the operator and the
+  camera, whose steps prompt the operator) run in the main thread, one
+  at a time, so that prompts and Ctrl-C work as in a script; the other
+  steps run in threads meanwhile. run() prints a timing report of all
+  steps at the end.
+
+  Usage:
+   >> seq = Sequence()
+   >> seq.add('nod up', nod, (cfg, 'up'), uses=['telescope', 'camera', 'phasecam'])
+   >> seq.add('stage camera', stage_camera, (cfg, 1000), uses=['camera'])
+   >> seq.add('settle', sleep, (7.0,), uses=['telescope'])   # at the same time as 'stage camera'
+   >> seq.run()
+  """
+
+  def __init__(self, poll=0.05, main=('operator', 'camera')):
+    self.steps = []
+    self.main = list(main)  # resources whose steps run in the main thread
+    self.last = {}          # resource -> last step added which uses it
+    self.poll = poll        # s between checks for finished steps
+    self.t0 = None
+    self.wall_time = None
+
+  def add(self, name, function, args=(), uses=(), after=()):
+    """
+    Adds a step and returns it (e.g., for after of a later step).
+    """
+    after = list(after)
+    for resource in uses:
+      if (resource in self.last) and (self.last[resource] not in after):
+        after.append(self.last[resource])
+    main = len([resource for resource in uses if resource in self.main]) > 0
+    step = Step('%i %s' % (len(self.steps) + 1, name), function, args, uses, after, main)
+    for resource in uses:
+      self.last[resource] = step
+    self.steps.append(step)
+    return step
+
+  def run(self, verbose=True):
+    """
+    Runs all steps, each as soon as the steps it waits for are done, and
+    prints the timing report (if verbose). Of the steps which are ready,
+    the threads are started first, then one main thread step is run. If
+    a step fails, no further steps are started and its error is raised
+    again once the running steps finished. On Ctrl-C (or quit() in a
+    main thread step), no further steps are started, the report is
+    printed, and KeyboardInterrupt (SystemExit) is raised again at once
+    (steps still running in threads end with the process).
+    Returns the wall time of the sequence in s.
+    """
+    self.t0 = time.time()
+    pending = list(self.steps)
+    running = []
+    failed = None
+    try:
+      while ((len(pending) > 0) and (failed is None)) or (len(running) > 0):
+        if failed is None:
+          ready = [step for step in pending if step.ready()]
+          for step in [step for step in ready if not step.main] + [step for step in ready if step.main][0:1]:
+            pending.remove(step)
+            running.append(step)
+            step.start()
+        sleep(self.poll)
+        for step in [step for step in running if step.done()]:
+          running.remove(step)
+          if step.failed() and (failed is None):
+            failed = step
+    except (KeyboardInterrupt, SystemExit):   # Ctrl-C, or quit() in a main thread step (e.g., [c] at a prompt)
+      self.wall_time = time.time() - self.t0
+      print('')
+      info('Sequence aborted, no further steps started.')
+      if verbose:
+        self.report()
+      raise
+    self.wall_time = time.time() - self.t0
+    if verbose:
+      self.report()
+    if failed is not None:
+      if failed.task.error is None:
+        raise SystemExit('sequence aborted in step %s' % (failed.name))
+      error = failed.task.error
+      raise error[0], error[1], error[2]
+    return self.wall_time
+
+  def report(self):
+    """
+    Prints the start time (from the start of the sequence) and the wall
+    time of every step, and how much of it overlapped with other steps.
+    """
+    print('')
+    info('Sequence timing:')
+    print('  %-32s %10s %10s' % ('step', 'start [s]', 'time [s]'))
+    busy = 0.0
+    for step in self.steps:
+      if (step.task is None) or (step.task.t_start is None):
+        print('  %-32s %10s %10s  (not run)' % (step.name, '-', '-'))
+      elif step.task.duration is None:
+        status = '(aborted)'
+        if step.task.isAlive():
+          status = '(still running)'
+        print('  %-32s %10.1f %10s  %s' % (step.name, step.task.t_start - self.t0, '-', status))
+      else:
+        status = ''
+        if step.task.error is not None:
+          status = '  (FAILED: %s)' % (step.task.error[1])
+        print('  %-32s %10.1f %10.1f%s' % (step.name, step.task.t_start - self.t0, step.task.duration, status))
+        busy = busy + step.task.duration
+    print('  %-32s %10s %10.1f' % ('total', '', self.wall_time))
+    print('  Steps took %.1f s in total, %.1f s of it concurrently with other steps.' % (busy, max(0.0, busy - self.wall_time)))
+    print('')
+
+
+def _request_setpoint():
+  request('Search for setpoint (run setpoint script?) and hit return when done.'); raw_input()
+
+
+def _null_frames(cfg):
+  # frames taken by take_null (whole dither cycles), compiling the dither pattern fails here on a bad configuration
+  if cfg['nomic_dither_opd']:
+    return DitherPattern.from_config(cfg).whole_cycles(cfg['nomic_nsequences_null'])
+  return cfg['nomic_nsequences_null']
+
+
+def _plan_position(seq, cfg, extra_wait, nod_dir=None, nulls=None, ask=True):
+  # nulls at one nod position (after a nod to it, if nod_dir is given)
+  if nulls is None:
+    nulls = [{}]
+  cfgs = []
+  for overrides in nulls:
+    null_cfg = custom_cfg(cfg)
+    null_cfg.update(overrides)
+    cfgs.append(null_cfg)
+  for null_cfg in cfgs:
+    _null_frames(null_cfg)
+  # no camera staging here: the phase loop wait and the setpoint search change the camera setup again
+  if nod_dir is not None:
+    seq.add('nod ' + nod_dir, nod, (cfg, nod_dir), uses=['telescope', 'camera', 'phasecam'])
+    seq.add('settle', sleep, (extra_wait,), uses=['telescope'])
+    seq.add('phase loop', wait_phase_loop, (cfg,), uses=['telescope', 'phasecam', 'camera'])
+  if ask:
+    seq.add('setpoint search', _request_setpoint, uses=['operator', 'phasecam'])
+  for i in range(len(cfgs)):
+    name = 'null'
+    if len(cfgs) > 1:
+      name = 'null %i/%i' % (i + 1, len(cfgs))
+    seq.add(name, take_null, (cfgs[i],), uses=['camera', 'phasecam', 'telescope'])
+
+
+def _plan_null(seq, cfg, extra_wait, nulls=None):
+  _plan_position(seq, cfg, extra_wait, nulls=nulls)
+
+
+def _plan_nod(seq, cfg, extra_wait, nod_dir, nulls=None):
+  _plan_position(seq, cfg, extra_wait, nod_dir, nulls, ask=not cfg['nomic_setpoint_track'])
+
+
+def _plan_nod_pairs(seq, cfg, extra_wait, n_pairs, nulls=None):
+  _plan_null(seq, cfg, extra_wait, nulls)
+  for i in range(2 * n_pairs - 1):
+    _plan_nod(seq, cfg, extra_wait, ['up', 'down'][i % 2], nulls)
+
+
+def _plan_photometry(seq, cfg, extra_wait):
+  seq.add('nod down (left)', nod, (cfg, 'down', True, 'left'), uses=['telescope', 'camera'])
+  seq.add('stage camera (photometry)', stage_camera, (cfg, cfg['nomic_nsequences_phot']), uses=['camera'])
+  seq.add('settle', sleep, (extra_wait,), uses=['telescope'])
+  seq.add('AO loop', wait_AO_loop, (cfg, False), uses=['telescope'])
+  seq.add('settle', sleep, (extra_wait,), uses=['telescope'])
+  seq.add('photometry', take_photometry, (cfg,), uses=['camera', 'telescope'])
+
+
+def _plan_background(seq, cfg, extra_wait):
+  seq.add('nod up (left)', nod, (cfg, 'up', True, 'left'), uses=['telescope', 'camera'])
+  seq.add('settle', sleep, (extra_wait,), uses=['telescope'])
+  seq.add('AO loop', wait_AO_loop, (cfg, False), uses=['telescope'])
+  seq.add('offset up', offset_background, (cfg, 'up'), uses=['telescope', 'camera'])
+  seq.add('stage camera (background)', stage_camera, (cfg, cfg['nomic_nsequences_bkgd']), uses=['camera'])
+  seq.add('AO loop', wait_AO_loop, (cfg, False), uses=['telescope'])
+  seq.add('settle', sleep, (extra_wait,), uses=['telescope'])
+  seq.add('background', take_background, (cfg,), uses=['camera', 'telescope'])
+
+
+def _plan_reset(seq, cfg, extra_wait):
+  seq.add('offset down', offset_background, (cfg, 'down'), uses=['telescope', 'camera'])
+  seq.add('AO loop', wait_AO_loop, (cfg, False), uses=['telescope'])
+  seq.add('settle', sleep, (3 * extra_wait,), uses=['telescope'])
+  seq.add('nod down', nod, (cfg, 'down'), uses=['telescope', 'camera', 'phasecam'])
+  seq.add('AO loop', wait_AO_loop, (cfg, False), uses=['telescope'])
+
+
+# actions of an observing plan, see observing_sequence()
+plan_actions = {'null': _plan_null, 'nod': _plan_nod, 'nod_pairs': _plan_nod_pairs,
+                'photometry': _plan_photometry, 'background': _plan_background, 'reset': _plan_reset}
+
+
+def observing_sequence(cfg, plan, extra_wait=7.0):
+  """
+  Builds the Sequence of an observing plan. The plan is a list of
+  actions, each a tuple of the action name and its arguments:
+
+   ('null', nulls)             nulls at the current nod position, after a
+                               setpoint search by the operator
+   ('nod', nod_dir, nulls)     nod ('up' or 'down'), wait extra_wait s and
+                               for the phase loop, then nulls (with a
+                               setpoint search unless 'nomic_setpoint_track')
+   ('nod_pairs', n, nulls)     nulls at the current position and after
+                               2n-1 nods (up, down, up, ...)
+   ('photometry',)             photometry with the left side nodded down
+   ('background',)             background with the left side nodded back
+                               and the telescope offset up
+   ('reset',)                  back to the start position for a new
+                               observation of the target
+
+  nulls is optional, a list of configuration changes, one per null taken
+  at each position (default: one null with cfg as it is). The null
+  configurations are checked (e.g., their dither patterns compiled) when
+  the plan is built, before anything moves. A plan which nods starts by
+  comparing all NOMIC ROIs with the server (see roi_tools.ROIRegistry).
+
+  Usage:
+   >> seq = observing_sequence(cfg, [('nod_pairs', 3), ('photometry',), ('background',), ('reset',)])
+   >> seq.run()
+  """
+  seq = Sequence()
+  for action in plan:
+    if action[0] not in plan_actions:
+      raise ValueError('unknown plan action %s (known: %s)' % (action[0], ', '.join(sorted(plan_actions.keys()))))
+  if len([action for action in plan if action[0] != 'null']) > 0:
+    seq.add('check ROIs', nomic_rois.check, (True,), uses=['camera'])   # all ROIs once, the nods compare one each
+  for action in plan:
+    plan_actions[action[0]](seq, cfg, extra_wait, *action[1:])
+  return seq
+
+
+def run_plan(cfg, plan, extra_wait=7.0):
+  """
+  Builds and runs the Sequence of an observing plan (see
+  observing_sequence) and prints its timing report. Returns the wall
+  time in s.
+
+  Usage:
+   >> run_plan(cfg, [('nod_pairs', 3), ('photometry',), ('background',), ('reset',)])
+  """
+  return observing_sequence(cfg, plan, extra_wait).run()
@@ -0,0 +1,130 @@
+from pyindi import PyINDI
+import os
+import socket
+import threading
+from profile_tools import Profiler, profiler
+
+class Session(object):
+  """
+  Stands in for a PyINDI instance and owns the INDI connections of the
+  nomops modules, so that all of them share one connection per process
+  instead of opening their own. Connections are opened on first use.
+
+  Every thread uses a named channel. The main thread uses 'main', other
+  threads use 'background' unless they select their own channel with
+  use_channel(), so that background tasks (and tasks running in
+  parallel) never share a socket with the main thread. A process started
+  with multiprocessing gets its own connections instead of the socket
+  inherited from its parent.
+
+  If a call fails because the connection was lost, the connection is
+  reopened. Calls which only read (getINDI, getKeys, evalINDI) are then
+  repeated once, all others (e.g., setINDI) raise the error, since the
+  server may have received them already (e.g., a 'go' or an offset).
+
+  All INDI calls are recorded by the profiler (see profile_tools).
+
+  Usage:
+   >> from session_tools import pi
+   >> DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+   >> pi.use_channel('dither')      # in a thread, to get its own connection
+   >> pi.report()                   # connection reuse statistics
+  """
+
+  idempotent = ['getINDI', 'getKeys', 'evalINDI']   # calls which are safe to repeat
+
+  def __init__(self, verbose=False):
+    self.verbose = verbose
+    self.connections = {}   # (process ID, channel) -> PyINDI
+    self.stats = {'opened': 0, 'reused': 0, 'reconnects': 0}
+    self.local = threading.local()
+    self.lock = threading.Lock()
+
+  def use_channel(self, channel):
+    """
+    Selects the channel (i.e., the connection) used by the calling thread.
+    """
+    self.local.channel = channel
+
+  def channel(self):
+    """
+    Returns the channel used by the calling thread.
+    """
+    channel = getattr(self.local, 'channel', None)
+    if channel is None:
+      if threading.currentThread().getName() == 'MainThread':
+        channel = 'main'
+      else:
+        channel = 'background'
+    return channel
+
+  def connection(self, channel=None):
+    """
+    Returns the connection of a channel (default: the channel of the
+    calling thread) in this process, opening it if needed.
+    """
+    if channel is None:
+      channel = self.channel()
+    key = (os.getpid(), channel)
+    self.lock.acquire()
+    try:
+      if key in self.connections:
+        self.stats['reused'] = self.stats['reused'] + 1
+      else:
+        self.connections[key] = PyINDI(verbose=self.verbose)
+        self.stats['opened'] = self.stats['opened'] + 1
+      return self.connections[key]
+    finally:
+      self.lock.release()
+
+  def reconnect(self, channel=None):
+    """
+    Drops the connection of a channel so that the next call opens a new one.
+    """
+    if channel is None:
+      channel = self.channel()
+    self.lock.acquire()
+    try:
+      self.connections.pop((os.getpid(), channel), None)
+      self.stats['reconnects'] = self.stats['reconnects'] + 1
+    finally:
+      self.lock.release()
+
+  def report(self):
+    """
+    Prints the connection reuse statistics of this process.
+    """
+    pid = os.getpid()
+    channels = [key[1] for key in self.connections.keys() if key[0] == pid]
+    channels.sort()
+    n_calls = self.stats['opened'] + self.stats['reused']
+    print('  INDI connections opened  = %i (channels: %s)' % (self.stats['opened'], ', '.join(channels)))
+    print('  INDI calls               = %i' % (n_calls))
+    if n_calls > 0:
+      print('  connection reuse         = %.1f%%' % (100.0 * self.stats['reused'] / n_calls))
+    print('  reconnects               = %i' % (self.stats['reconnects']))
+
+  def __getattr__(self, name):
+    attr = getattr(self.connection(), name)
+    if not callable(attr):
+      return attr
+    session = self
+    def call(*args, **kwargs):
+      try:
+        return session._call(name, attr, args, kwargs)
+      except socket.timeout:
+        raise
+      except (socket.error, EOFError):
+        session.reconnect()
+        if name not in Session.idempotent:
+          raise   # the server may have received the command, do not send it twice
+        return session._call(name, getattr(session.connection(), name), args, kwargs)
+    return call
+
+  def _call(self, name, function, args, kwargs):
+    if name in Profiler.methods:
+      return profiler.call(name, function, args, kwargs)
+    return function(*args, **kwargs)
+
+
+pi = Session()
@@ -36,7 +36,9 @@ plot     = 'n'        # options for graphical output: 's' for screen, 'f' for fi
                       # The file will be saved as 'setpoint.eps' in the directory this script is located in.
 save_data = 0         # Save data during setpoint optimization? 1 for Yes, 0 for No
 max_step = 45         # Maximum single step with to change the setpoint, set to HUGE number for no constraint.
+ramp_rate = 0         # Maximum rate to change the setpoint in deg/s, 0 for no limit.
 n_success_confirm = 1 # Number of successful setpoint confirmations required
+profile   = 0         # Print a profile of the INDI round trips at the end? 1 for Yes, 0 for No
 # ====================================================================================================
 
 print('')
@@ -58,20 +60,23 @@ from pyindi import *
 import numpy as np
 #import numpy as flx      # obsolete
 #import numpy as pixels   # obsolete
-from matplotlib import use as mpl_use
 
-#pi is an instance of PyINDI. Here we connect to the server
-pi=PyINDI(verbose=False)
+#pi stands in for an instance of PyINDI and connects to the server on first use
+from session_tools import pi
+
+# Reader for the nulling statistics (one request per sample), paced on the camera frame counter
+from stats_tools import NullingStatsReader, FrameClock, NoisePool
+stats = NullingStatsReader()
+clock = FrameClock(stats)
+roi_noise = NoisePool(size=3)   # ROI noise pooled over the scan points, to clip short stacks against
 
 print('')
 if pi.getINDI("NOMIC.CamInfo.Go"):
   info('Camera is still integrating. Aborting.')
   quit()
 
-#mpl_use('QT4Agg')
-mpl_use('tkagg')    # needed for interactive mode
-
-import matplotlib.pyplot as plt
+# Plotting runs in a separate process, matplotlib is only imported there if needed
+from plot_tools import SetpointPlotter
 
 import warnings
 
@@ -100,19 +105,7 @@ setpoints = numpy.zeros((n_points+1))
 null_tot  = numpy.zeros((n_points))
 null_std  = numpy.zeros((n_points))
 
-if (plot == 's') or (plot == 'b'):
-  # Init plot		NOTE: The following two lines take ~5 sec, needs optimization!!!!!
-  plt.ion()  # Turn on interactive mode
-  plt.figure(1)
-  plt.ylabel('Mean flux at null [ADU]')
-  plt.xlabel('Phase [degrees]')
-  plt.title('Setpoint optimization')
-  plt.draw()
-if (plot == 'f') or (plot == 'b'):
-  plt.figure(1)
-  plt.ylabel('Mean flux at null [ADU]')
-  plt.xlabel('Phase [degrees]')
-  plt.title('Setpoint optimization')
+plotter = SetpointPlotter({'s': 'screen', 'f': 'file', 'b': 'both', 'n': 'none'}[plot])
 
 # Get integration time and initial setpoint
 
@@ -125,7 +118,10 @@ if src == 'UBC':
 else: # if src = 'NAC'
   setpoint_old = pi.getINDI('PLC.NACSettings.PLSetpoint')
 
-setpoint_current = setpoint_old # This parameter is used to keep track of the CURRENT setpoint during all offsets sent by the script.
+# Setpoint changes are sent by a separate thread in steps of at most max_step, superseded targets are dropped
+from opd_controls import SetpointRamper
+ramper = SetpointRamper(src, max_step, ramp_rate, setpoint_old)
+ramper.start()
 
 # 1. Find the best setpoint
 # *************************
@@ -159,22 +155,18 @@ while n_success < n_success_confirm + 1:
     setpoints[i] = setpoint_old + np.float(i - half_steps) * scan_step
     setpoints[-1] = setpoint_old # Last scan step returns to center.
     
-    # Set new setpoint
-    while np.abs(setpoints[i] - setpoint_current) > max_step: # go small steps ...
-      setpoint_current = setpoint_current + np.sign(setpoints[i] - setpoint_current) * max_step
-      pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
-    setpoint_current = setpoints[i] # go final step ...
-    pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
+    # Set new setpoint (the return to the center is not waited for)
+    ramper.move(setpoints[i])
+    if i < n_points:
+      ramper.wait()
     
     # Read RIOs
     if i < n_points: # Ignore last step (back to center) for measurements.
-      for j in range(n_img):
-        time_stats_0 = time.time()
-        null[j] = pi.getINDI ('NOMIC.NullingStats.Mean3') - 0.5 * (pi.getINDI ('NOMIC.NullingStats.Mean1') + pi.getINDI ('NOMIC.NullingStats.Mean2'))
-        time.sleep(np.max([0.0, t_int - (time.time() - time_stats_0)]))      # wait for 1 integration in nomic - time it took to get the stats (previous line), but not less then 0.0s
+      data = clock.next_n(n_img, settle=1)   # next new frames after the setpoint change
+      null[:] = stats.null(data)
     
-      # Compute mean value over n_img images
-      null_tot[i] = null.mean()
+      # Compute sigma-clipped mean value over n_img images (per ROI, see robust_tools)
+      null_tot[i] = stats.robust_null(data, pool=roi_noise)[0]
       null_std[i] = null.std()
   
   # Find new setpoint by parabola fit
@@ -194,27 +186,8 @@ while n_success < n_success_confirm + 1:
   else:
     offset = np.abs(setpoint_old - setpoint_new)
   
-  # Plot results
-  if (plot == 's') or (plot == 'b'):
-    null_range = null_tot.max() - null_tot.min()
-    plot_range_x = [setpoints[0] - scan_step, setpoints[-2] + scan_step]
-
-    # display measurements and fit
-    xp = numpy.linspace(plot_range_x[0], plot_range_x[1], 30)
-    p  = numpy.poly1d(z)
-    plt.errorbar(setpoints[0:-1], null_tot, null_std, marker='o', linestyle='.')
-    plt.plot(xp, p(xp), linestyle='-', color='black')
-    plt.draw()
-    time.sleep(0.001)
-  if (plot == 'f') or (plot == 'b'):
-    null_range = null_tot.max() - null_tot.min()
-    plot_range_x = [setpoints[0] - scan_step, setpoints[-2] + scan_step]
-    xp = numpy.linspace(plot_range_x[0], plot_range_x[1], 30)
-    p  = numpy.poly1d(z)
-    plt.errorbar(setpoints[0:-1], null_tot, null_std, marker='o', linestyle='.')
-    plt.plot(xp, p(xp), linestyle='-', color='black')
-    plt.savefig('setpoint.pdf')
-    time.sleep(0.001)
+  # Plot results (does not wait for the display)
+  plotter.plot(setpoints[0:-1], null_tot, null_std, z, [setpoints[0] - scan_step, setpoints[-2] + scan_step])
   
   if offset <= scan_step:
     n_success = n_success + 1
@@ -240,18 +213,20 @@ while n_success < n_success_confirm + 1:
 
 # count time
 t1 = time.time()-t0
+plotter.close()
 
 # Send determined setpoint
 setpoint_final = np.average(setpoints_fit)
-while np.abs(setpoint_final - setpoint_current) > max_step: # go small steps ...
-  setpoint_current = setpoint_current + np.sign(setpoint_final - setpoint_current) * max_step
-  pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
-setpoint_current = setpoint_final # go final step ...
-pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
+ramper.move(setpoint_final)
+ramper.stop()
 
 info('Finished. New setpoint used: ' + str(setpoint_final))
 print('')
 
+if profile == 1:
+  from profile_tools import profiler
+  profiler.report()
+
 #Now pause
 #if raw_input("Press [ENTER] to confirm or [c] + [ENTER] to abort. ") == "c": quit()
 #input("Press 1")
@@ -1,13 +1,17 @@
 from pyindi import * 
 import numpy as np
 import time
-from matplotlib import use as mpl_use
-import matplotlib.pyplot as plt
 import warnings
 from print_tools import *
+from profile_tools import *
+from stats_tools import *
+from plot_tools import *
+from setpoint_search import *
+from opd_controls import SetpointRamper
+from telescope_controls import nod_position
+from cache_tools import *
 
-pi = PyINDI()
-mpl_use('tkagg')    # needed for interactive mode
+from session_tools import pi
 
 
 # Ignore deprecation warnings
@@ -17,23 +21,131 @@ with warnings.catch_warnings():
   warnings.simplefilter('ignore')
   fxn()
 
+class SetpointProbe(object):
+  """
+  Measurement and actuation layer of the setpoint search, shared by all
+  strategies (see setpoint_search.setpoint_strategies): sends setpoints
+  through a SetpointRamper thread (in steps of at most
+  'nomic_setpoint_max_step', at most 'nomic_setpoint_rate' deg/s) and
+  measures the null of the next 'nomic_setpoint_img_stack' new frames
+  after each setpoint change (sigma-clipped with 'nomic_setpoint_clip'
+  against the ROI noise pooled over the probes, see
+  robust_tools.NoisePool). Counts the probes and frames used.
+
+  The uncertainty of each null is computed from the frame-to-frame
+  noise pooled over all probes of the search so far, not from the few
+  frames of the probe alone: the strategies weight their fits by
+  1/uncertainty**2, and the scatter of 3-5 frames can be close to 0 by
+  chance.
+
+  Usage:
+   >> probe = SetpointProbe(cfg, setpoint0)
+   >> null, null_err, null_std = probe.measure(setpoint)
+   >> probe.close(setpoint_final)
+  """
+
+  def __init__(self, cfg, setpoint):
+    self.pzt = cfg['pzt']
+    self.n_stack = cfg['nomic_setpoint_img_stack']
+    self.clip = cfg['nomic_setpoint_clip']
+    self.stats = NullingStatsReader()
+    self.clock = FrameClock(self.stats)
+    self.ramper = SetpointRamper(cfg['pzt'], cfg['nomic_setpoint_max_step'], cfg['nomic_setpoint_rate'], setpoint)
+    self.ramper.start()
+    self.n_probes = 0
+    self.n_frames = 0
+    self.noise_ss = 0.0   # pooled frame noise: sum of (frames - 1) * variance over the probes
+    self.noise_dof = 0    # and its degrees of freedom
+    self.roi_noise = NoisePool(size=3)   # ROI noise pooled over the probes, to clip the short stacks against
+
+  def move(self, setpoint):
+    """
+    Sends a setpoint (returns at once).
+    """
+    self.ramper.move(setpoint)
+
+  def measure(self, setpoint):
+    """
+    Sends a setpoint, waits until it was sent, and returns the null of
+    the next new frames, its uncertainty (from the pooled noise), and the
+    standard deviation of the null over the frames.
+    """
+    self.ramper.move(setpoint)
+    self.ramper.wait()
+    data = self.clock.next_n(self.n_stack, settle=1)   # next new frames after the setpoint change
+    null, null_err, n_rejected = self.stats.robust_null(data, self.clip, self.roi_noise)
+    self.n_probes = self.n_probes + 1
+    self.n_frames = self.n_frames + len(data) + self.clock.skipped
+    self.clock.skipped = 0
+    if len(data) > 1:
+      self.noise_ss = self.noise_ss + null_err**2 * len(data) * (len(data) - 1)   # frame variance of this probe
+      self.noise_dof = self.noise_dof + len(data) - 1
+    if self.noise_dof > 0:
+      null_err = np.sqrt(self.noise_ss / self.noise_dof / len(data))
+    return null, null_err, self.stats.null(data).std()
+
+  def loop_closed(self):
+    """
+    Returns False if the phase loop is open (can only be checked on UBC).
+    """
+    if self.pzt != 'UBC':
+      return True
+    return bool(pi.getINDI('PLC.CloseLoop.Yes'))
+
+  def close(self, setpoint):
+    """
+    Sends the final setpoint and stops the ramper once it was sent.
+    """
+    self.ramper.move(setpoint)
+    self.ramper.stop()
+
+
+def run_setpoint_strategy(strategy, probe, plotter=None):
+  """
+  Runs a setpoint search strategy on a SetpointProbe: measures every
+  batch of setpoints the strategy asks for, prints its status after each
+  batch, plots the batch, and restarts the strategy if the phase loop
+  opened during the batch.
+  """
+  while True:
+    batch = strategy.ask()
+    if batch is None:
+      return
+    null_tot = np.zeros(len(batch))
+    null_std = np.zeros(len(batch))
+    for i in range(len(batch)):
+      null_tot[i], null_err, null_std[i] = probe.measure(batch[i])
+      strategy.tell(batch[i], null_tot[i], null_err)
+    print(strategy.update())
+    
+    # Plot results (does not wait for the display)
+    if plotter is not None:
+      plotter.plot(np.array(batch), null_tot, null_std, curve=strategy.curve())
+    
+    # Check for loop closed, samples taken with the loop open are not trusted
+    if not probe.loop_closed():
+      strategy.restart()
+      if raw_input('REQUEST: Phase loop open. Please close loop and press [ENTER] to continue or [c] + [ENTER] to abort. ') == 'c': quit()
+
+
+@profiled
 def find_setpoint(cfg):
+  """
+  Finds the phase setpoint at the null with the search strategy
+  'nomic_setpoint_method' (see setpoint_search.setpoint_strategies), sends
+  it, and appends a timing record of the search to the setpoint run log
+  (profile_tools.setpoint_log).
   
-  
-  
-  if cfg['pzt'] == 'UBC':
-    forNAC = '0'
-  else: # if cfg['pzt'] == 'NAC'
-    forNAC = '1'
+  Usage:
+   >> find_setpoint(cfg)
+  """
   
   # Start time counter
   t0 = time.time()
+  n_calls0 = profiler.count()
   
-  #pi is an instance of PyINDI. Here we connect to the server
-  pi=PyINDI(verbose=False)
-  
-  # Define ROI ID numbers
-  ROIIDs = [3,2,1]
+  # Get integration time
+  DIT  = pi.getINDI('NOMIC.CamInfo.IntTime') # get NOMIC integration time
   
   # Set camera in safe state
   pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
@@ -47,39 +159,28 @@ def find_setpoint(cfg):
   if cfg['nomic_setpoint_savedata'] == True:
     pi.setINDI('NOMIC.Command.text', '1 savedata', wait=True)
   
-  # Initialize arrays
-  null      = np.zeros((cfg['nomic_setpoint_img_stack']))
-  setpoints = np.zeros((cfg['nomic_setpoint_n_scan']+1))
-  null_tot  = np.zeros((cfg['nomic_setpoint_n_scan']))
-  null_std  = np.zeros((cfg['nomic_setpoint_n_scan']))
-  
-  if (cfg['nomic_setpoint_output'] == 'screen') or (cfg['nomic_setpoint_output'] == 'both'):
-    print('')
-    print('  Initializing display.')
-    # Init plot		NOTE: The following two lines take ~5 sec, needs optimization!!!!!
-    plt.ion()  # Turn on interactive mode
-    plt.figure(1)
-    plt.ylabel('Mean flux at null [ADU]')
-    plt.xlabel('Phase [degrees]')
-    plt.title('Setpoint optimization')
-    plt.draw()
-  if (cfg['nomic_setpoint_output'] == 'file') or (cfg['nomic_setpoint_output'] == 'both'):
-    print('')
-    print('  Plotting to file.')
-    plt.figure(1)
-    plt.ylabel('Mean flux at null [ADU]')
-    plt.xlabel('Phase [degrees]')
-    plt.title('Setpoint optimization')
-  
-  # Get integration time and initial setpoint
-  DIT  = pi.getINDI('NOMIC.CamInfo.IntTime') # get NOMIC integration time
-  
-  if cfg['pzt'] == 'UBC':
-    setpoint_old = pi.getINDI('PLC.UBCSettings.PLSetpoint')
-  else: # if cfg['pzt'] = 'NAC'
-    setpoint_old = pi.getINDI('PLC.NACSettings.PLSetpoint')
-  
-  setpoint_current = setpoint_old # This parameter is used to keep track of the CURRENT setpoint during all offsets sent by the script.
+  # Start plotting in a separate process (does nothing if output is 'none')
+  plotter = SetpointPlotter(cfg['nomic_setpoint_output'])
+  
+  # Get initial setpoint (and beam 2 position, which is part of the setpoint cache key)
+  settings = pi.getINDI('PLC.%sSettings.*' % (cfg['pzt']))
+  setpoint_old = settings['PLC.%sSettings.PLSetpoint' % (cfg['pzt'])]
+  
+  # Setpoint changes and null measurements, shared by all strategies
+  probe = SetpointProbe(cfg, setpoint_old)
+  
+  # Start from the cached setpoint of this target and nod position with a narrower scan, if there is a recent one
+  scan_range = np.array(cfg['nomic_setpoint_scan_range'], dtype=float)
+  cache_key = None
+  cached = False
+  if cfg.get('target', '') != '':
+    cache_key = setpoint_cache.key(cfg.get('target', ''), nod_position(), cfg['pzt'], settings['PLC.%sSettings.Beam2_y' % (cfg['pzt'])])
+    entry = setpoint_cache.lookup(cache_key, cfg['nomic_setpoint_cache_age'])
+    if entry is not None:
+      print('  Cached setpoint  = %f degrees (%.0f s old)' % (entry['setpoint'], entry['age']))
+      setpoint_old = entry['setpoint']
+      scan_range = scan_range * cfg['nomic_setpoint_cache_range']
+      cached = True
   
   # 1. Find the best setpoint
   # *************************
@@ -90,119 +191,37 @@ def find_setpoint(cfg):
   
   print('  Initial setpoint = %f degrees' % setpoint_old)
   
-  # compute some values before the loop
-  scan_step = np.sum(np.abs(cfg['nomic_setpoint_scan_range'])) / np.float(cfg['nomic_setpoint_n_scan'] - 1)     # step width of the OPD scan
-  half_steps = (cfg['nomic_setpoint_n_scan'] - 1) / 2                                 # half of ( the number of steps - 1 )
-  
-  # Loop until offset is smaller than step width
-  k = 0
-  offset = 100000.0
-  n_success = 0
-  setpoints_fit = []
+  method = cfg.get('nomic_setpoint_method', 'scan')
+  if method not in setpoint_strategies:
+    raise ValueError('unknown setpoint method %s (known: %s)' % (method, ', '.join(setpoint_strategies.keys())))
+  strategy = setpoint_strategies[method].from_config(cfg, setpoint_old, scan_range)
   
-  if (cfg['pzt'] == 'UBC') and (not pi.getINDI('PLC.CloseLoop.Yes')): # Initial check if phase loop closed (can only be done on UBC)
+  if not probe.loop_closed(): # Initial check if phase loop closed (can only be done on UBC)
     if raw_input('REQUEST: Phase loop open. Please close loop and press [ENTER] to continue or [c] + [ENTER] to abort. ') == 'c': quit()
   
-  while n_success < cfg['nomic_setpoints_n_confirm'] + 1:
-    k=k+1
-    
-    # loop over setpoints (scan)
-    for i in range(0, cfg['nomic_setpoint_n_scan'] + 1):
-      
-      # compute setpoints to scan
-      setpoints[i] = setpoint_old + np.float(i - half_steps) * scan_step
-      setpoints[-1] = setpoint_old # Last scan step returns to center.
-      
-      # Set new setpoint
-      while np.abs(setpoints[i] - setpoint_current) > cfg['nomic_setpoint_max_step']: # go small steps ...
-        setpoint_current = setpoint_current + np.sign(setpoints[i] - setpoint_current) * cfg['nomic_setpoint_max_step']
-        pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
-      setpoint_current = setpoints[i] # go final step ...
-      pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
-      
-      # Read RIOs
-      if i < cfg['nomic_setpoint_n_scan']: # Ignore last step (back to center) for measurements.
-        for j in range(cfg['nomic_setpoint_img_stack']):
-          time_stats_0 = time.time()
-          null[j] = pi.getINDI ('NOMIC.NullingStats.Mean3') - 0.5 * (pi.getINDI ('NOMIC.NullingStats.Mean1') + pi.getINDI ('NOMIC.NullingStats.Mean2'))
-          time.sleep(np.max([0.0, t_int - (time.time() - time_stats_0)]))      # wait for 1 integration on nomic - time it took to get the stats (previous line), but not less then 0.0s
-        
-        # Compute mean value over stacked frames
-        null_tot[i] = null.mean()
-        null_std[i] = null.std()
-    
-    # Find new setpoint by parabola fit
-
-    z = np.polyfit(setpoints[0:-1], null_tot, 2)    	# Numpy returns highest degree first
-    
-    setpoint_new = -0.5*z[1]/z[0]
-    # if parabola has negative curvature of ir fit moves setpoint too far:
-    if (z[0] < 0) or (setpoint_new < setpoints[0]) or (setpoint_new > setpoints[-2]):
-      if null_tot[0] < null_tot[-1]:
-        setpoint_new = setpoints[1]
-      else:
-        setpoint_new = setpoints[-3]
-      offset = 10000000.0
-    else:
-      offset = np.abs(setpoint_old - setpoint_new)
-    
-    print('  Iteration %i -- min. flux %.2f max. flux %.2f -- new setpoint = %.1f' % (k,  np.min(null_tot), np.max(null_tot), setpoint_new))
-    
-    # Plot results
-    if (cfg['nomic_setpoint_output'] == 'screen') or (cfg['nomic_setpoint_output'] == 'both'):
-      null_range = null_tot.max() - null_tot.min()
-      plot_range_x = [setpoints[0] - scan_step, setpoints[-2] + scan_step]
-  
-      # display measurements and fit
-      xp = numpy.linspace(plot_range_x[0], plot_range_x[1], 30)
-      p  = numpy.poly1d(z)
-      plt.errorbar(setpoints[0:-1], null_tot, null_std, marker='o', linestyle='.')
-      plt.plot(xp, p(xp), linestyle='-', color='black')
-      plt.draw()
-      time.sleep(0.001)
-    if (cfg['nomic_setpoint_output'] == 'file') or (cfg['nomic_setpoint_output'] == 'both'):
-      null_range = null_tot.max() - null_tot.min()
-      plot_range_x = [setpoints[0] - scan_step, setpoints[-2] + scan_step]
-      xp = numpy.linspace(plot_range_x[0], plot_range_x[1], 30)
-      p  = numpy.poly1d(z)
-      plt.errorbar(setpoints[0:-1], null_tot, null_std, marker='o', linestyle='.')
-      plt.plot(xp, p(xp), linestyle='-', color='black')
-      plt.savefig('setpoint.pdf')
-      time.sleep(0.001)
-    
-    if offset <= scan_step:
-      n_success = n_success + 1
-      setpoints_fit.append(setpoint_new)
-      print('  Success: ', n_success)
-    else:
-      n_success = 0
-      setpoints_fit = []
-      print('  FAILED')
-    
-    # Pause for debugging
-#    if raw_input('  Press [ENTER] to confirm or [c] + [ENTER] to abort. ') == 'c': quit()
-    
-    # Check for loop closed (can only be done on UBC)
-    if (cfg['pzt'] == 'UBC') and (not pi.getINDI('PLC.CloseLoop.Yes')):
-      n_success = 0
-      if raw_input('REQUEST: Phase loop open. Please close loop and press [ENTER] to continue or [c] + [ENTER] to abort. ') == 'c': quit()
-    else:
-      setpoint_old = setpoint_new # Update setpoint scan center.
+  run_setpoint_strategy(strategy, probe, plotter)
+  setpoint_final, setpoint_err = strategy.result()
+  if not strategy.converged:
+    info('Setpoint search did not converge within %i probes, using the best setpoint found.' % (probe.n_probes))
   
   # count time
   t1 = time.time()-t0
+  plotter.close()
   
   # Print status
   print('  Time to optimize setpoint: %fs' % (t1))
   
   # Send determined setpoint
-  setpoint_final = np.average(setpoints_fit)
-  while np.abs(setpoint_final - setpoint_current) > cfg['nomic_setpoint_max_step']: # go small steps ...
-    setpoint_current = setpoint_current + np.sign(setpoint_final - setpoint_current) * cfg['nomic_setpoint_max_step']
-    pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
-  setpoint_current = setpoint_final # go final step ...
-  pi.setINDI('PLC.PLSetpoint.PLSetpoint=' + str(setpoint_current) + ';forNAC=' + forNAC)
+  if (cache_key is not None) and strategy.converged:
+    setpoint_cache.store(cache_key, setpoint_final, setpoint_err)
+  probe.close(setpoint_final)
+  print('  Setpoint steps sent: %i (%i targets superseded before they were reached)' % (probe.ramper.n_sent, probe.ramper.n_superseded))
+  
+  # Timing record of this search, see setpoint_log.summary()
+  setpoint_log.append({'method': method, 'pzt': cfg['pzt'], 'target': cfg.get('target', ''), 'nod_position': nod_position(),
+                       'cached': cached, 'converged': bool(strategy.converged), 'setpoint_start': float(setpoint_old),
+                       'setpoint': float(setpoint_final), 'setpoint_std': setpoint_err, 'probes': probe.n_probes,
+                       'frames': probe.n_frames, 'setpoint_steps': probe.ramper.n_sent, 'indi_calls': profiler.count() - n_calls0,
+                       'dit': DIT, 'wall_time': time.time() - t0})
   
   print('  New setpoint used: ', setpoint_final)
-
-
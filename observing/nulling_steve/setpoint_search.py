@@ -0,0 +1,655 @@
+import numpy as np
+
+golden = 0.5 * (3.0 - np.sqrt(5.0))   # golden-section fraction (0.382)
+
+class ParabolicSearch(object):
+  """
+  Setpoint search by successive parabolic interpolation with a
+  golden-section fallback (Brent's method). All samples (setpoint, null
+  flux, std) of the current search are kept and used to pick the next
+  probe, so that no measurement is thrown away.
+
+  The search first probes the start setpoint and one step to each side.
+  As long as the lowest flux is at the edge of the sampled range, it
+  walks downhill with growing steps (by the golden ratio) until the null
+  is bracketed. It then probes the vertex of a parabola through the
+  lowest sample and its two neighbours, or the golden section of the
+  larger sub-interval if the parabola is not usable. Once the next probe
+  would be closer than 'tolerance' to the best sample (or the bracket is
+  narrower than 2 * tolerance), the probe spacing cannot tell more: the
+  search has converged if the vertex of a weighted parabola fit
+  (QuadraticFit) to the samples within 2 steps of the best one is
+  known to better than 'tolerance'. Otherwise it probes one step to
+  either side of that vertex in turn, to average the noise down, until
+  it is or max_probes were used (not converged).
+
+  The search does not send anything, it only proposes probes:
+
+  Usage:
+   >> search = ParabolicSearch(setpoint0, step=180.0, tolerance=10.0)
+   >> x = search.ask()
+   >> while x is not None:
+   ..   search.tell(x, null, null_std)   # measure the null at x first
+   ..   x = search.ask()
+   >> setpoint = search.result()
+  """
+
+  def __init__(self, start, step, tolerance, max_probes=15, max_travel=None):
+    self.start = float(start)
+    self.step = float(step)
+    self.tolerance = float(tolerance)
+    self.max_probes = max_probes
+    self.max_travel = max_travel   # maximum distance of a probe from the start setpoint
+    self.x = []
+    self.y = []
+    self.std = []
+    self.vertex = None
+    self.vertex_std = None         # uncertainty of the fitted vertex
+    self.n_refine = 0              # probes taken around the fitted vertex
+    self.converged = False
+
+  def tell(self, x, y, std=0.0):
+    """
+    Adds one measurement (null flux y with uncertainty std at setpoint x).
+    """
+    self.x.append(float(x))
+    self.y.append(float(y))
+    self.std.append(float(std))
+
+  def ask(self):
+    """
+    Returns the next setpoint to probe, or None if the search is done.
+    """
+    n = len(self.x)
+    if n < 3:
+      return self.start + [0.0, -self.step, self.step][n]
+    if n >= self.max_probes:
+      return None
+
+    order = np.argsort(self.x)
+    xs = np.array(self.x)[order]
+    ys = np.array(self.y)[order]
+    i = np.argmin(ys)
+    if self.n_refine > 0:
+      return self._refine(xs[i])   # bracketed and probed closely before, only average the noise down now
+
+    # Walk downhill until the null is bracketed
+    if i == 0 or i == len(xs) - 1:
+      if i == 0:
+        probe = xs[0] - (1.0 + golden) * (xs[1] - xs[0])
+      else:
+        probe = xs[-1] + (1.0 + golden) * (xs[-1] - xs[-2])
+      if (self.max_travel is not None) and (np.abs(probe - self.start) > self.max_travel):
+        probe = self.start + np.sign(probe - self.start) * self.max_travel
+        if np.min(np.abs(xs - probe)) < self.tolerance:
+          self.vertex = xs[i]     # null not reachable within max_travel, stop at the edge
+          return None
+      return probe
+
+    a, b = xs[i-1], xs[i+1]
+    x_best = xs[i]
+    if b - a < 2.0 * self.tolerance:
+      return self._refine(x_best)
+
+    u = parabola_vertex(xs[i-1:i+2], ys[i-1:i+2])
+    if (u is None) or (u <= a) or (u >= b):
+      # golden section of the larger sub-interval
+      self.vertex = None
+      if (x_best - a) > (b - x_best):
+        u = x_best - golden * (x_best - a)
+      else:
+        u = x_best + golden * (b - x_best)
+    else:
+      self.vertex = u
+    if np.abs(u - x_best) < self.tolerance:
+      return self._refine(x_best)
+    return u
+
+  def fit(self, x_best):
+    """
+    Returns the vertex of a weighted parabola fit to the samples within
+    2 steps of x_best and its uncertainty, or (None, None).
+    """
+    fit = QuadraticFit(center=x_best)
+    for k in range(len(self.x)):
+      if np.abs(self.x[k] - x_best) <= 2.0 * self.step:
+        fit.add(self.x[k], self.y[k], self.std[k])
+    vertex, vertex_std = fit.vertex()
+    if (vertex is None) or (np.abs(vertex - x_best) > 2.0 * self.step):
+      return None, None
+    return vertex, vertex_std
+
+  def _refine(self, x_best):
+    # probes are close enough, done if the fitted vertex is known well enough, else probe around it
+    vertex, vertex_std = self.fit(x_best)
+    if vertex is not None:
+      self.vertex, self.vertex_std = vertex, vertex_std
+      if vertex_std <= self.tolerance:
+        self.converged = True
+        return None
+    elif self.vertex is None:
+      self.vertex = x_best
+    self.n_refine = self.n_refine + 1
+    return self.vertex + (-1)**self.n_refine * self.step
+
+  def result(self):
+    """
+    Returns the best setpoint estimate: the vertex of the last parabola
+    (or parabola fit) if there was a valid one, the setpoint with the
+    lowest flux otherwise.
+    """
+    if self.vertex is not None:
+      return self.vertex
+    return self.x[int(np.argmin(self.y))]
+
+
+def parabola_vertex(x, y):
+  """
+  Returns the position of the vertex of the parabola through three
+  points, or None if the parabola has no minimum.
+  """
+  x0, x1, x2 = x
+  y0, y1, y2 = y
+  if (x0 == x1) or (x1 == x2) or (x0 == x2):
+    return None
+  d = (x1 - x0) * (y1 - y2) - (x1 - x2) * (y1 - y0)
+  if d == 0.0:
+    return None
+  curvature = ((y2 - y1) / (x2 - x1) - (y1 - y0) / (x1 - x0)) / (x2 - x0)   # second divided difference
+  if curvature <= 0.0:
+    return None
+  return x1 - 0.5 * ((x1 - x0)**2 * (y1 - y2) - (x1 - x2)**2 * (y1 - y0)) / d
+
+
+class QuadraticFit(object):
+  """
+  Weighted least-squares fit of a parabola y = a*x**2 + b*x + c, updated
+  incrementally. Only the sums of the normal equations are kept, so a
+  point is added or dropped in O(1) and the fit can be read at any time
+  without refitting all samples. Points are weighted by 1/std**2, and
+  the uncertainty of the vertex is propagated from the covariance of the
+  coefficients (scaled up by the reduced chi-square if the scatter is
+  larger than the errors claim).
+
+  x is measured from 'center' internally to keep the sums well
+  conditioned (setpoints are hundreds of degrees, the sums go up to x**4).
+
+  Usage:
+   >> fit = QuadraticFit(center=setpoint0)
+   >> fit.add(setpoint, null, null_std)
+   >> fit.drop(setpoint, null, null_std)   # e.g., when the scan window moves
+   >> vertex, vertex_std = fit.vertex()
+   >> z = fit.poly()                       # as np.polyfit, highest degree first
+  """
+
+  def __init__(self, center=0.0, min_std=1e-3):
+    self.center = float(center)
+    self.min_std = min_std     # floor on std, so that a point with std = 0 does not get infinite weight
+    self.clear()
+
+  def clear(self):
+    """
+    Removes all points.
+    """
+    self.n = 0
+    self.sx = np.zeros(5)      # sum(w * x**k), k = 0..4
+    self.sxy = np.zeros(3)     # sum(w * y * x**k), k = 0..2
+    self.syy = 0.0             # sum(w * y**2)
+
+  def _update(self, x, y, std, sign):
+    w = sign / max(float(std), self.min_std)**2
+    u = float(x) - self.center
+    powers = u**np.arange(5)
+    self.sx = self.sx + w * powers
+    self.sxy = self.sxy + w * float(y) * powers[0:3]
+    self.syy = self.syy + w * float(y)**2
+    self.n = self.n + int(sign)
+
+  def add(self, x, y, std):
+    """
+    Adds one point (null flux y with uncertainty std at setpoint x).
+    """
+    self._update(x, y, std, 1.0)
+
+  def drop(self, x, y, std):
+    """
+    Removes a point which was added before (with the same x, y, std).
+    """
+    self._update(x, y, std, -1.0)
+
+  def solve(self):
+    """
+    Returns the coefficients (c, b, a) in centered coordinates, lowest
+    degree first, and their covariance matrix, or (None, None) if there
+    are fewer than three points or the points are degenerate.
+    """
+    if self.n < 3:
+      return None, None
+    A = np.array([self.sx[0:3], self.sx[1:4], self.sx[2:5]])
+    try:
+      cov = np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+      return None, None
+    p = np.dot(cov, self.sxy)
+    if self.n > 3:
+      chi2 = self.syy - 2.0 * np.dot(p, self.sxy) + np.dot(p, np.dot(A, p))
+      cov = cov * max(1.0, chi2 / (self.n - 3))
+    return p, cov
+
+  def poly(self):
+    """
+    Returns the coefficients [a, b, c] in setpoint coordinates, highest
+    degree first (as np.polyfit), or None.
+    """
+    p, cov = self.solve()
+    if p is None:
+      return None
+    c, b, a = p
+    x0 = self.center
+    return np.array([a, b - 2.0*a*x0, c - b*x0 + a*x0**2])
+
+  def vertex(self):
+    """
+    Returns the setpoint of the vertex and its uncertainty (1 sigma), or
+    (None, None) if there is no fit or the parabola has no minimum.
+    """
+    p, cov = self.solve()
+    if (p is None) or (p[2] <= 0.0):
+      return None, None
+    c, b, a = p
+    u = -0.5 * b / a
+    grad = np.array([0.0, -0.5 / a, 0.5 * b / a**2])   # d(vertex) / d(c, b, a)
+    return self.center + u, np.sqrt(max(0.0, np.dot(grad, np.dot(cov, grad))))
+
+  def model(self, x):
+    """
+    Returns the fitted flux at setpoints x, or None.
+    """
+    z = self.poly()
+    if z is None:
+      return None
+    return np.polyval(z, x)
+
+
+class FringeFit(object):
+  """
+  Weighted least-squares fit of a cosine fringe
+  y = c0 + c1*cos(k*x) + c2*sin(k*x) = c0 + A*cos(k*x - phi),
+  with k = 2*pi / period, i.e., offset, amplitude and phase of the
+  fringe. The model is linear in (c0, c1, c2), so the fit is a single
+  3x3 solve, and like QuadraticFit it only keeps the sums of the normal
+  equations (points are added or dropped in O(1)). Unlike the parabola,
+  the model holds over the whole fringe, so one scan far from the null
+  still gives a good estimate of it.
+
+  The null is at k*x = phi + pi (modulo one period); vertex() returns
+  the null closest to 'center'.
+
+  Usage:
+   >> fit = FringeFit(period=1800.0, center=setpoint0)
+   >> fit.add(setpoint, null, null_std)
+   >> setpoint, setpoint_std = fit.vertex()
+  """
+
+  def __init__(self, period=1800.0, center=0.0, min_std=1e-3):
+    self.period = float(period)
+    self.center = float(center)
+    self.min_std = min_std
+    self.clear()
+
+  def clear(self):
+    """
+    Removes all points.
+    """
+    self.n = 0
+    self.sff = np.zeros((3,3))   # sum(w * f f^T) with f = (1, cos(kx), sin(kx))
+    self.sfy = np.zeros(3)       # sum(w * y * f)
+    self.syy = 0.0               # sum(w * y**2)
+
+  def _basis(self, x):
+    phase = 2.0 * np.pi * (np.asarray(x, dtype=float) - self.center) / self.period
+    return np.array([np.ones(np.shape(phase)), np.cos(phase), np.sin(phase)])
+
+  def _update(self, x, y, std, sign):
+    w = sign / max(float(std), self.min_std)**2
+    f = self._basis(x)
+    self.sff = self.sff + w * np.outer(f, f)
+    self.sfy = self.sfy + w * float(y) * f
+    self.syy = self.syy + w * float(y)**2
+    self.n = self.n + int(sign)
+
+  def add(self, x, y, std):
+    """
+    Adds one point (null flux y with uncertainty std at setpoint x).
+    """
+    self._update(x, y, std, 1.0)
+
+  def drop(self, x, y, std):
+    """
+    Removes a point which was added before (with the same x, y, std).
+    """
+    self._update(x, y, std, -1.0)
+
+  def solve(self):
+    """
+    Returns the coefficients (c0, c1, c2) and their covariance matrix,
+    or (None, None) if there are fewer than three points or the points
+    are degenerate.
+    """
+    if self.n < 3:
+      return None, None
+    try:
+      cov = np.linalg.inv(self.sff)
+    except np.linalg.LinAlgError:
+      return None, None
+    p = np.dot(cov, self.sfy)
+    if self.n > 3:
+      chi2 = self.syy - 2.0 * np.dot(p, self.sfy) + np.dot(p, np.dot(self.sff, p))
+      cov = cov * max(1.0, chi2 / (self.n - 3))
+    return p, cov
+
+  def vertex(self):
+    """
+    Returns the setpoint of the null closest to the center and its
+    uncertainty (1 sigma), or (None, None) if there is no fit or no
+    fringe (zero amplitude).
+    """
+    p, cov = self.solve()
+    if p is None:
+      return None, None
+    c0, c1, c2 = p
+    a2 = c1**2 + c2**2
+    if a2 == 0.0:
+      return None, None
+    phi = np.arctan2(c2, c1)
+    u = (phi + np.pi) / (2.0 * np.pi) * self.period
+    u = u - self.period * np.round(u / self.period)            # closest to the center
+    grad = np.array([0.0, -c2 / a2, c1 / a2])                  # d(phi) / d(c0, c1, c2)
+    phi_std = np.sqrt(max(0.0, np.dot(grad, np.dot(cov, grad))))
+    return self.center + u, phi_std / (2.0 * np.pi) * self.period
+
+  def model(self, x):
+    """
+    Returns the fitted flux at setpoints x, or None.
+    """
+    p, cov = self.solve()
+    if p is None:
+      return None
+    return np.dot(p, self._basis(x))
+
+
+class ScanStrategy(object):
+  """
+  Setpoint search strategy 'scan': grid scans of n_scan setpoints around
+  the current center, a weighted parabola fit (QuadraticFit) over all
+  samples within the scan range around the center, and a new center at
+  the vertex. Converged when the uncertainty of the vertex is below the
+  tolerance. If the fit fails (no minimum, or vertex outside the scan),
+  the center moves one scan step toward the lower flux. After max_scans
+  scans (e.g., on a washed-out fringe), the search ends without having
+  converged, and result() returns the setpoint with the lowest flux
+  measured.
+
+  A strategy only proposes setpoints and digests the measurements, the
+  setpoints are sent and the nulls measured by the caller (see
+  setpoint_controls.run_setpoint_strategy). All strategies have the same
+  interface:
+
+  Usage:
+   >> strategy = setpoint_strategies[cfg['nomic_setpoint_method']].from_config(cfg, setpoint0, scan_range)
+   >> batch = strategy.ask()                    # setpoints to measure next, None when done
+   >> strategy.tell(setpoint, null, null_err)   # for every setpoint of the batch
+   >> print(strategy.update())                  # after the batch, returns a status line
+   >> strategy.restart()                        # e.g., if the phase loop opened during the batch
+   >> setpoint, setpoint_err = strategy.result()
+  """
+
+  name = 'scan'
+
+  def __init__(self, start, scan_range, n_scan, tolerance, max_scans=10):
+    self.center = float(start)
+    self.previous = self.center
+    self.tolerance = float(tolerance)
+    self.max_scans = max_scans
+    self.step = np.sum(np.abs(scan_range)) / float(n_scan - 1)   # step width of the scan
+    self.offsets = (np.arange(n_scan) - (n_scan - 1) // 2) * self.step
+    self.half_width = np.max(np.abs(scan_range)) + 0.5 * self.step    # samples further from the center are dropped
+    self.fit = self._new_fit()
+    self.samples = []             # (setpoint, flux, std of mean flux) in the fit
+    self.batch = []
+    self.y = []
+    self.std = []
+    self.setpoint_std = None
+    self.converged = False
+    self.iterations = 0
+    self.best = None              # (flux, setpoint) of the lowest flux measured
+
+  @classmethod
+  def from_config(cls, cfg, start, scan_range):
+    return cls(start, scan_range, cfg['nomic_setpoint_n_scan'], cfg['nomic_setpoint_tolerance'], cfg['nomic_setpoint_max_scans'])
+
+  def _new_fit(self):
+    return QuadraticFit(center=self.center)
+
+  def _usable(self, setpoint):
+    return (setpoint >= self.batch[0]) and (setpoint <= self.batch[-1])   # the parabola only holds within the scan
+
+  def ask(self):
+    if self.converged or (self.iterations >= self.max_scans):
+      return None
+    self.batch = list(self.center + self.offsets)
+    self.y = []
+    self.std = []
+    return self.batch
+
+  def tell(self, x, y, std):
+    sample = (float(x), float(y), float(std))
+    self.fit.add(*sample)
+    self.samples.append(sample)
+    self.y.append(sample[1])
+    self.std.append(sample[2])
+    if (self.best is None) or (sample[1] < self.best[0]):
+      self.best = (sample[1], sample[0])
+
+  def update(self):
+    self.iterations = self.iterations + 1
+    setpoint_new, setpoint_err = self.fit.vertex()
+    if (setpoint_new is None) or (not self._usable(setpoint_new)):
+      if self.y[0] < self.y[-1]:
+        setpoint_new = self.batch[1]
+      else:
+        setpoint_new = self.batch[-2]
+      message = '  Iteration %i -- min. flux %.2f max. flux %.2f -- new setpoint = %.1f -- FAILED' % (self.iterations, np.min(self.y), np.max(self.y), setpoint_new)
+    else:
+      self.converged = setpoint_err <= self.tolerance
+      self.setpoint_std = setpoint_err
+      message = '  Iteration %i -- min. flux %.2f max. flux %.2f -- new setpoint = %.1f +/- %.1f (%i samples)' % (self.iterations, np.min(self.y), np.max(self.y), setpoint_new, setpoint_err, self.fit.n)
+    self.previous = self.center
+    self.center = setpoint_new
+    for sample in self.samples:
+      if np.abs(sample[0] - self.center) > self.half_width:
+        self.fit.drop(*sample)
+    self.samples = [sample for sample in self.samples if np.abs(sample[0] - self.center) <= self.half_width]
+    return message
+
+  def restart(self):
+    self.center = self.previous
+    self.fit.clear()   # samples taken with the loop open are not trusted
+    self.samples = []
+    self.converged = False
+    self.best = None
+
+  def result(self):
+    if (not self.converged) and (self.iterations >= self.max_scans) and (self.best is not None):
+      return self.best[1], None   # gave up, the lowest flux is the best guess
+    return self.center, self.setpoint_std
+
+  def curve(self):
+    xp = np.linspace(self.batch[0] - self.step, self.batch[-1] + self.step, 60)
+    return xp, self.fit.model(xp)
+
+
+class FringeStrategy(ScanStrategy):
+  """
+  Setpoint search strategy 'fringe': grid scans as ScanStrategy, but a
+  cosine fringe fit (FringeFit) over all samples. The fringe model holds
+  over the whole fringe, so no samples are dropped and the vertex may be
+  outside the scan.
+  """
+
+  name = 'fringe'
+
+  def __init__(self, start, scan_range, n_scan, tolerance, period=1800.0, max_scans=10):
+    self.period = period
+    ScanStrategy.__init__(self, start, scan_range, n_scan, tolerance, max_scans)
+    self.half_width = np.inf
+
+  @classmethod
+  def from_config(cls, cfg, start, scan_range):
+    return cls(start, scan_range, cfg['nomic_setpoint_n_scan'], cfg['nomic_setpoint_tolerance'], cfg['nomic_setpoint_fringe_period'], cfg['nomic_setpoint_max_scans'])
+
+  def _new_fit(self):
+    return FringeFit(self.period, center=self.center)
+
+  def _usable(self, setpoint):
+    return True
+
+
+class ParabolaStrategy(object):
+  """
+  Setpoint search strategy 'brent': successive parabolic interpolation
+  (ParabolicSearch), one probe per batch. Every measurement is used to
+  choose the next probe. Converged when the vertex of the parabola fit
+  around the best probe is known to better than the tolerance. After a
+  restart, the search starts again from the best setpoint so far.
+  """
+
+  name = 'brent'
+
+  def __init__(self, start, step, tolerance, max_probes=15, max_travel=None):
+    self.step = float(step)
+    self.tolerance = tolerance
+    self.max_probes = max_probes
+    self.max_travel = max_travel
+    self.search = ParabolicSearch(start, step, tolerance, max_probes=max_probes, max_travel=max_travel)
+    self.n_probes = 0
+    self.last = None
+
+  @classmethod
+  def from_config(cls, cfg, start, scan_range):
+    step = np.sum(np.abs(scan_range)) / float(cfg['nomic_setpoint_n_scan'] - 1)
+    return cls(start, step, cfg['nomic_setpoint_tolerance'], cfg['nomic_setpoint_max_probes'], 2 * np.max(np.abs(scan_range)))
+
+  def _get_converged(self):
+    return self.search.converged
+  converged = property(_get_converged)
+
+  def ask(self):
+    x = self.search.ask()
+    if x is None:
+      return None
+    return [x]
+
+  def tell(self, x, y, std):
+    self.search.tell(x, y, std)
+    self.n_probes = self.n_probes + 1
+    self.last = (x, y, std)
+
+  def update(self):
+    return '  Probe %i -- setpoint %.1f -- flux %.2f +/- %.2f' % ((self.n_probes,) + self.last)
+
+  def restart(self):
+    self.search = ParabolicSearch(self.search.result(), self.step, self.tolerance, max_probes=self.max_probes, max_travel=self.max_travel)
+
+  def result(self):
+    return self.search.result(), self.search.vertex_std
+
+  def curve(self):
+    return None
+
+
+class GradientStrategy(object):
+  """
+  Setpoint search strategy 'gradient': dithers the setpoint by +/- step
+  around the current center and moves the center by a Newton step,
+  -gradient / curvature, with the gradient from the two dither
+  positions. The curvature is measured (one extra probe at the center)
+  at the start and again after every large step, so most iterations
+  take two probes. If the curvature is not positive, the center walks
+  one step downhill. Steps are limited to 2 * step. Converged when the
+  uncertainty of the new center (from the gradient uncertainty) is
+  below the tolerance, and the center moved by less than the tolerance
+  (a Newton step from far off the null is not trusted yet).
+  """
+
+  name = 'gradient'
+
+  def __init__(self, start, step, tolerance, max_probes=15):
+    self.center = float(start)
+    self.step = float(step)
+    self.tolerance = float(tolerance)
+    self.max_probes = max_probes
+    self.previous = self.center
+    self.curvature = None
+    self.setpoint_std = None
+    self.converged = False
+    self.n_probes = 0
+    self.batch = []
+    self.y = {}
+    self.std = {}
+
+  @classmethod
+  def from_config(cls, cfg, start, scan_range):
+    step = np.sum(np.abs(scan_range)) / float(cfg['nomic_setpoint_n_scan'] - 1)
+    return cls(start, step, cfg['nomic_setpoint_tolerance'], cfg['nomic_setpoint_max_probes'])
+
+  def ask(self):
+    if self.converged or (self.n_probes >= self.max_probes):
+      return None
+    if self.curvature is None:
+      self.batch = [self.center - self.step, self.center, self.center + self.step]
+    else:
+      self.batch = [self.center - self.step, self.center + self.step]
+    self.y = {}
+    self.std = {}
+    return self.batch
+
+  def tell(self, x, y, std):
+    i = self.batch.index(x)
+    self.y[i] = float(y)
+    self.std[i] = float(std)
+    self.n_probes = self.n_probes + 1
+
+  def update(self):
+    last = len(self.batch) - 1
+    gradient = (self.y[last] - self.y[0]) / (2.0 * self.step)
+    gradient_std = np.sqrt(self.std[last]**2 + self.std[0]**2) / (2.0 * self.step)
+    if len(self.batch) == 3:
+      self.curvature = (self.y[0] + self.y[2] - 2.0 * self.y[1]) / self.step**2
+    if (self.curvature is None) or (self.curvature <= 0.0):
+      move = -np.sign(gradient) * self.step
+      self.curvature = None
+      self.setpoint_std = None
+    else:
+      move = np.clip(-gradient / self.curvature, -2.0 * self.step, 2.0 * self.step)
+      self.setpoint_std = gradient_std / self.curvature
+      self.converged = (self.setpoint_std <= self.tolerance) and (np.abs(move) <= self.tolerance)
+      if np.abs(move) > self.step:
+        self.curvature = None   # measure it again at the new center
+    self.previous = self.center
+    self.center = self.center + move
+    return '  Probe %i -- gradient %.3f +/- %.3f -- new setpoint = %.1f' % (self.n_probes, gradient, gradient_std, self.center)
+
+  def restart(self):
+    self.center = self.previous
+    self.curvature = None
+    self.converged = False
+
+  def result(self):
+    return self.center, self.setpoint_std
+
+  def curve(self):
+    return None
+
+
+setpoint_strategies = {'scan': ScanStrategy, 'fringe': FringeStrategy, 'brent': ParabolaStrategy, 'gradient': GradientStrategy}   # method name -> strategy class
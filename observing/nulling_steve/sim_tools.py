@@ -0,0 +1,341 @@
+import numpy
+import numpy as np
+import re
+import sys
+import threading
+import time
+
+class VirtualClock(object):
+  """
+  Simulated time for offline runs. install() replaces time.time and
+  time.sleep, so that sleeps, INDI latencies, and frame arrivals take no
+  wall time and runs are reproducible. Modules which bind sleep at
+  import (from time import sleep) must be imported after install().
+
+  Usage:
+   >> clock = VirtualClock()
+   >> clock.install()
+   >> ...
+   >> clock.uninstall()
+  """
+
+  epoch = 1.5e9   # time.time() at t = 0
+
+  def __init__(self):
+    self.t = 0.0
+    self.lock = threading.RLock()
+    self.originals = None
+
+  def time(self):
+    return self.epoch + self.t
+
+  def sleep(self, dt):
+    self.advance(dt)
+
+  def advance(self, dt):
+    self.lock.acquire()
+    try:
+      self.t = self.t + max(0.0, float(dt))
+      return self.t
+    finally:
+      self.lock.release()
+
+  def install(self):
+    if self.originals is None:
+      self.originals = (time.time, time.sleep)
+      time.time = self.time
+      time.sleep = self.sleep
+
+  def uninstall(self):
+    if self.originals is not None:
+      time.time, time.sleep = self.originals
+      self.originals = None
+
+
+class SimTimeout(Exception):
+  """
+  Raised by the simulator when a run exceeds its (simulated) time limit.
+  """
+  pass
+
+
+class SimUnsupported(Exception):
+  """
+  Raised by the simulator for an INDI call it does not simulate (e.g.,
+  getFITS, since there are no NOMIC images).
+  """
+  pass
+
+
+class FringeSim(object):
+  """
+  Simulated INDI server for the setpoint search: PHASECAM (PLC) and NOMIC
+  with a cosine fringe on the null ROI.
+
+  The null position (the setpoint of the dark fringe) moves with a
+  linear piston drift plus a random walk. NOMIC takes frames at 'fps';
+  the null flux of a frame follows the setpoint in effect when the frame
+  started,
+    Mean3 - 0.5 * (Mean1 + Mean2) = amplitude * (1 - cos(2 pi (setpoint - null) / period)) / 2 + noise.
+  Every INDI call advances the clock by 'latency' seconds (plus an
+  exponential jitter of mean 'jitter'); setINDI with wait=False costs
+  nothing. All calls are counted by method.
+
+  Supports what the setpoint scripts use: PLC settings and setpoints,
+  PLC.CloseLoop, NOMIC.CamInfo, NOMIC.NullingStats, NOMIC.ROIStats (via
+  getKeys), NOMIC.Command.text ('go' waits for the frames), and
+  evalINDI on NOMIC.CamInfo.FIndex. Images (getFITS, cutRegion) are not
+  simulated and raise SimUnsupported.
+
+  Usage:
+   >> sim = FringeSim(clock, seed=1, setpoint=0.0, null=250.0)
+   >> install(sim)        # 'from pyindi import *' now connects to sim
+  """
+
+  def __init__(self, clock, seed=0, setpoint=0.0, null=0.0, period=1800.0, amplitude=1000.0, background=500.0,
+               noise=20.0, fps=20.0, latency=0.02, jitter=0.005, drift=0.0, walk=0.0, time_limit=None):
+    self.clock = clock
+    self.rng = np.random.RandomState(seed)
+    self.period = period
+    self.amplitude = amplitude
+    self.background = background
+    self.noise = noise                # ADU rms per ROI and frame
+    self.fps = fps
+    self.latency = latency            # s, INDI round trip
+    self.jitter = jitter              # s, mean of the exponential latency jitter
+    self.drift = drift                # deg/s, linear piston drift of the null
+    self.walk = walk                  # deg/sqrt(s), random walk of the null
+    self.time_limit = time_limit      # s of simulated time, SimTimeout after that
+    self.t0 = clock.t
+    self.null0 = float(null)
+    self.walked = 0.0                 # random walk of the null up to frame self.frame_walked
+    self.frame_walked = self.frame_index()
+    self.setpoints = {'UBC': [(self.t0 - 1.0, float(setpoint))], 'NAC': [(self.t0 - 1.0, float(setpoint))]}
+    self.n_sequ = 1
+    self.frames = {}                  # frame index -> stats (last few frames)
+    self.calls = {}                   # method -> number of calls
+    self.lock = threading.RLock()
+
+  # Model -----------------------------------------------------------------
+
+  def now(self):
+    return self.clock.t - self.t0
+
+  def frame_index(self):
+    return int((self.clock.t - self.t0) * self.fps)
+
+  def setpoint(self, pzt='UBC', t=None):
+    """
+    Returns the setpoint of a PZT at (clock) time t (default: now).
+    """
+    if t is None:
+      t = self.clock.t
+    value = self.setpoints[pzt][0][1]
+    for t_set, setpoint in self.setpoints[pzt]:
+      if t_set > t:
+        break
+      value = setpoint
+    return value
+
+  def null(self, t=None):
+    """
+    Returns the setpoint of the dark fringe at (clock) time t (default:
+    now), without the part of the random walk not simulated yet.
+    """
+    if t is None:
+      t = self.clock.t
+    return self.null0 + self.drift * (t - self.t0) + self.walked
+
+  def error(self, pzt='UBC'):
+    """
+    Returns the current setpoint error (setpoint - null), wrapped to
+    [-period/2, period/2).
+    """
+    e = self.setpoint(pzt) - self.null()
+    return (e + 0.5 * self.period) % self.period - 0.5 * self.period
+
+  def _stats(self, frame):
+    if frame in self.frames:
+      return self.frames[frame]
+    if frame > self.frame_walked:
+      self.walked = self.walked + self.walk * np.sqrt((frame - self.frame_walked) / self.fps) * self.rng.randn()
+      self.frame_walked = frame
+    t_frame = self.t0 + frame / self.fps
+    phase = 2.0 * np.pi * (self.setpoint('UBC', t_frame) - self.null(t_frame)) / self.period
+    flux = 0.5 * self.amplitude * (1.0 - np.cos(phase))
+    means = self.background + self.noise * self.rng.randn(3)
+    means[2] = means[2] + flux
+    stats = {'Mean1': means[0], 'Mean2': means[1], 'Mean3': means[2]}
+    self.frames[frame] = stats
+    for old in [f for f in self.frames.keys() if f < frame - 100]:
+      del self.frames[old]
+    return stats
+
+  def _set_setpoint(self, pzt, value):
+    history = self.setpoints[pzt]
+    history.append((self.clock.t, float(value)))
+    if len(history) > 1000:
+      del history[0:500]
+
+  # INDI ------------------------------------------------------------------
+
+  def _call(self, method, wait=True):
+    self.calls[method] = self.calls.get(method, 0) + 1
+    if wait:
+      self.clock.advance(self.latency + self.rng.exponential(self.jitter))
+    if (self.time_limit is not None) and (self.now() > self.time_limit):
+      raise SimTimeout('time limit of %.0f s exceeded' % (self.time_limit))
+
+  def _value(self, name):
+    device, prop, element = name.split('.', 2)
+    frame = self.frame_index()
+    if (device, prop) == ('PLC', 'UBCSettings') or (device, prop) == ('PLC', 'NACSettings'):
+      pzt = prop[0:3]
+      values = {'PLSetpoint': self.setpoint(pzt), 'Beam2_y': 124.0, 'Beam2_x': 124.0}
+    elif (device, prop) == ('PLC', 'PLSetpoint'):
+      values = {'PLSetpoint': self.setpoint('UBC'), 'forNAC': 0}
+    elif (device, prop) == ('PLC', 'CloseLoop'):
+      values = {'Yes': 1, 'No': 0}
+    elif (device, prop) == ('NOMIC', 'CamInfo'):
+      values = {'FIndex': frame, 'IntTime': 1.0 / self.fps, 'Go': 0, 'NCoadds': 1, 'NSeqs': self.n_sequ}
+    elif (device, prop) == ('NOMIC', 'NullingStats'):
+      values = self._stats(frame - 1)   # last complete frame
+    elif (device, prop) == ('LBTO', 'AOStatus'):
+      values = {'L_AOStatus': 'AORunning', 'R_AOStatus': 'AORunning'}
+    else:
+      raise KeyError('%s is not simulated' % (name))
+    prefix = '%s.%s.' % (device, prop)
+    if element == '*':
+      return dict([(prefix + key, values[key]) for key in values.keys()])
+    return {name: values[element]}
+
+  def getINDI(self, *names, **kwargs):
+    self.lock.acquire()
+    try:
+      self._call('getINDI', kwargs.get('wait', True))
+      values = {}
+      for name in names:
+        values.update(self._value(name))
+      if (len(names) == 1) and (not names[0].endswith('*')):
+        return values[names[0]]
+      return values
+    finally:
+      self.lock.release()
+
+  def setINDI(self, *args, **kwargs):
+    self.lock.acquire()
+    try:
+      self._call('setINDI', kwargs.get('wait', True))
+      if isinstance(args[0], dict):
+        items = args[0].items()
+      elif len(args) > 1:
+        items = [(args[i], args[i+1]) for i in range(0, len(args) - 1, 2)]
+      else:
+        name, values = args[0].split('.', 2)[0:2], args[0].split('.', 2)[2]
+        prefix = '.'.join(name) + '.'
+        items = [(prefix + item.split('=')[0], item.split('=')[1]) for item in values.split(';')]
+      items = dict(items)
+      if 'PLC.PLSetpoint.PLSetpoint' in items:
+        pzt = ['UBC', 'NAC'][int(items.get('PLC.PLSetpoint.forNAC', 0))]
+        self._set_setpoint(pzt, float(items['PLC.PLSetpoint.PLSetpoint']))
+      for pzt in ['UBC', 'NAC']:
+        key = 'PLC.%sSettings.PLSetpoint' % (pzt)
+        if key in items:
+          self._set_setpoint(pzt, float(items[key]))
+      if 'NOMIC.Command.text' in items:
+        self._command(str(items['NOMIC.Command.text']), kwargs.get('wait', True))
+    finally:
+      self.lock.release()
+
+  def _command(self, text, wait):
+    words = text.split()
+    for i in range(len(words)):
+      if (words[i] == 'lbtintpar') and (i >= 3):
+        self.n_sequ = int(words[i-1])
+      if (words[i] == 'go') and wait:
+        self.clock.advance(self.n_sequ / self.fps)   # integrate n_sequ frames
+
+  def evalINDI(self, expression, timeout=None, **kwargs):
+    self.lock.acquire()
+    try:
+      self._call('evalINDI', False)
+      match = re.match(r'\s*"NOMIC\.CamInfo\.FIndex"\s*>=\s*(-?\d+)', expression)
+      if match is None:
+        self.clock.advance(self.latency)
+        return True   # everything else (e.g., loop status) is true in the simulation
+      t_frame = self.t0 + int(match.group(1)) / self.fps
+      if (timeout is not None) and (t_frame - self.clock.t > timeout):
+        self.clock.advance(timeout)
+        raise Exception('evalINDI timed out')
+      self.clock.advance(max(0.0, t_frame - self.clock.t) + self.latency)
+      return True
+    finally:
+      self.lock.release()
+
+  def getKeys(self, device='NOMIC', prop='ROIStats', key='ID', nunique=3, **kwargs):
+    self.lock.acquire()
+    try:
+      self._call('getKeys')
+      stats = self._stats(self.frame_index() - 1)
+      return dict([('%i' % (i), {'ID': '%i' % (i), 'Mean': stats['Mean%i' % (i)]}) for i in [1, 2, 3]])
+    finally:
+      self.lock.release()
+
+  def _unsupported(self, method, args):
+    raise SimUnsupported('%s%r is not supported by the simulated INDI server: it has no NOMIC images, '
+                         'only CamInfo, NullingStats/ROIStats, PLC settings, and AO status' % (method, tuple(args)))
+
+  def getFITS(self, *args, **kwargs):
+    self._call('getFITS')
+    self._unsupported('getFITS', args)
+
+  def cutRegion(self, *args, **kwargs):
+    self._unsupported('cutRegion', args[1:])   # not the image
+
+  def ppD(self, d):
+    pass
+
+
+server = None   # the FringeSim the PyINDI stand-ins connect to, see install()
+
+class PyINDI(object):
+  """
+  Stand-in for pyindi.PyINDI which talks to the simulated server.
+  """
+
+  def __init__(self, verbose=False, **kwargs):
+    if server is None:
+      raise IOError('no simulated INDI server installed')
+
+  def __getattr__(self, name):
+    return getattr(server, name)
+
+
+class NullDisplay(object):
+  """
+  Stand-in for matplotlib and matplotlib.pyplot during offline runs:
+  every attribute and call does nothing.
+  """
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return self
+
+  def __call__(self, *args, **kwargs):
+    return self
+
+
+def install(sim, display=True):
+  """
+  Makes 'import pyindi' (and 'from pyindi import *') use the simulated
+  server sim, and (if display is True) replaces matplotlib by a
+  NullDisplay so that the scripts run without a display.
+  """
+  global server
+  server = sim
+  sys.modules['pyindi'] = sys.modules[__name__]
+  if display:
+    null_display = NullDisplay()
+    sys.modules['matplotlib'] = null_display
+    sys.modules['matplotlib.pyplot'] = null_display
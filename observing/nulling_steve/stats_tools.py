@@ -0,0 +1,234 @@
+from pyindi import *
+import abc
+import numpy as np
+from time import sleep
+
+from session_tools import pi
+from robust_tools import robust_null, NoisePool
+
+class StatsReader(object):
+  """
+  Abstract base class of the NOMIC statistics readers (use
+  NullingStatsReader or ROIStatsReader, it cannot be instantiated
+  itself). A reader fetches a full statistics vector in a single
+  request and returns it as a NumPy record tagged with the frame index,
+  so that all values of one sample come from the same frame. Derived
+  readers implement _fetch() for their INDI property.
+
+  The record fields are 'frame' followed by the statistics keys (sorted)
+  as found in the first sample. They are available as reader.fields.
+  """
+
+  __metaclass__ = abc.ABCMeta
+
+  def __init__(self):
+    self.fields = None
+    self.dtype = None
+
+  @abc.abstractmethod
+  def _fetch(self):
+    """
+    Returns (frame index, dictionary of statistics).
+    """
+    pass
+
+  def _values(self, frame, stats):
+    if self.fields is None:
+      keys = [key for key in stats.keys() if _is_number(stats[key])]
+      keys.sort()
+      self.fields = ['frame'] + keys
+      self.dtype = np.dtype([('frame', np.int64)] + [(key, np.float64) for key in keys])
+    return tuple([int(frame)] + [float(stats[key]) for key in self.fields[1:]])
+
+  def read(self):
+    """
+    Reads one sample and returns it as a NumPy record.
+
+    Usage:
+     >> rec = reader.read()
+     >> print(rec.frame, rec.Mean3)
+    """
+    frame, stats = self._fetch()
+    return np.rec.array([self._values(frame, stats)], dtype=self.dtype)[0]
+
+  def read_n(self, n, interval=0.0):
+    """
+    Reads n samples, waiting interval seconds between two reads, and
+    returns an (n, k) array. Column j holds reader.fields[j], i.e., the
+    frame index is in column 0.
+
+    Usage:
+     >> data = reader.read_n(5)
+    """
+    data = np.zeros((n, 0))
+    for i in range(n):
+      frame, stats = self._fetch()
+      values = self._values(frame, stats)
+      if i == 0:
+        data = np.zeros((n, len(values)))
+      data[i] = values
+      if (interval > 0.0) and (i < n - 1):
+        sleep(interval)
+    return data
+
+  def column(self, data, key):
+    """
+    Returns the values of one statistics key from a record or from an
+    array returned by read_n.
+    """
+    if getattr(data, 'dtype', None) is not None and data.dtype.names is not None:
+      return data[key]
+    return np.asarray(data)[..., self.fields.index(key)]
+
+  def null(self, data):
+    """
+    Returns the background subtracted flux at null, i.e.,
+    Mean3 - 0.5 * (Mean1 + Mean2), for a record or for every row of an
+    array returned by read_n.
+    """
+    return self.column(data, 'Mean3') - 0.5 * (self.column(data, 'Mean1') + self.column(data, 'Mean2'))
+
+  def robust_null(self, data, clip=5.0, pool=None):
+    """
+    Returns the flux at null from the sigma-clipped means of the three
+    ROIs over the rows of an array returned by read_n (see
+    robust_tools.robust_null), its uncertainty, and the number of
+    rejected ROI values. A cosmic or a bad pixel in one frame and ROI is
+    rejected instead of averaged in if the stack has 10 frames or more,
+    or, for short stacks (3 frames or more), if a robust_tools.NoisePool
+    kept over the stacks (e.g., of a setpoint search) is given and has
+    seen a few stacks.
+    """
+    means = np.array([self.column(data, key) for key in ['Mean1', 'Mean2', 'Mean3']]).T
+    return robust_null(means, clip, pool)
+
+
+class NullingStatsReader(StatsReader):
+  """
+  Reads NOMIC.NullingStats and the camera frame index (CamInfo.FIndex)
+  in one request, instead of one getINDI per value.
+
+  Usage:
+   >> stats = NullingStatsReader()
+   >> null = stats.null(stats.read())
+   >> nulls = stats.null(stats.read_n(10))
+  """
+
+  def __init__(self, camera='NOMIC'):
+    StatsReader.__init__(self)
+    self.camera = camera
+
+  def _fetch(self):
+    values = pi.getINDI('%s.NullingStats.*' % (self.camera), '%s.CamInfo.FIndex' % (self.camera))
+    frame = values.pop('%s.CamInfo.FIndex' % (self.camera))
+    stats = {}
+    for key in values.keys():
+      stats[key.split('.')[-1]] = values[key]
+    return frame, stats
+
+
+class ROIStatsReader(StatsReader):
+  """
+  Reads the statistics of all ROIs from NOMIC.ROIStats in one request
+  (as pi.getKeys does) and flattens them to fields named <key><ROI ID>,
+  e.g., Mean3 for the mean of ROI 3, so that null() works the same way
+  as for NullingStats. ROIStats does not carry a frame index, so the
+  record is tagged with CamInfo.FIndex read right after the statistics
+  (one additional request), unless tag_frame=False is given, in which
+  case the frame index is -1.
+
+  Usage:
+   >> rois = ROIStatsReader()
+   >> null = rois.null(rois.read())
+  """
+
+  def __init__(self, camera='NOMIC', nunique=3, tag_frame=True):
+    StatsReader.__init__(self)
+    self.camera = camera
+    self.nunique = nunique
+    self.tag_frame = tag_frame
+
+  def _fetch(self):
+    rois = pi.getKeys(device=self.camera, prop='ROIStats', key='ID', nunique=self.nunique)
+    frame = -1
+    if self.tag_frame:
+      frame = pi.getINDI('%s.CamInfo.FIndex' % (self.camera))
+    stats = {}
+    for roi_id in rois.keys():
+      for key in rois[roi_id].keys():
+        stats['%s%s' % (key, roi_id)] = rois[roi_id][key]
+    return frame, stats
+
+
+class FrameClock(object):
+  """
+  Paces statistics reads on the camera frame counter (CamInfo.FIndex)
+  instead of sleeping for one integration time. next_n(n) blocks on the
+  server (evalINDI) until a new frame has arrived, reads its statistics,
+  and repeats until n distinct new frames were collected. A frame is
+  never returned twice and no time is spent waiting beyond the arrival
+  of the next frame.
+  
+  After a change of the setpoint, call sync() (or pass settle to next_n)
+  so that only frames integrated after the change are used.
+  
+  Usage:
+   >> clock = FrameClock(NullingStatsReader())
+   >> clock.sync()                # e.g. after sending a new setpoint
+   >> data = clock.next_n(3)      # (3, k) array, see reader.fields
+  """
+  
+  def __init__(self, reader=None, camera='NOMIC', timeout=60):
+    if reader is None:
+      reader = NullingStatsReader(camera)
+    self.reader = reader
+    self.camera = camera
+    self.timeout = timeout
+    self.last = None      # frame index of the last frame used
+    self.skipped = 0      # number of frames which arrived while reading and were not used
+  
+  def sync(self, settle=1):
+    """
+    Marks the current frame as used. With settle=1 (default) the frame
+    currently being integrated is skipped as well, since it may have
+    started before a change of the setpoint.
+    """
+    self.last = int(pi.getINDI('%s.CamInfo.FIndex' % (self.camera))) + settle
+  
+  def wait(self, frame):
+    """
+    Blocks until the camera frame index is at least frame.
+    """
+    pi.evalINDI('"%s.CamInfo.FIndex" >= %d' % (self.camera, frame), timeout=self.timeout)
+  
+  def next_n(self, n, settle=None):
+    """
+    Waits for the next n new frames and returns their statistics as an
+    (n, k) array with the frame index in column 0. Calls sync(settle)
+    first if settle is given.
+    """
+    if (settle is not None) or (self.last is None):
+      self.sync(settle or 0)
+    data = None
+    i = 0
+    while i < n:
+      self.wait(self.last + 1)
+      frame, stats = self.reader._fetch()
+      if frame <= self.last:
+        continue    # the frame index has not advanced yet, read again
+      values = self.reader._values(frame, stats)
+      if data is None:
+        data = np.zeros((n, len(values)))
+      data[i] = values
+      self.skipped = self.skipped + (int(frame) - self.last - 1)
+      self.last = int(frame)
+      i = i + 1
+    return data
+
+
+def _is_number(value):
+  try:
+    float(value)
+  except (TypeError, ValueError):
+    return False
+  return True
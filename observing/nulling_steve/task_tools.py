@@ -0,0 +1,86 @@
+import threading
+import time
+import sys
+from session_tools import pi
+from profile_tools import profiler
+
+class Task(threading.Thread):
+  """
+  Runs a function in a thread with its own INDI connection (session
+  channel named after the task) and records its wall time and result or
+  error.
+
+  run() can also be called directly to run the function in the calling
+  thread (on its INDI channel), with the same records.
+
+  Usage:
+   >> task = Task('telescope', offset_telescope, args=(cfg,))
+   >> task.start(); task.join()
+   >> print(task.duration)
+  """
+
+  def __init__(self, name, target, args=(), kwargs=None):
+    threading.Thread.__init__(self, name=name)
+    self.target = target
+    self.args = args
+    self.kwargs = kwargs or {}
+    self.result = None
+    self.error = None
+    self.t_start = None
+    self.duration = None
+    self.section = profiler.current()   # profiled function which started the task
+
+  def run(self):
+    if threading.currentThread() is self:
+      pi.use_channel(self.getName())   # run() called directly keeps the channel of the calling thread
+    if self.section is not None:
+      profiler.enter(self.section)
+    try:
+      self.t_start = time.time()
+      try:
+        self.result = self.target(*self.args, **self.kwargs)
+      except Exception:
+        self.error = sys.exc_info()
+      self.duration = time.time() - self.t_start
+    finally:
+      if self.section is not None:
+        profiler.leave()   # the calling function counts the time of the section
+
+
+def run_parallel(actions, verbose=True):
+  """
+  Runs independent actions concurrently and waits for all of them to
+  finish. actions is a list of (name, function) or (name, function,
+  args) tuples. Prints the wall time of each action (if verbose) and
+  returns a dictionary name -> wall time in s. If an action failed, the
+  first error is raised again after all actions finished.
+
+  Usage:
+   >> run_parallel([('opw', move_opw), ('telescope', offset_telescope, (cfg, 1))])
+  """
+  t0 = time.time()
+  tasks = []
+  for action in actions:
+    args = ()
+    if len(action) > 2:
+      args = action[2]
+    task = Task(action[0], action[1], args=args)
+    task.start()
+    tasks.append(task)
+  timing = {}
+  error = None
+  for task in tasks:
+    task.join()
+    timing[task.getName()] = task.duration
+    if (task.error is not None) and (error is None):
+      error = task.error
+  if verbose:
+    for task in tasks:
+      status = ''
+      if task.error is not None:
+        status = ' (FAILED: %s)' % (task.error[1])
+      print('  %-25s %6.2f s%s' % (task.getName(), task.duration, status))
+    print('  %-25s %6.2f s' % ('total (in parallel)', time.time() - t0))
+  if error is not None:
+    raise error[0], error[1], error[2]
+  return timing
@@ -1,10 +1,27 @@
 from pyindi import * 
 import numpy as np
 from print_tools import *
+from profile_tools import *
+from command_tools import *
+from wait_tools import *
+from task_tools import *
+from roi_tools import *
 from time import sleep
 
-pi = PyINDI()
+from session_tools import pi
 
+nod_offset = 0.0   # net nod offset in arcsec since nomops was loaded (nods of both sides only)
+
+def nod_position():
+  """
+  Returns the nod position as the net nod offset in arcsec since nomops
+  was loaded, e.g., '+0.0' at the start position and '+2.3' after a nod
+  up. Used to tell the nod positions apart (e.g., for cached setpoints).
+  """
+  return '%+.1f' % (nod_offset)
+
+
+@profiled
 def nod(cfg, nod_dir, move_tel=True, side='both'):
   """
   Nods the telescope and updates the position of the PHASECAM beams
@@ -49,33 +66,23 @@ def nod(cfg, nod_dir, move_tel=True, side='both'):
     sign = -1
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Take a background (and repeat to make sure it is a good one)
-  # Set camera in safe state.
-  pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  
-  # Set up camera for integration.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  
-  # Integrate.
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
-  
-  # Use background.
-  pi.setINDI('NOMIC.Command.text', 'rawbg', timeout=50000, wait=True)
-  
-  # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  # Set camera in safe state and set up camera for integration (changes only).
+  nomic_state.set('contacq', 0).set('loglevel', 0)
+  nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1)
+  changed = nomic_state.flush()
+  
+  # Integrate
+  if changed:
+    sleep(0.3)
+  nomic_state.send('go', timeout=50000)
+  
+  # Use background and set camera in continuous.
+  nomic_state.add('rawbg')
+  nomic_state.set('savedata', 0).set('loglevel', 0).set('autodispwhat', 1).set('contacq', 1)
+  nomic_state.flush(timeout=50000)
   
   if side == 'both':
     #Get current NIL_OPW position
@@ -88,37 +95,60 @@ def nod(cfg, nod_dir, move_tel=True, side='both'):
   # Open phase loop
   pi.setINDI('PLC.CloseLoop.Yes=Off')
   
+  # Move everything at the same time and wait for all of it to finish
+  actions = []
   if side == 'both':
-    # Move OPW
-    pi.setINDI('Warm.NIL_OPW.command', '%i' % (opw_pos - sign * cfg['opw_offset_nod']), wait=False)
-  
+    actions.append(('OPW', _move_opw, (opw_pos - sign * cfg['opw_offset_nod'],)))
   if move_tel == True:
-    # Nod the telescope side(s)
-    pi.setINDI('LBTO.OffsetPointing.CoordSys', 'DETXY', 'LBTO.OffsetPointing.OffsetX', 0, 'LBTO.OffsetPointing.OffsetY', (sign * cfg['nod_throw']), 'LBTO.OffsetPointing.Side', side, 'LBTO.OffsetPointing.Type', 'REL', wait=False)
-  
+    actions.append(('telescope', _offset_telescope, (sign * cfg['nod_throw'], side)))
   if side == 'both':
-    # Move beam 2 position
     settings['PLC.%sSettings.Beam2_y' % (cfg['pzt'])] = beam2_y + sign * cfg['phasecam_beam2_offset_nod']
-    pi.setINDI(settings)
-    
-    # ROI info
-    ROIIDs = [1,2,3]
-    ROI_nod = np.int(cfg['nod_throw'] / 0.018)     # Nodding offset in pix
-  
-    # Move ROI positions
-    for i in range(0, len(ROIIDs)):
-      qroi = dict([('NOMIC.QueryROI.ROIID', ROIIDs[i]), ('NOMIC.QueryROI.X', 0.0), ('NOMIC.QueryROI.Y', 0.0), ('NOMIC.QueryROI.H', 0.0), ('NOMIC.QueryROI.W', 0.0)])
-      pi.setINDI(qroi)
-      qroi = pi.getINDI('NOMIC.QueryROI.ROIID', 'NOMIC.QueryROI.X', 'NOMIC.QueryROI.Y', 'NOMIC.QueryROI.H', 'NOMIC.QueryROI.W')
-      droi = dict([('NOMIC.DefROI.ROIID', ROIIDs[i]), ('NOMIC.DefROI.X', qroi['NOMIC.QueryROI.X']), ('NOMIC.DefROI.Y', qroi['NOMIC.QueryROI.Y'] + sign * ROI_nod), ('NOMIC.DefROI.H', qroi['NOMIC.QueryROI.H']), ('NOMIC.DefROI.W', qroi['NOMIC.QueryROI.W'])])
-      pi.setINDI(droi)
-      
-    
+    actions.append(('PHASECAM beam 2', _set_plc_settings, (settings,)))
+    actions.append(('NOMIC ROIs', _move_rois, (sign * np.int(cfg['nod_throw'] / 0.018),)))   # Nodding offset in pix
+  run_parallel(actions)
+  if (side == 'both') and (move_tel == True):   # the telescope only moved with move_tel
+    global nod_offset
+    nod_offset = nod_offset + sign * cfg['nod_throw']
+  
   print('')
   info('Nod finished.')
   print('')
 
 
+def _move_opw(opw_pos):
+  """
+  Moves the PHASECAM pupil wheel (NIL_OPW) and waits until it is there.
+  """
+  pi.setINDI('Warm.NIL_OPW.command', '%i' % (opw_pos), timeout=60, wait=True)
+
+
+def _offset_telescope(offset_y, side):
+  """
+  Offsets the telescope side(s) in detector y and waits until the offset
+  is done.
+  """
+  pi.setINDI('LBTO.OffsetPointing.CoordSys', 'DETXY', 'LBTO.OffsetPointing.OffsetX', 0, 'LBTO.OffsetPointing.OffsetY', offset_y, 'LBTO.OffsetPointing.Side', side, 'LBTO.OffsetPointing.Type', 'REL', timeout=60, wait=True)
+
+
+def _set_plc_settings(settings):
+  """
+  Sends a (modified) PLC settings dictionary, e.g., to move beam 2.
+  """
+  pi.setINDI(settings)
+
+
+def _move_rois(ROI_nod):
+  """
+  Moves the NOMIC ROIs 1, 2, and 3 by ROI_nod pixels in y, using the
+  client-side ROI registry (re-synced if the ROIs were moved by hand,
+  one ROI is compared per nod).
+  """
+  nomic_rois.check()
+  nomic_rois.offset(dy=ROI_nod)
+  nomic_rois.push()
+
+
+@profiled
 def offset_background(cfg, off_dir):
   """
   Offsets the telescope pointing to take a background with the target
@@ -142,33 +172,23 @@ def offset_background(cfg, off_dir):
     sign = -1
   
   # Get DIT as set by operator.
-  DIT = pi.getINDI('NOMIC.CamInfo.IntTime')
+  DIT = nomic_state.sync()['NOMIC.CamInfo.IntTime']
   
   # Take a background (and repeat to make sure it is a good one)
-  # Set camera in safe state.
-  pi.setINDI('NOMIC.Command.text', '0 contacq', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  
-  # Set up camera for integration.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '%f %i %i lbtintpar' % (DIT, 1, 1), wait=True)
-  
-  # Integrate.
-  sleep(0.3)
-  pi.setINDI('NOMIC.Command.text', 'go', timeout=50000, wait=True)
-  
-  # Use background.
-  pi.setINDI('NOMIC.Command.text', 'rawbg', timeout=50000, wait=True)
-  
-  # Set camera in continuous.
-  pi.setINDI('NOMIC.Command.text', '0 savedata', wait=True)
-  pi.setINDI('NOMIC.Command.text', '0 loglevel', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 autodispwhat', wait=True)
-  pi.setINDI('NOMIC.Command.text', '1 contacq', wait=True)
+  # Set camera in safe state and set up camera for integration (changes only).
+  nomic_state.set('contacq', 0).set('loglevel', 0)
+  nomic_state.set('savedata', 0).set('autodispwhat', 1).lbtintpar(DIT, 1, 1)
+  changed = nomic_state.flush()
+  
+  # Integrate
+  if changed:
+    sleep(0.3)
+  nomic_state.send('go', timeout=50000)
+  
+  # Use background and set camera in continuous.
+  nomic_state.add('rawbg')
+  nomic_state.set('savedata', 0).set('loglevel', 0).set('autodispwhat', 1).set('contacq', 1)
+  nomic_state.flush(timeout=50000)
   
   # Open phase loop
   pi.setINDI('PLC.CloseLoop.Yes=Off')
@@ -177,14 +197,7 @@ def offset_background(cfg, off_dir):
   pi.setINDI('LBTO.OffsetPointing.CoordSys', 'DETXY', 'LBTO.OffsetPointing.OffsetX', 0, 'LBTO.OffsetPointing.OffsetY', (sign * cfg['off_throw']), 'LBTO.OffsetPointing.Side', 'both', 'LBTO.OffsetPointing.Type', 'REL', wait=False)
   
   # Wait for AO loop to be closed
-  i = 0
-  while not (pi.getINDI('LBTO.AOStatus.L_AOStatus') == 'AORunning') or not (pi.getINDI('LBTO.AOStatus.R_AOStatus') == 'AORunning'):
-    i = i + 1
-    if i < 10:
-      print('  Waiting for AO loop(s) to close ...')
-    if i == 10:
-      print('  AO loop(s) still open, continue waiting quietly ...')
-    sleep(1.0)
+  wait_ao_running(report=waiting_report('  Waiting for AO loop(s) to close ...', '  AO loop(s) still open, continue waiting quietly ...', 10))
   print('AO loops closed.')
   
   print('')
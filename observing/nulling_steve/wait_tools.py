@@ -0,0 +1,129 @@
+from pyindi import *
+import re
+import time
+
+from session_tools import pi
+
+def wait_eval(expression, timeout=None, step=1.0, report=None):
+  """
+  Waits until an INDI expression (as understood by evalINDI) is true.
+  The expression is evaluated on the server, which answers as soon as it
+  becomes true, so there is no polling delay and no extra load on the
+  server. The wait is split into steps of 'step' seconds; report(i)
+  is called (if provided) after the i-th step expired. Returns True
+  when the expression is true, False if 'timeout' seconds (None for
+  no limit) passed. Errors other than the evalINDI timeout (e.g., a
+  lost connection or a malformed expression) are raised.
+
+  Usage:
+   >> wait_eval('"PLC.CloseLoop.Yes" == 1', timeout=60)
+  """
+  t0 = time.time()
+  i = 0
+  while True:
+    this_step = step
+    if timeout is not None:
+      this_step = min(step, timeout - (time.time() - t0))
+      if this_step <= 0.0:
+        return False
+    t_step = time.time()
+    try:
+      pi.evalINDI(expression, timeout=this_step)
+      return True
+    except Exception, error:
+      if not _timed_out(error, time.time() - t_step, this_step):
+        raise        # e.g., lost connection or malformed expression, waiting longer would not help
+      i = i + 1      # evalINDI timed out, the expression is still false
+      if report is not None:
+        report(i)
+
+
+def _timed_out(error, elapsed, timeout):
+  # pyindi raises a plain Exception on an evalINDI timeout, tell it apart
+  # from other errors by its message or by having waited the full timeout
+  if re.search(r'time[sd]?\s*-?\s*out', str(error), re.IGNORECASE):
+    return True
+  return elapsed >= 0.9 * timeout
+
+
+def wait_for(test, timeout=None, poll=0.1, report=None, report_every=1.0):
+  """
+  Waits until test() returns True, calling it every 'poll' seconds. Use
+  this only for conditions evalINDI can not evaluate on the server
+  (e.g. text properties). report(i) is called (if provided) every
+  'report_every' seconds. Returns True when the condition is met, False
+  if 'timeout' seconds (None for no limit) passed.
+
+  Usage:
+   >> wait_for(ao_loops_running, timeout=60)
+  """
+  t0 = time.time()
+  t_report = t0 + report_every
+  i = 0
+  while not test():
+    now = time.time()
+    if (timeout is not None) and (now - t0 >= timeout):
+      return False
+    if (report is not None) and (now >= t_report):
+      i = i + 1
+      t_report = t_report + report_every
+      report(i)
+    time.sleep(poll)
+  return True
+
+
+def waiting_report(loud, quiet, n_loud):
+  """
+  Returns a report function for wait_eval/wait_for which prints 'loud'
+  for the first n_loud - 1 calls, then 'quiet' once, then nothing.
+
+  Usage:
+   >> report = waiting_report('  Loop open, waiting ...', '  Waiting quietly ...', 5)
+  """
+  def report(i):
+    if i < n_loud:
+      print(loud)
+    if i == n_loud:
+      print(quiet)
+  return report
+
+
+def phase_loop_closed():
+  """
+  Returns True if the phase loop is closed.
+  """
+  return bool(pi.getINDI('PLC.CloseLoop.Yes'))
+
+
+def ao_loops_running():
+  """
+  Returns True if the AO loops on both sides are running. Reads both
+  sides in one request.
+  """
+  status = pi.getINDI('LBTO.AOStatus.*')
+  return (status['LBTO.AOStatus.L_AOStatus'] == 'AORunning') and (status['LBTO.AOStatus.R_AOStatus'] == 'AORunning')
+
+
+def wait_phase_loop_closed(timeout=None, report=None):
+  """
+  Waits for the phase loop to be closed. The condition is evaluated on
+  the server (evalINDI), so this returns within milliseconds after the
+  loop closed. Returns True if the loop is closed, False on timeout.
+
+  Usage:
+   >> wait_phase_loop_closed()
+  """
+  return wait_eval('"PLC.CloseLoop.Yes" == 1', timeout=timeout, report=report)
+
+
+def wait_ao_running(timeout=None, report=None, poll=0.1):
+  """
+  Waits for the AO loops on both sides to be running. The AO status is
+  a text property which evalINDI can not compare, so it is polled with
+  one request (both sides) every 'poll' seconds. Returns True if both
+  loops are running, False on timeout.
+
+  Usage:
+   >> wait_ao_running()
+  """
+  return wait_for(ao_loops_running, timeout=timeout, poll=poll, report=report)